@@ -0,0 +1,69 @@
+'''Measures model attribute get/set, with and without compiled accessors.
+Compiled accessors should make plain gets and sets at least `target` times
+faster (serialized values are dominated by the serializer).
+
+    python benchmarks/bench_attributes.py
+'''
+
+import json
+
+from datastore.objects import Attribute
+from datastore.objects import Model
+
+from records import per_call
+
+
+def model_classes(compiled):
+  class Plain(Model):
+    __compile_attributes__ = compiled
+    name = Attribute(default='')
+    count = Attribute(data_type=int, default=0)
+
+  class Serialized(Model):
+    __compile_attributes__ = compiled
+    name = Attribute(default='', serializer=json)
+
+  return Plain, Serialized
+
+
+target = 3.0
+
+
+def run(number=200000):
+  print '%-10s %-16s %12s %12s %8s' % ('accessors', 'operation', 'us',
+      'speedup', 'target')
+  baseline = {}
+  for compiled in [False, True]:
+    Plain, Serialized = model_classes(compiled)
+    plain = Plain('bench')
+    plain.name = 'name'
+    serialized = Serialized('bench')
+    serialized.name = 'name'
+
+    def set_name():
+      plain.name = 'other'
+
+    def set_count():
+      plain.count = 5
+
+    operations = [
+      ('get', lambda: plain.name),
+      ('get default', lambda: plain.count),
+      ('get json', lambda: serialized.name),
+      ('set', set_name),
+      ('set int', set_count),
+    ]
+
+    label = 'compiled' if compiled else 'attribute'
+    for operation, fn in operations:
+      us = per_call(fn, number)
+      speedup = baseline.setdefault(operation, us) / us
+      met = ''
+      if compiled and 'json' not in operation:
+        met = 'met' if speedup >= target else 'MISSED'
+      print '%-10s %-16s %12.3f %11.1fx %8s' % (label, operation, us, speedup,
+          met)
+
+
+if __name__ == '__main__':
+  run()
@@ -0,0 +1,57 @@
+'''Measures loading records through Manager.put_many and BulkLoader.
+
+    python benchmarks/bench_bulk_load.py [count] [workers]
+'''
+
+import json
+import sys
+import time
+
+import datastore
+from datastore.objects import Attribute
+from datastore.objects import BulkLoader
+from datastore.objects import Manager
+from datastore.objects import Model
+
+
+class Sample(Model):
+  count = Attribute(data_type=int, default=0)
+  ratio = Attribute(data_type=float, default=0.0)
+  label = Attribute(required=True)
+  tags = Attribute(data_type=list, serializer=json)
+
+
+def records(count):
+  for i in xrange(count):
+    yield {'key': str(i), 'count': i, 'ratio': i / 3.0,
+        'label': 'label%d' % (i % 10), 'tags': ['a', 'b']}
+
+
+def timed(fn):
+  start = time.time()
+  result = fn()
+  return time.time() - start, result
+
+
+def run(count=100000, workers=1):
+  def put_many():
+    manager = Manager(datastore.DictDatastore(), model=Sample)
+    def instances():
+      for record in records(count):
+        instance = Sample(record['key'])
+        instance.updateAttributes(record)
+        yield instance
+    manager.put_many(instances())
+
+  def bulk_load():
+    manager = Manager(datastore.DictDatastore(), model=Sample)
+    return BulkLoader(manager, workers=workers).load(records(count))
+
+  print '%-10s %10s %10s' % ('path', 'seconds', 'us/record')
+  for name, fn in [('put_many', put_many), ('bulk_load', bulk_load)]:
+    seconds, _ = timed(fn)
+    print '%-10s %10.3f %10.2f' % (name, seconds, seconds / count * 1e6)
+
+
+if __name__ == '__main__':
+  run(*map(int, sys.argv[1:]))
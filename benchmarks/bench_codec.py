@@ -0,0 +1,69 @@
+'''Compares storing a narrow model as JSON dicts (through a serializer) with
+RecordCodec records: size per record, and time to get and query instances.
+
+    python benchmarks/bench_codec.py
+'''
+
+import json
+
+import datastore
+
+from datastore.core.serialize import SerializerShimDatastore
+
+from datastore.objects import Attribute
+from datastore.objects import Model
+from datastore.objects import ObjectDatastore
+from datastore.objects.record_codec import RecordCodec
+
+from records import per_call
+
+
+class Reading(Model):
+  sensor = Attribute()
+  value = Attribute(data_type=float)
+  count = Attribute(data_type=int)
+  unit = Attribute()
+  valid = Attribute(data_type=bool)
+
+
+def reading(i):
+  instance = Reading('r%d' % i)
+  instance.sensor = 'sensor%d' % (i % 50)
+  instance.value = i * 0.25
+  instance.count = i
+  instance.unit = 'celsius'
+  instance.valid = bool(i % 2)
+  return instance
+
+
+def run(size=1000, number=5000):
+  dds = datastore.DictDatastore()
+  json_ods = ObjectDatastore(SerializerShimDatastore(dds, serializer=json),
+      model=Reading, isolation='copy')
+  cds = datastore.DictDatastore()
+  codec_ods = ObjectDatastore(cds, model=Reading, codec=RecordCodec(Reading))
+
+  for i in range(size):
+    instance = reading(i)
+    json_ods.put(instance.key, instance)
+    codec_ods.put(instance.key, instance)
+
+  key = Reading.key.instance('r1')
+  query = datastore.Query(Reading.key)
+  json_bytes = sum(len(dds.get(reading(i).key)) for i in range(size))
+  codec_bytes = sum(len(cds.get(reading(i).key)) for i in range(size))
+
+  print '%-12s %12s %12s %12s %14s' % ('storage', 'bytes/rec', 'put us',
+      'get us', 'query us/rec')
+  for name, ods, total in [('json', json_ods, json_bytes),
+      ('codec', codec_ods, codec_bytes)]:
+    instance = reading(1)
+    put = per_call(lambda: ods.put(key, instance), number)
+    get = per_call(lambda: ods.get(key), number)
+    query_all = per_call(lambda: list(ods.query(query)), 5)
+    print '%-12s %12.1f %12.2f %12.2f %14.2f' % (name, total / float(size),
+        put, get, query_all / size)
+
+
+if __name__ == '__main__':
+  run()
@@ -0,0 +1,59 @@
+'''Measures aggregating an attribute over query results, from model instances
+and from Manager.query_columns arrays.
+
+    python benchmarks/bench_columns.py [count]
+'''
+
+import sys
+import time
+
+import datastore
+from datastore.objects import Attribute
+from datastore.objects import Manager
+from datastore.objects import Model
+
+
+class Sample(Model):
+  count = Attribute(data_type=int, default=0)
+  ratio = Attribute(data_type=float, default=0.0)
+  label = Attribute()
+
+
+def populate(count):
+  manager = Manager(datastore.DictDatastore(), model=Sample)
+  child = manager.datastore.child_datastore
+  for i in xrange(count):
+    key = Sample.key.instance(str(i))
+    child.put(key, {'key': str(key), 'count': i, 'ratio': i / 3.0,
+        'label': 'label%d' % (i % 10)})
+  return manager
+
+
+def timed(fn):
+  start = time.time()
+  result = fn()
+  return time.time() - start, result
+
+
+def run(count=200000):
+  manager = populate(count)
+  query = manager.init_query()
+
+  def instances():
+    total = 0
+    for sample in manager.query(query):
+      total += sample.count * sample.ratio
+    return total
+
+  def columns():
+    arrays = manager.query_columns(query, ['count', 'ratio'])
+    return (arrays['count'] * arrays['ratio']).sum()
+
+  print '%-10s %10s %10s' % ('path', 'seconds', 'us/object')
+  for name, fn in [('instances', instances), ('columns', columns)]:
+    seconds, total = timed(fn)
+    print '%-10s %10.3f %10.2f' % (name, seconds, seconds / count * 1e6)
+
+
+if __name__ == '__main__':
+  run(*map(int, sys.argv[1:]))
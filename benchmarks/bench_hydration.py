@@ -0,0 +1,55 @@
+'''Measures constructing model instances from stored data, with withData and
+withStoredData (constructing instances, or trusting the data), and through
+ObjectDatastore.get and query.
+
+    python benchmarks/bench_hydration.py
+'''
+
+import datastore
+
+from datastore.objects import Attribute
+from datastore.objects import Model
+from datastore.objects import ObjectDatastore
+
+from records import per_call
+
+
+def model_class(width, compact=False, trusted=False):
+  attrs = dict(('field%d' % i, Attribute()) for i in range(width))
+  attrs['__compact__'] = compact
+  attrs['__trusted_hydration__'] = trusted
+  return type('Record', (Model,), attrs)
+
+
+def run(number=5000):
+  print '%-6s %-8s %12s %12s %12s %12s %12s' % ('width', 'layout',
+      'withData', 'stored', 'trusted', 'get', 'query/obj')
+  for width in [5, 20, 100]:
+    for compact in [False, True]:
+      Record = model_class(width, compact)
+      key = Record.key.instance('bench')
+      record = dict(('field%d' % i, 'value%d' % i) for i in range(width))
+      record['key'] = str(key)
+
+      with_data = per_call(lambda: Record.withData(record), number)
+      stored = per_call(lambda: Record.withStoredData(dict(record)), number)
+      Trusted = model_class(width, compact, trusted=True)
+      trusted = per_call(lambda: Trusted.withStoredData(dict(record)), number)
+
+      dds = datastore.DictDatastore()
+      ods = ObjectDatastore(dds, model=Record, isolation='copy')
+      for i in range(100):
+        ikey = Record.key.instance(str(i))
+        dds.put(ikey, dict(record, key=str(ikey)))
+      first = Record.key.instance('0')
+      get = per_call(lambda: ods.get(first), number)
+      query = datastore.Query(Record.key)
+      query_all = per_call(lambda: list(ods.query(query)), number / 100)
+
+      layout = 'compact' if compact else 'dict'
+      print '%-6d %-8s %12.2f %12.2f %12.2f %12.2f %12.2f' % (width, layout,
+          with_data, stored, trusted, get, query_all / 100)
+
+
+if __name__ == '__main__':
+  run()
@@ -0,0 +1,31 @@
+'''Measures ObjectDatastore get/put cost for each isolation mode.
+
+    python benchmarks/bench_isolation.py
+'''
+
+import datastore
+
+from datastore.objects import Key
+from datastore.objects import ObjectDatastore
+
+from records import per_call
+from records import shapes
+
+
+def run(number=2000):
+  print '%-8s %-10s %12s %12s' % ('shape', 'isolation', 'get (us)', 'put (us)')
+  for shape, make_record in shapes:
+    for isolation in ObjectDatastore.isolation_modes:
+      dds = datastore.DictDatastore()
+      ods = ObjectDatastore(dds, isolation=isolation)
+      key = Key('/model:bench')
+      dds.put(key, make_record(key))
+      instance = ods.get(key)
+
+      get = per_call(lambda: ods.get(key), number)
+      put = per_call(lambda: ods.put(key, instance), number)
+      print '%-8s %-10s %12.2f %12.2f' % (shape, isolation, get, put)
+
+
+if __name__ == '__main__':
+  run()
@@ -0,0 +1,54 @@
+'''Measures the memory and speed of model instances, with and without compact
+storage (Model.__compact__).
+
+    python benchmarks/bench_memory.py
+
+Sizes count the instance and its containers, not the values they hold, which
+both layouts share.
+'''
+
+import sys
+
+from datastore.objects import Attribute
+from datastore.objects import Model
+
+from records import per_call
+
+
+def model_class(width, compact):
+  attrs = dict(('field%d' % i, Attribute()) for i in range(width))
+  attrs['__compact__'] = compact
+  return type('Record', (Model,), attrs)
+
+
+def instance_size(instance):
+  '''Returns the bytes taken by `instance`, its __dict__ and its data.'''
+  size = sys.getsizeof(instance) + sys.getsizeof(instance.__dict__)
+  if '_values' in instance.__dict__:
+    size += sys.getsizeof(instance._values)
+    if instance._values[-1] is not None:
+      size += sys.getsizeof(instance._values[-1])
+  else:
+    size += sys.getsizeof(instance.data)
+  return size
+
+
+def run(number=20000):
+  print '%-6s %-8s %10s %10s %10s' % ('width', 'layout', 'bytes', 'get us',
+      'load us')
+  for width in [5, 20, 100]:
+    record = dict(('field%d' % i, 'value%d' % i) for i in range(width))
+    record['key'] = '/record:bench'
+
+    for compact in [False, True]:
+      Record = model_class(width, compact)
+      instance = Record.withData(record)
+      label = 'compact' if compact else 'dict'
+      print '%-6d %-8s %10d %10.3f %10.3f' % (width, label,
+          instance_size(instance),
+          per_call(lambda: instance.field0, number * 10),
+          per_call(lambda: Record.withData(record), number / width + 1))
+
+
+if __name__ == '__main__':
+  run()
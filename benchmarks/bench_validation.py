@@ -0,0 +1,59 @@
+'''Compares validating attribute values when set with deferred validation
+(see Model.validate), and checking records with Model.validate_many.
+
+    python benchmarks/bench_validation.py
+'''
+
+import datastore
+
+from datastore.objects import Attribute
+from datastore.objects import Manager
+from datastore.objects import Model
+
+from records import per_call
+
+
+def model_class(width, deferred):
+  attrs = dict(('field%d' % i, Attribute(data_type=int if i % 2 else str))
+      for i in range(width))
+  attrs['__deferred_validation__'] = deferred
+  return type('Record', (Model,), attrs)
+
+
+def record(width, i=0):
+  return dict(('field%d' % f, f + i if f % 2 else 'value%d' % f)
+      for f in range(width))
+
+
+def run(number=2000, size=1000):
+  print '%-6s %-9s %14s %12s %12s' % ('width', 'mode', 'construct us',
+      'put us', 'check us/rec')
+  for width in [5, 20, 100]:
+    values = record(width)
+    records = [dict(record(width, i), key='r%d' % i) for i in range(size)]
+    for deferred in [False, True]:
+      Record = model_class(width, deferred)
+      manager = Manager(datastore.DictDatastore(), model=Record,
+          isolation='copy')
+
+      def construct():
+        instance = Record('bench')
+        instance.updateAttributes(values)
+        instance.validate()
+        return instance
+
+      construct_us = per_call(construct, number)
+      put_us = per_call(lambda: manager.put(construct()), number)
+      if deferred:
+        check = lambda: Record.validate_many(records)
+      else:
+        check = lambda: [Record('r').updateAttributes(r) for r in records]
+      check_us = per_call(check, 5) / size
+
+      mode = 'deferred' if deferred else 'eager'
+      print '%-6d %-9s %14.2f %12.2f %12.2f' % (width, mode, construct_us,
+          put_us, check_us)
+
+
+if __name__ == '__main__':
+  run()
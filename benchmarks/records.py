@@ -0,0 +1,41 @@
+'''Record shapes shared by the benchmarks.'''
+
+import timeit
+
+
+def small_record(key):
+  '''A record with a handful of short string fields.'''
+  data = dict(('field%d' % i, 'value%d' % i) for i in range(5))
+  data['key'] = str(key)
+  return data
+
+
+def wide_record(key, width=200):
+  '''A record with `width` short string fields.'''
+  data = dict(('field%d' % i, 'value%d' % i) for i in range(width))
+  data['key'] = str(key)
+  return data
+
+
+def nested_record(key, depth=5, breadth=4):
+  '''A record whose values are dicts and lists nested `depth` levels deep.'''
+  def nested(level):
+    if level == 0:
+      return ['leaf%d' % i for i in range(breadth)]
+    return dict(('level%d_%d' % (level, i), nested(level - 1))
+        for i in range(breadth))
+
+  return {'key': str(key), 'field0': 'value0', 'nested': nested(depth)}
+
+
+shapes = [
+  ('small', small_record),
+  ('wide', wide_record),
+  ('nested', nested_record),
+]
+
+
+def per_call(fn, number):
+  '''Returns the best time, in microseconds, of one call to `fn`.'''
+  times = timeit.repeat(fn, number=number, repeat=3)
+  return min(times) / number * 1e6
@@ -0,0 +1,299 @@
+'''Benchmark suite for the object-mapping hot paths, with machine-readable
+results.
+
+    python benchmarks/suite.py [--output results.json] [--filter text]
+        [--compare baseline.json] [--threshold 0.2] [--quick]
+
+Each benchmark measures one operation for some parameters (record width,
+nesting depth, collection size), as the best of 3 repeats, in microseconds
+per call. Results are written as JSON:
+
+    {"python": "2.7.18", "time": ..., "results": [
+      {"name": "model.withData", "params": {"width": 5}, "us": 21.4}, ...]}
+
+With --compare, results are matched to those in a baseline file (by name and
+params), and any more than --threshold slower (default: 20%) is reported as
+a regression, making the exit status 1.
+'''
+
+import json
+import sys
+import time
+import argparse
+import platform
+
+import datastore
+
+from datastore.objects import Attribute
+from datastore.objects import Key
+from datastore.objects import Manager
+from datastore.objects import Model
+from datastore.objects import ObjectDatastore
+from datastore.objects.collection import Collection
+
+from records import per_call
+
+
+widths = [5, 20, 100]
+depths = [0, 2, 4]
+sizes = [100, 1000]
+
+
+def model_class(width, serializer=None):
+  attrs = dict(('field%d' % i, Attribute(serializer=serializer))
+      for i in range(width))
+  return type('Record', (Model,), attrs)
+
+
+def nested_value(depth, breadth=3):
+  '''A dict of lists nested `depth` levels deep.'''
+  if depth == 0:
+    return ['leaf%d' % i for i in range(breadth)]
+  return dict(('level%d_%d' % (depth, i), nested_value(depth - 1, breadth))
+      for i in range(breadth))
+
+
+def record_for(Record, name, depth=0):
+  key = Record.key.instance(name)
+  data = dict((attr.name, 'value%d' % i)
+      for i, attr in enumerate(Record._attributes.values()))
+  if depth:
+    data['field0'] = nested_value(depth)
+  data['key'] = str(key)
+  return key, data
+
+
+# benchmarks: each yields `(params, fn, number)` to time
+
+def bench_attribute_get():
+  for serializer in [None, json]:
+    Record = model_class(5, serializer)
+    instance = Record('bench')
+    instance.field0 = 'value'
+    params = {'serializer': 'json' if serializer else 'none'}
+    yield params, lambda: instance.field0, 100000
+
+
+def bench_attribute_set():
+  for serializer in [None, json]:
+    Record = model_class(5, serializer)
+    instance = Record('bench')
+    def set_attribute():
+      instance.field0 = 'value'
+    params = {'serializer': 'json' if serializer else 'none'}
+    yield params, set_attribute, 50000
+
+
+def bench_model_init():
+  for width in widths:
+    Record = model_class(width)
+    yield {'width': width}, lambda: Record('bench'), 5000
+
+
+def bench_model_with_data():
+  for width in widths:
+    Record = model_class(width)
+    key, data = record_for(Record, 'bench')
+    yield {'width': width}, lambda: Record.withData(data), 5000
+
+
+def bench_model_with_stored_data():
+  for width in widths:
+    Record = model_class(width)
+    key, data = record_for(Record, 'bench')
+    yield {'width': width}, lambda: Record.withStoredData(dict(data)), 5000
+
+
+def bench_metaclass_create():
+  for width in widths:
+    yield {'width': width}, lambda: model_class(width), 200
+
+
+def _object_datastore(width, depth):
+  Record = model_class(width)
+  ods = ObjectDatastore(datastore.DictDatastore(), model=Record)
+  key, data = record_for(Record, 'bench', depth)
+  ods.child_datastore.put(key, data)
+  return Record, ods, key
+
+
+def bench_object_datastore_get():
+  for width in widths:
+    for depth in depths:
+      Record, ods, key = _object_datastore(width, depth)
+      yield {'width': width, 'depth': depth}, lambda: ods.get(key), 2000
+
+
+def bench_object_datastore_put():
+  for width in widths:
+    for depth in depths:
+      Record, ods, key = _object_datastore(width, depth)
+      instance = ods.get(key)
+      yield ({'width': width, 'depth': depth},
+          lambda: ods.put(key, instance), 2000)
+
+
+def bench_object_datastore_query():
+  '''Per instance, querying a collection of `size`.'''
+  for width in widths:
+    for size in sizes:
+      Record, ods, key = _object_datastore(width, 0)
+      for i in range(size):
+        ikey, data = record_for(Record, str(i))
+        ods.child_datastore.put(ikey, data)
+      query = datastore.Query(Record.key)
+      def query_all():
+        for instance in ods.query(query):
+          pass
+      yield {'width': width, 'size': size}, query_all, max(2, 2000 / size)
+
+
+def bench_manager_get():
+  for width in widths:
+    Record = model_class(width)
+    manager = Manager(datastore.DictDatastore(), model=Record)
+    key, data = record_for(Record, 'bench')
+    manager.datastore.child_datastore.put(key, data)
+    yield {'width': width}, lambda: manager.get(key), 2000
+
+
+def bench_manager_put():
+  for width in widths:
+    Record = model_class(width)
+    manager = Manager(datastore.DictDatastore(), model=Record)
+    key, data = record_for(Record, 'bench')
+    instance = Record.withData(data)
+    def put():
+      # a modified instance, as managers writing changes only skip clean ones.
+      instance.field0 = 'value'
+      manager.put(instance)
+    yield {'width': width}, put, 2000
+
+
+def _collection(size):
+  coll = Collection(Key('/bench'), datastore.DictDatastore())
+  ods = ObjectDatastore(coll.directory_datastore)
+  for i in range(size):
+    instance = Model('m%d' % i)
+    ods.put(instance.key, instance)
+    coll.add(instance)
+  return coll
+
+
+def bench_collection_add_remove():
+  '''Adding and removing a member of a collection of `size`.'''
+  for size in sizes:
+    coll = _collection(size)
+    member = Model('new')
+    def add_remove():
+      coll.add(member)
+      coll.remove(member)
+    yield {'size': size}, add_remove, max(5, 5000 / size)
+
+
+def bench_collection_instances():
+  '''Per instance, iterating a collection of `size`.'''
+  for size in sizes:
+    coll = _collection(size)
+    def instances():
+      for instance in coll.instances:
+        pass
+    yield {'size': size}, instances, max(2, 1000 / size)
+
+
+benchmarks = [
+  ('attribute.get', bench_attribute_get),
+  ('attribute.set', bench_attribute_set),
+  ('model.init', bench_model_init),
+  ('model.withData', bench_model_with_data),
+  ('model.withStoredData', bench_model_with_stored_data),
+  ('metaclass.create', bench_metaclass_create),
+  ('object_datastore.get', bench_object_datastore_get),
+  ('object_datastore.put', bench_object_datastore_put),
+  ('object_datastore.query', bench_object_datastore_query),
+  ('manager.get', bench_manager_get),
+  ('manager.put', bench_manager_put),
+  ('collection.add_remove', bench_collection_add_remove),
+  ('collection.instances', bench_collection_instances),
+]
+
+# benchmarks timing a call over a whole collection, reported per member.
+per_member = set(['object_datastore.query', 'collection.instances'])
+
+
+def run(name_filter=None, quick=False):
+  '''Returns the results of the benchmarks whose name contains
+  `name_filter`.'''
+  results = []
+  for name, bench in benchmarks:
+    if name_filter and name_filter not in name:
+      continue
+
+    for params, fn, number in bench():
+      if quick:
+        number = max(1, number / 10)
+      us = per_call(fn, number)
+      if name in per_member:
+        us /= params['size']
+      results.append({'name': name, 'params': params, 'us': round(us, 3)})
+      print >> sys.stderr, '%-24s %-32s %10.2f us' % (name,
+          json.dumps(params, sort_keys=True), us)
+  return results
+
+
+def result_id(result):
+  return result['name'], json.dumps(result['params'], sort_keys=True)
+
+
+def compare(results, baseline, threshold):
+  '''Returns `(result, baseline_us)` for results slower than in `baseline` by
+  more than `threshold` (a fraction).'''
+  baseline = dict((result_id(result), result['us']) for result in baseline)
+  regressions = []
+  for result in results:
+    before = baseline.get(result_id(result))
+    if before and result['us'] > before * (1 + threshold):
+      regressions.append((result, before))
+  return regressions
+
+
+def main(argv):
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  parser.add_argument('--output', help='file to write JSON results to')
+  parser.add_argument('--filter', help='run benchmarks with names containing'
+      ' this text')
+  parser.add_argument('--compare', help='baseline JSON results to compare to')
+  parser.add_argument('--threshold', type=float, default=0.2,
+      help='slowdown over the baseline reported as a regression')
+  parser.add_argument('--quick', action='store_true',
+      help='make fewer calls (noisier results)')
+  args = parser.parse_args(argv)
+
+  output = {
+    'python': platform.python_version(),
+    'platform': platform.platform(),
+    'time': time.time(),
+    'results': run(args.filter, args.quick),
+  }
+
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump(output, f, indent=2, sort_keys=True)
+  else:
+    print json.dumps(output, indent=2, sort_keys=True)
+
+  if args.compare:
+    with open(args.compare) as f:
+      baseline = json.load(f)['results']
+    regressions = compare(output['results'], baseline, args.threshold)
+    for result, before in regressions:
+      print >> sys.stderr, 'REGRESSION %s %s: %.2f us (was %.2f us)' % (
+          result['name'], json.dumps(result['params'], sort_keys=True),
+          result['us'], before)
+    if regressions:
+      return 1
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
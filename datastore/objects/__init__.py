@@ -19,4 +19,13 @@ from .attribute import Attribute
 from .model import Key
 from .model import Model
 from .manager import Manager
+from .query_plan import QueryPlan
+from .bulk_loader import BulkLoader
+from .exporter import Exporter
+from .identity_map import IdentityMap
+from .key_cache import KeyCache
+from .instrumentation import Instrumentation
 from .object_datastore import ObjectDatastore
+from .record_codec import RecordCodec
+from .async_manager import AsyncManager
+from .async_object_datastore import AsyncObjectDatastore
@@ -0,0 +1,131 @@
+from multiprocessing.pool import ThreadPool
+
+from .manager import Manager
+from .util import prefetch
+
+
+class AsyncManager(object):
+  '''Non-blocking interface to a Manager.
+
+  It mirrors the Manager API, but every call returns immediately with a
+  multiprocessing.pool.AsyncResult: `result.get()` waits for and returns the
+  value. Calls run the wrapped manager's methods in a pool of `workers`
+  threads, which bounds how many run at once.
+
+  `query` (and `instances`, when wrapping a CollectionManager) return
+  iterators whose results are fetched in the background, up to `read_ahead`
+  ahead of the consumer.
+
+  For example:
+
+      >>> mgr = AsyncManager(ds, model=Scientist)
+      >>> results = [mgr.get(name) for name in ['Tesla', 'Curie']]
+      >>> [result.get().key for result in results]
+      [Key('/scientist:Tesla'), Key('/scientist:Curie')]
+
+  Other keyword arguments are passed on to the wrapped Manager.
+  '''
+
+  # the manager class to wrap.
+  Manager = Manager
+
+  # number of threads running manager calls.
+  workers = 8
+
+  # number of query results fetched ahead of the consumer.
+  read_ahead = 100
+
+  def __init__(self, datastore, model=None, workers=None, read_ahead=None,
+      **kwargs):
+    if workers:
+      self.workers = int(workers)
+    if read_ahead:
+      self.read_ahead = int(read_ahead)
+
+    self.manager = self.Manager(datastore, model=model, **kwargs)
+    self.pool = ThreadPool(self.workers)
+
+
+  @property
+  def model(self):
+    return self.manager.model
+
+
+  def key(self, key_or_name):
+    '''Coerces `key_or_name` to be a proper model Key (synchronously).'''
+    return self.manager.key(key_or_name)
+
+
+  def contains(self, key):
+    '''Returns whether manager contains instance named by `key_or_name`.'''
+    return self._call(self.manager.contains, key)
+
+
+  def get(self, key):
+    '''Retrieves instance named by `key_or_name`.'''
+    return self._call(self.manager.get, key)
+
+
+  def put(self, instance):
+    '''Stores given `instance`.'''
+    return self._call(self.manager.put, instance)
+
+
+  def delete(self, key_or_name):
+    '''Deletes instance named by `key_or_name`.'''
+    return self._call(self.manager.delete, key_or_name)
+
+
+  def get_many(self, keys):
+    '''Retrieves a list with the instance named by each of `keys`.'''
+    return self._call(self.manager.get_many, list(keys))
+
+
+  def put_many(self, instances):
+    '''Stores all given `instances`.'''
+    return self._call(self.manager.put_many, list(instances))
+
+
+  def delete_many(self, keys):
+    '''Deletes the instances named by each of `keys`.'''
+    return self._call(self.manager.delete_many, list(keys))
+
+
+  def init_query(self):
+    '''Initiates a Query object for the model'''
+    return self.manager.init_query()
+
+
+  def query(self, query):
+    '''Returns an iterator of the instances matching `query`, which are
+    fetched in the background.
+    '''
+    return self._iterate(lambda: self.manager.query(query))
+
+
+  @property
+  def instances(self):
+    '''Iterator of the wrapped CollectionManager's instances, which are
+    fetched in the background.
+    '''
+    return self._iterate(lambda: self.manager.instances)
+
+
+  def close(self):
+    '''Stops accepting calls. Pending calls still complete.'''
+    self.pool.close()
+
+
+  def _call(self, method, *args):
+    return self.pool.apply_async(method, args)
+
+
+  def _iterate(self, iterable_fn):
+    '''Returns a prefetching iterator over the iterable `iterable_fn` returns,
+    calling it in the background too.'''
+    def results():
+      for item in iterable_fn():
+        yield item
+
+    # runs in its own thread, so long queries do not hold up the pool.
+    return prefetch(results(), self.read_ahead)
@@ -0,0 +1,140 @@
+from multiprocessing.pool import ThreadPool
+
+from .object_datastore import ObjectDatastore
+from .util import prefetch
+
+
+class AsyncResult(object):
+  '''Result of a child datastore's asynchronous call, transformed on `get`.'''
+
+  def __init__(self, result, transform):
+    self._result = result
+    self._transform = transform
+
+  def ready(self):
+    return self._result.ready()
+
+  def wait(self, timeout=None):
+    self._result.wait(timeout)
+
+  def get(self, timeout=None):
+    return self._transform(self._result.get(timeout))
+
+
+
+class AsyncObjectDatastore(object):
+  '''Non-blocking interface to an ObjectDatastore.
+
+  Every call returns immediately with a result object (such as
+  multiprocessing.pool.AsyncResult): `result.get()` waits for and returns
+  the value, and `result.ready()` tells whether it is available. Calls run in
+  a pool of `workers` threads, which bounds how many run at once.
+
+  Child datastores that are themselves asynchronous may implement `get_async`,
+  `put_async`, `delete_async` and `contains_async`, returning result objects
+  with the same interface. These are then called directly, instead of running
+  the synchronous calls in the pool.
+
+  `query` returns an iterator whose results are fetched in the background,
+  up to `read_ahead` ahead of the consumer.
+
+  Other keyword arguments are passed on to the ObjectDatastore, unless
+  `datastore` already is one.
+  '''
+
+  # number of threads running synchronous datastore calls.
+  workers = 8
+
+  # number of query results fetched ahead of the consumer.
+  read_ahead = 100
+
+  def __init__(self, datastore, workers=None, read_ahead=None, **kwargs):
+    if workers:
+      self.workers = int(workers)
+    if read_ahead:
+      self.read_ahead = int(read_ahead)
+
+    if not isinstance(datastore, ObjectDatastore):
+      datastore = ObjectDatastore(datastore, **kwargs)
+
+    self.datastore = datastore
+    self.pool = ThreadPool(self.workers)
+
+
+  @property
+  def model(self):
+    return self.datastore.model
+
+
+  def get(self, key):
+    '''Retrieves the object named by `key`.'''
+    native = self._native('get_async')
+    if native:
+      return AsyncResult(native(key), self.datastore._instance)
+    return self.pool.apply_async(self.datastore.get, (key,))
+
+
+  def put(self, key, value):
+    '''Stores the object `value` named by `key`.'''
+    native = self._native('put_async')
+    if native:
+      return AsyncResult(native(key, self.datastore._value(value)), _none)
+    return self.pool.apply_async(self.datastore.put, (key, value))
+
+
+  def delete(self, key):
+    '''Removes the object named by `key`.'''
+    native = self._native('delete_async')
+    if native:
+      return AsyncResult(native(key), _none)
+    return self.pool.apply_async(self.datastore.delete, (key,))
+
+
+  def contains(self, key):
+    '''Returns whether the object named by `key` exists.'''
+    native = self._native('contains_async')
+    if native:
+      return AsyncResult(native(key), bool)
+    return self.pool.apply_async(self.datastore.contains, (key,))
+
+
+  def get_many(self, keys):
+    '''Retrieves a list with the object named by each of `keys`.'''
+    return self.pool.apply_async(self.datastore.get_many, (list(keys),))
+
+
+  def put_many(self, items):
+    '''Stores each `(key, value)` pair in `items`.'''
+    return self.pool.apply_async(self.datastore.put_many, (list(items),))
+
+
+  def delete_many(self, keys):
+    '''Removes the objects named by `keys`.'''
+    return self.pool.apply_async(self.datastore.delete_many, (list(keys),))
+
+
+  def query(self, query):
+    '''Returns an iterator of the instances matching `query`, which are
+    fetched in the background.
+    '''
+    def results():
+      for instance in self.datastore.query(query):
+        yield instance
+
+    # runs in its own thread, so long queries do not hold up the pool.
+    return prefetch(results(), self.read_ahead)
+
+
+  def close(self):
+    '''Stops accepting calls. Pending calls still complete.'''
+    self.pool.close()
+
+
+  def _native(self, name):
+    '''Returns the child datastore's asynchronous method `name`, if any.'''
+    return getattr(self.datastore.child_datastore, name, None)
+
+
+
+def _none(value):
+  return None
@@ -1,4 +1,5 @@
 from datastore.core.serialize import NonSerializer
+from .util import missing
 
 
 
@@ -10,6 +11,16 @@ class Attribute(object):
   Attributes can have other options, including defining a default value, and
   validation for the data they hold.
 
+  Values are decoded by the serializer on every read, so each read returns a
+  new object. With `cache=True`, decoded values are cached per instance (in
+  its `_decoded` dict) instead, so reading an attribute repeatedly decodes it
+  once. The cached value is returned as long as the stored value is the same
+  object, so every read shares it: mutating it in place is seen by later
+  reads, but is not stored (assign it back to store it).
+
+  With `indexed=True`, Managers keep an index of the values of the attribute,
+  to look up instances by value (see Manager.find_by).
+
   This is adapted from dronestore.attribute. See:
   https://github.com/jbenet/py-dronestore/blob/master/dronestore/attribute.py
   '''
@@ -18,12 +29,14 @@ class Attribute(object):
 
 
   def __init__(self, name=None, default=None, required=False, data_type=str,
-      serializer=None):
+      serializer=None, cache=False, indexed=False):
     self.name = name
     self.default = default
     self.required = bool(required)
     self.data_type = data_type
     self.serializer = serializer if serializer else NonSerializer
+    self.cache = bool(cache) and self.serializer is not NonSerializer
+    self.indexed = bool(indexed)
 
 
   def _attr_raw_get(self, instance, name, default=None):
@@ -86,6 +99,11 @@ class Attribute(object):
     return value
 
 
+  def stored_value(self, value):
+    '''Returns `value` as it would be stored in model data.'''
+    return self.serializer.dumps(self.type_coerced_value(value))
+
+
   def __get__(self, instance, model_class):
     '''Descriptor to aid model instantiation.'''
     value = self._attr_raw_get(instance, self.name)
@@ -93,12 +111,22 @@ class Attribute(object):
     if self.is_empty_value(value):
       value = self.default_value()
 
-    return self.serializer.loads(value)
+    if instance is None or not self.cache:
+      return self.serializer.loads(value)
+    return self._cached_loads(instance, value)
 
 
   def __set__(self, instance, value, validate=True):
     '''Validate and Set the attribute on the model instance.'''
 
+    # models deferring validation (see Model.validate) get the value as is.
+    if validate and getattr(instance, '__deferred_validation__', False) and \
+        self.serializer is NonSerializer:
+      self._attr_raw_set(instance, self.name, value)
+      self._deferred(instance)
+      self._changed(instance)
+      return
+
     # coerce invalid value types
     value = self.type_coerced_value(value)
 
@@ -110,3 +138,263 @@ class Attribute(object):
 
     # set on the instance data
     self._attr_raw_set(instance, self.name, value)
+    self._changed(instance)
+
+
+  def _cached_loads(self, instance, value):
+    '''Returns `value` decoded, using the cache of `instance` if possible.'''
+    instance_dict = getattr(instance, '__dict__', None)
+    if instance_dict is None:
+      return self.serializer.loads(value)
+
+    decoded = instance_dict.get('_decoded')
+    if decoded is None:
+      decoded = instance_dict['_decoded'] = {}
+    else:
+      cached = decoded.get(self.name)
+      if cached is not None and cached[0] is value:
+        return cached[1]
+
+    result = self.serializer.loads(value)
+    decoded[self.name] = (value, result)
+    return result
+
+
+  def _deferred(self, instance):
+    '''Records that the value of this attribute set on `instance` is to be
+    validated (see Model.validate).
+    '''
+    unvalidated = instance.__dict__.get('_unvalidated')
+    if unvalidated is None:
+      unvalidated = instance.__dict__['_unvalidated'] = {}
+    unvalidated[self.name] = self
+
+
+  def _changed(self, instance):
+    '''Records that this attribute was set on `instance`: marks it modified
+    (see Model.markClean) and drops its cached decoded value.
+    '''
+    instance_dict = getattr(instance, '__dict__', None)
+    if not instance_dict:
+      return
+
+    dirty = instance_dict.get('_dirty')
+    if dirty is not None:
+      dirty.add(self.name)
+
+    decoded = instance_dict.get('_decoded')
+    if decoded:
+      decoded.pop(self.name, None)
+
+
+
+def _overrides(attribute, method):
+  '''Returns whether the class of `attribute` overrides Attribute `method`.'''
+  return getattr(type(attribute), method).im_func is not \
+      getattr(Attribute, method).im_func
+
+
+
+class AttributeAccessor(object):
+  '''Descriptor standing in for an Attribute on model classes.
+
+  It behaves as its `attribute` does, but reads and writes the model
+  instance's `data` dict directly, instead of going through
+  Attribute._attr_raw_get and Model.__getattr__. AttributeMetaclass builds
+  one per attribute (see `compile`), with __get__ and __set__ specialized to
+  that attribute.
+  '''
+
+  __slots__ = ('attribute', 'index', 'deferred')
+
+  def __init__(self, attribute, index=None, deferred=False):
+    self.attribute = attribute
+    self.index = index
+    self.deferred = deferred
+
+
+  def __repr__(self):
+    return '<%s for %s>' % (self.__class__.__name__, self.attribute.name)
+
+
+  @classmethod
+  def compile(cls, attribute, index=None, deferred=False):
+    '''Returns an accessor specialized for `attribute`, or None if the
+    attribute customizes how values are stored, which accessors cannot follow.
+
+    If `index` is given, the accessor reads and writes position `index` of the
+    instance's `_values` list (see Model.__compact__) instead of `data`.
+
+    If `deferred`, values set are not validated, but recorded to be validated
+    later (see Model.validate), unless the attribute has a serializer. Values
+    of the data type (which validation would keep as they are) need not be.
+    '''
+    raw_methods = ['__get__', '__set__', '_attr_raw_get', '_attr_raw_set']
+    if any(_overrides(attribute, method) for method in raw_methods):
+      return None
+
+    name = attribute.name
+    serializer = attribute.serializer
+    serialized = serializer is not NonSerializer
+    defer = deferred and not serialized
+
+    value_methods = ['is_empty_value', 'default_value', 'type_coerced_value',
+        'validated_value']
+    custom = any(_overrides(attribute, method) for method in value_methods)
+
+    if not custom and not serialized and index is None:
+
+      # the common case: values stored as they are, in `data`.
+      def __get__(self, instance, model_class):
+        if instance is None:
+          return attribute.__get__(instance, model_class)
+        value = instance.data.get(name)
+        if value is None:
+          return attribute.default
+        return value
+
+      if defer:
+        def __set__(self, instance, value):
+          if (value is None and attribute.required or
+              value is not None and not isinstance(value, attribute.data_type)):
+            attribute._deferred(instance)
+          instance.data[name] = value
+          dirty = instance.__dict__.get('_dirty')
+          if dirty is not None:
+            dirty.add(name)
+
+      else:
+        def __set__(self, instance, value):
+          if value is not None and not isinstance(value, attribute.data_type):
+            value = attribute.type_coerced_value(value)
+          elif value is None and attribute.required:
+            raise ValueError('Attribute %s is required.' % name)
+          instance.data[name] = value
+          dirty = instance.__dict__.get('_dirty')
+          if dirty is not None:
+            dirty.add(name)
+
+    else:
+      read, write = _accessor_storage(name, index)
+      validated = _accessor_validation(attribute, custom, defer)
+      is_empty = attribute.is_empty_value if custom else _is_none
+      dumps = serializer.dumps
+
+      if custom:
+        default = attribute.default_value
+      else:
+        default = lambda: attribute.default
+
+      if not serialized:
+        loads = lambda instance, value: value
+      elif attribute.cache:
+        loads = attribute._cached_loads
+      else:
+        loads = lambda instance, value: serializer.loads(value)
+
+      def __get__(self, instance, model_class):
+        if instance is None:
+          return attribute.__get__(instance, model_class)
+        value = read(instance)
+        if is_empty(value):
+          value = default()
+        return loads(instance, value)
+
+      def __set__(self, instance, value):
+        value = validated(instance, value)
+        if serialized:
+          value = dumps(value)
+        write(instance, value)
+        attribute._changed(instance)
+
+    accessor_class = type(cls.__name__, (cls,),
+        {'__slots__': (), '__get__': __get__, '__set__': __set__})
+    return accessor_class(attribute, index, deferred)
+
+
+
+class RawValueAccessor(object):
+  '''Descriptor for the raw value of an attribute on model classes: the
+  `_<name>` that Attribute._attr_raw_get and _attr_raw_set access. It reads
+  and writes the instance's `data`, as Model.__getattr__ and __setattr__
+  would, so that models whose attributes all have one need no __setattr__
+  (see AttributeMetaclass._direct_setattr).
+  '''
+
+  __slots__ = ('name',)
+
+  def __init__(self, name):
+    self.name = name
+
+
+  def __get__(self, instance, model_class):
+    if instance is None:
+      return self
+    data = instance.data
+    if self.name not in data:
+      raise AttributeError('_%s' % self.name)
+    return data[self.name]
+
+
+  def __set__(self, instance, value):
+    instance.data[self.name] = value
+
+
+
+def _is_none(value):
+  return value is None
+
+
+def _accessor_storage(name, index):
+  '''Returns the functions reading and writing the raw value of attribute
+  `name` of an instance: in its `data`, or at position `index` of its
+  `_values` (for compact instances, where `missing` reads as None).
+  '''
+  if index is None:
+    def read(instance):
+      return instance.data.get(name)
+
+    def write(instance, value):
+      instance.data[name] = value
+
+  else:
+    def read(instance):
+      value = instance._values[index]
+      return None if value is missing else value
+
+    def write(instance, value):
+      instance._values[index] = value
+
+  return read, write
+
+
+def _accessor_validation(attribute, custom, deferred):
+  '''Returns the function validating the values set on an instance (see
+  AttributeAccessor.compile).
+  '''
+  if deferred and custom:
+    def validated(instance, value):
+      attribute._deferred(instance)
+      return value
+
+  elif deferred:
+    def validated(instance, value):
+      if (value is None and attribute.required or
+          value is not None and not isinstance(value, attribute.data_type)):
+        attribute._deferred(instance)
+      return value
+
+  elif custom:
+    def validated(instance, value):
+      value = attribute.type_coerced_value(value)
+      return attribute.validated_value(value)
+
+  else:
+    def validated(instance, value):
+      if value is not None and not isinstance(value, attribute.data_type):
+        value = attribute.type_coerced_value(value)
+      elif value is None and attribute.required:
+        raise ValueError('Attribute %s is required.' % attribute.name)
+      return value
+
+  return validated
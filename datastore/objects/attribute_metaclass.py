@@ -1,4 +1,9 @@
 from .attribute import Attribute
+from .attribute import AttributeAccessor
+from .attribute import RawValueAccessor
+from .attribute import _overrides
+from .util import CompactData
+from .util import missing
 
 
 
@@ -11,11 +16,128 @@ class AttributeMetaclass(type):
   '''Metaclass to initialize attributes in a class.
 
   It ensures that attributes do not clash,
+
+  Classes whose instances keep attribute values in a `data` dict (like Model)
+  can set `__compile_attributes__` to have the attributes they define replaced
+  by AttributeAccessors, which access `data` directly.
+
+  Such classes can also set `__compact__`, to keep values in a list instead
+  (see `_compact_layout`).
   '''
 
   def __init__(cls, name, bases, attrs):
     super(AttributeMetaclass, cls).__init__(name, bases, attrs)
     cls._initialize_attributes(name, bases, attrs)
+    if getattr(cls, '__compact__', False):
+      cls._compact_layout(bases)
+    if getattr(cls, '__compile_attributes__', False):
+      cls._compile_attributes(attrs)
+    if cls._class_attribute('__raw_setattr__') is not None:
+      cls._direct_setattr(attrs)
+
+
+  def _compile_attributes(cls, attrs):
+    '''Replaces the attributes defined in `attrs` with AttributeAccessors.'''
+    index = None
+    if getattr(cls, '__compact__', False):
+      index = cls._layout_index
+    deferred = bool(getattr(cls, '__deferred_validation__', False))
+    redirected = cls._class_attribute('__raw_setattr__') is not None
+
+    for attr_name, attr in cls._attributes.items():
+      # only attributes named after a class attribute are kept in `data`.
+      if attr.name not in cls._attributes:
+        continue
+
+      position = index[attr.name] if index else None
+      if attr_name not in attrs:
+        # inherited attributes need new accessors if stored (or validated)
+        # differently here.
+        current = cls._class_attribute(attr_name)
+        if not isinstance(current, AttributeAccessor) or \
+            (current.index, current.deferred) == (position, deferred):
+          continue
+
+      accessor = AttributeAccessor.compile(attr, position, deferred)
+      if accessor:
+        setattr(cls, attr_name, accessor)
+        raw_name = '_' + attr.name
+        if redirected and not hasattr(cls, raw_name):
+          setattr(cls, raw_name, RawValueAccessor(attr.name))
+
+
+  def _direct_setattr(cls, attrs):
+    '''Classes redirecting raw attribute values with a `__setattr__` (like
+    Model) name it `__raw_setattr__`. Setting any attribute of their
+    instances goes through it, which is slow, so it is replaced with object's
+    own `__setattr__` when no attribute needs it: when each has a compiled
+    accessor and a RawValueAccessor. Otherwise the redirection is restored.
+
+    Classes defining (or inheriting) another `__setattr__` keep it.
+    '''
+    raw_setattr = cls._class_attribute('__raw_setattr__')
+    if '__setattr__' in attrs:
+      return
+
+    current = cls.__setattr__
+    if current is not object.__setattr__ and \
+        getattr(current, 'im_func', None) is not raw_setattr:
+      return
+
+    def compiled(attr_name, attr):
+      return attr_name == attr.name and \
+          isinstance(cls._class_attribute(attr_name), AttributeAccessor) and \
+          isinstance(cls._class_attribute('_' + attr_name), RawValueAccessor)
+
+    if all(compiled(n, a) for n, a in cls._attributes.items()):
+      cls.__setattr__ = object.__setattr__
+    else:
+      cls.__setattr__ = raw_setattr
+
+
+  def _class_attribute(cls, name):
+    '''Returns the class attribute `name` as defined (not bound), or None.'''
+    for c in cls.__mro__:
+      if name in c.__dict__:
+        return c.__dict__[name]
+    return None
+
+
+  def _compact_layout(cls, bases):
+    '''Sets up instances to keep their `data` in a list, `_values`, with a
+    fixed position for the key and each attribute, rather than in a dict.
+    This takes much less memory per instance. `data` becomes a CompactData
+    view of the list, so it still accepts any key.
+
+    Positions are inherited from the first compact base, so its accessors
+    also work for the instances of subclasses.
+    '''
+    layout = []
+    for base in bases:
+      if getattr(base, '__compact__', False):
+        layout.extend(base._layout)
+        break
+
+    key_attr = getattr(cls, 'key_attr', None)
+    if key_attr and not layout:
+      layout.append(key_attr)
+
+    names = set(attr.name for attr in cls._attributes.values())
+    layout.extend(sorted(names - set(layout)))
+
+    cls._layout = tuple(layout)
+    cls._layout_index = index = dict((n, i) for i, n in enumerate(layout))
+    size = len(layout)
+
+    def get_data(self):
+      return CompactData(self._values, index)
+
+    def set_data(self, data):
+      values = [missing] * size + [None]
+      self.__dict__['_values'] = values
+      CompactData(values, index).update(data)
+
+    cls.data = property(get_data, set_data)
 
 
   def _initialize_attributes(cls, name, bases, attrs):
@@ -84,3 +206,10 @@ class AttributeMetaclass(type):
     # add the ds attributes from this class.
     for attr_name, attr in attrs.items():
       add_attr(cls, attr_name, attr, defined_attrs)
+
+    # the default of each attribute, as `(name, default, default_value)`,
+    # where `default_value` is None unless the attribute computes its default
+    # (which is then called for each instance).
+    cls._defaults = tuple((attr.name, attr.default,
+        attr.default_value if _overrides(attr, 'default_value') else None)
+        for attr in cls._attributes.values())
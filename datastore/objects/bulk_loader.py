@@ -0,0 +1,198 @@
+import csv
+import json
+import time
+import threading
+
+from .model import Key
+from .collection_manager import CollectionManager
+from .util import chunks
+from .util import parallel_map
+
+
+class BulkLoader(object):
+  '''Loads many records into the datastore of a Manager.
+
+  Records are dicts of attribute values, as given to Model.updateAttributes
+  (e.g. parsed from NDJSON or CSV), and must include the key attribute (a key
+  or a key name). They go through a pipeline:
+
+    parse -> validate -> batch -> write
+
+  Validation builds the data a model instance would store for each record
+  (coercing, validating and serializing attribute values, and filling in
+  defaults), without creating instances. Batches of `batch_size` records are
+  then written through the manager's ObjectDatastore (see
+  ObjectDatastore.put_records), and indexed as Manager.put does. Unlike
+  ObjectDatastore.put, the data is not copied first: it is new, so nothing
+  else refers to it. With a CollectionManager, each batch is also added to
+  the manager's collection, as CollectionManager.put_many does.
+
+  Batches are validated and written by `workers` threads. At most twice as
+  many batches are in progress at once, and parsing waits for them, so memory
+  use is bounded however large the input.
+
+  With `skip_invalid`, records failing validation are counted and skipped,
+  and the first `max_errors` of their errors are kept in `errors`. Otherwise
+  the first invalid record stops the load.
+
+  `stats` counts the records through each stage and the seconds spent in it
+  (summed across threads); see also `rates`.
+
+      >>> loader = BulkLoader(manager, batch_size=1000, workers=4)
+      >>> loader.load_ndjson(open('scientists.ndjson'))
+      {'parsed': 10000, 'validated': 10000, 'written': 10000, ...}
+
+  '''
+
+  # number of records written at a time.
+  batch_size = 500
+
+  # number of threads validating and writing batches.
+  workers = 1
+
+  # number of validation errors kept when skipping invalid records.
+  max_errors = 100
+
+  stages = ('parse', 'validate', 'write')
+
+  def __init__(self, manager, batch_size=None, workers=None,
+      skip_invalid=False):
+    if batch_size:
+      self.batch_size = int(batch_size)
+    if workers:
+      self.workers = int(workers)
+
+    self.manager = manager
+    self.skip_invalid = skip_invalid
+    self.errors = []
+
+    self.stats = {'invalid': 0, 'batches': 0}
+    for stage, count in zip(self.stages, ['parsed', 'validated', 'written']):
+      self.stats[count] = 0
+      self.stats['%s_seconds' % stage] = 0.0
+
+    self._lock = threading.Lock()
+
+
+  def load(self, records):
+    '''Loads the dicts in iterable `records`. Returns `stats`.'''
+    batches = chunks(self._parsed(records), self.batch_size)
+    if self.workers > 1:
+      for _ in parallel_map(self._load_batch, batches, self.workers,
+          ordered=False):
+        pass
+    else:
+      for batch in batches:
+        self._load_batch(batch)
+    return self.stats
+
+
+  def load_ndjson(self, lines):
+    '''Loads records from `lines` of JSON (e.g. a file). Returns `stats`.'''
+    return self.load(json.loads(line) for line in lines if line.strip())
+
+
+  def load_csv(self, lines, **kwargs):
+    '''Loads records from `lines` of CSV (e.g. a file) with a header row.
+    Empty values are treated as missing, and others are coerced to the
+    attributes' data types. Keyword arguments are passed to csv.DictReader.
+    Returns `stats`.
+    '''
+    def records():
+      for row in csv.DictReader(lines, **kwargs):
+        yield dict((field, value) for field, value in row.iteritems()
+            if value != '')
+
+    return self.load(records())
+
+
+  def rates(self):
+    '''Returns the records per second through each stage (per thread).'''
+    rates = {}
+    for stage, count in zip(self.stages, ['parsed', 'validated', 'written']):
+      seconds = self.stats['%s_seconds' % stage]
+      rates[stage] = self.stats[count] / seconds if seconds else None
+    return rates
+
+
+  def _parsed(self, records):
+    '''Yields the items of `records`, timing the parse stage.'''
+    records = iter(records)
+    while True:
+      start = time.time()
+      try:
+        record = records.next()
+      except StopIteration:
+        return
+
+      # parsing runs in a single thread: no need to lock.
+      self.stats['parse_seconds'] += time.time() - start
+      self.stats['parsed'] += 1
+      yield record
+
+
+  def _load_batch(self, records):
+    '''Validates and writes a batch of records.'''
+    start = time.time()
+    items = []
+    invalid = []
+    for record in records:
+      try:
+        items.append(self._validate(record))
+      except (KeyError, TypeError, ValueError), error:
+        if not self.skip_invalid:
+          raise
+        invalid.append(error)
+
+    validated = time.time()
+    self._write(items)
+    written = time.time()
+
+    with self._lock:
+      self.stats['validated'] += len(items)
+      self.stats['invalid'] += len(invalid)
+      self.stats['written'] += len(items)
+      self.stats['batches'] += 1
+      self.stats['validate_seconds'] += validated - start
+      self.stats['write_seconds'] += written - validated
+      self.errors.extend(invalid[:self.max_errors - len(self.errors)])
+
+
+  def _validate(self, record):
+    '''Returns the `(key, data)` to store for `record`.'''
+    model = self.manager.model
+    key = record[model.key_attr]
+    if isinstance(key, basestring) and key.startswith('/'):
+      key = Key(key)
+    key = self.manager.key(key)
+
+    data = {model.key_attr: str(key)}
+    for attr_name, attribute in model._attributes.items():
+      value = record.get(attr_name)
+      if value is None:
+        value = attribute.default_value()
+        if attribute.required and attribute.is_empty_value(value):
+          raise ValueError('Attribute %s is required.' % attribute.name)
+      else:
+        value = attribute.type_coerced_value(value)
+        value = attribute.validated_value(value)
+        value = attribute.serializer.dumps(value)
+      data[attribute.name] = value
+    return key, data
+
+
+  def _write(self, items):
+    '''Writes `(key, data)` items, with their index entries. Index entries
+    are updated by the manager, under its index locks (see
+    Manager.index_locks), so concurrent batches and managers keep them all.
+    '''
+    manager = self.manager
+    changes = []
+    for key, data in items:
+      manager._invalidate(key)
+      changes.extend(manager._index_put(key, data, None))
+
+    manager.datastore.put_records(items)
+    manager._index_discard(changes)
+    if isinstance(manager, CollectionManager):
+      manager.collection.add_many(key for key, data in items)
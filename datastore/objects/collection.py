@@ -1,68 +1,342 @@
 from datastore.core import SymlinkDatastore
 from datastore.core import DirectoryDatastore
+from datastore.core import Query
+
+import urllib
+import threading
+
+from itertools import imap
 
 from .model import Model
 from .model import Key
+from .util import parallel_map
 
 
 class Collection(object):
   '''Implements a simple persistent collection of objects.
 
   It uses symlink and directory datastores to keep track of the items.
+
+  Instance data is fetched one key at a time by default. With `workers` > 1,
+  it is fetched from a pool of that many threads, keeping up to `read_ahead`
+  fetches (default: twice the workers) in flight, which overlaps the latency
+  of slow child datastores. Unless `ordered` is False, instances are still
+  yielded in collection order.
+
+  Besides the directory, the collection stores a marker per member and a
+  member count, so `contains` and `count` do not read the directory. Adds and
+  removes update them together, under a lock (which only serializes changes
+  made within this process). Collections created before markers were kept
+  can add them with `recount`.
+
+  `page` and `page_instances` list members a page at a time (in key order),
+  resuming from the cursor returned with the previous page, so later pages
+  do not fetch the instances of earlier ones. Pages are read from a range
+  query over the markers, rather than from the directory (which lists all
+  members), so on datastores running such queries natively, a page costs
+  time proportional to its size rather than to the collection's.
   '''
 
   Model = Model
 
-  def __init__(self, key, datastore, Model=None):
+  # concurrency of instance data fetching (see instance_data_generator).
+  workers = 1
+  read_ahead = None
+  ordered = True
+
+  # number of members per page (see page).
+  page_size = 100
+
+  # serializes membership changes, so markers, count and directory agree.
+  _lock = threading.Lock()
+
+  def __init__(self, key, datastore, Model=None, workers=None,
+      read_ahead=None, ordered=None):
     self.key = key
     self.datastore = datastore
+
+    if Model:
+      self.Model = Model
+    if workers:
+      self.workers = int(workers)
+    if read_ahead:
+      self.read_ahead = int(read_ahead)
+    if ordered is not None:
+      self.ordered = bool(ordered)
+
     self.symlink_datastore = SymlinkDatastore(datastore)
     self.directory_datastore = DirectoryDatastore(self.symlink_datastore)
 
 
   @property
   def keys(self):
-    return self.directory_datastore.directoryRead(self.key)
+    for directory_key in self._directory_keys():
+      for key in self.directory_datastore.directoryRead(directory_key):
+        yield key
 
 
   @property
   def instances(self):
-    instances_data = self.instance_data_generator()
+    return self._instance_gen(self.instance_data_generator())
+
+
+  def _instance_gen(self, instances_data):
+    '''Yields model instances from an iterable of instance data.'''
     for data in instances_data:
-      yield self.Model.withData(data)
+      # datastores such as ObjectDatastore already construct instances.
+      if isinstance(data, self.Model):
+        yield data
+      else:
+        yield self.Model.withData(data)
+
+
+  def page(self, cursor=None, limit=None):
+    '''Returns `(keys, cursor)`: the keys of up to `limit` (default:
+    `page_size`) members following `cursor` (or the first ones), and the
+    cursor of the next page, or None after the last page.
+
+    Members are listed in order of their keys, from their markers rather than
+    the directory: each page queries the markers for the `limit` following
+    the cursor (and one more, to tell whether a next page follows). Datastores
+    running such key-range queries natively read only those; others (like
+    DictDatastore, which runs queries in Python) still read all the markers.
+
+    Cursors are strings naming the last member listed, so the next page
+    resumes after it even if members were removed meanwhile.
+    '''
+    limit = limit or self.page_size
+    query = Query(self._members_key, limit=limit + 1,
+        object_getattr=_marker_getattr)
+    query.order('key')
+    if cursor:
+      query.filter('key', '>', self._cursor_marker(cursor))
+
+    # ObjectDatastores would make instances of the markers.
+    run = getattr(self.datastore, 'query_records', self.datastore.query)
+    markers = list(run(query))
+
+    cursor = None
+    if len(markers) > limit:
+      markers = markers[:limit]
+      cursor = urllib.quote(markers[-1], safe='')
+    return [self.key.instance(Key(marker).name) for marker in markers], cursor
+
+
+  def page_instances(self, cursor=None, limit=None):
+    '''Returns `(instances, cursor)` for a page of members (see `page`).'''
+    keys, cursor = self.page(cursor, limit)
+    instances = self._instance_gen(self.instance_data_generator(keys=keys))
+    return list(instances), cursor
+
+
+  def _cursor_marker(self, cursor):
+    '''Returns the key (a string) of the marker named by `cursor`.'''
+    marker = urllib.unquote(cursor)
+    if not marker.startswith(str(self._members_key) + ':'):
+      raise ValueError('invalid collection cursor: %r' % cursor)
+    return marker
 
 
   def add(self, instance_key):
-    if not isinstance(instance_key, Key):
-      instance_key = instance_key.key
+    self.add_many([instance_key])
+
+
+  def remove(self, instance_key):
+    self.remove_many([instance_key])
+
+
+  def add_many(self, instance_keys):
+    '''Adds the instances named by `instance_keys` (or the instances given),
+    rewriting each directory they are listed in once.
+    '''
+    members = []
+    for instance_key in instance_keys:
+      instance_key = self._instance_key(instance_key)
+      collection_instance_key = self.key.instance(instance_key.name)
+
+      # add symlink
+      if instance_key != collection_instance_key:
+        self.symlink_datastore.link(instance_key, collection_instance_key)
+      members.append(collection_instance_key)
 
+    with self._lock:
+      # add to collection
+      for directory_key, keys in self._by_directory(members):
+        items = self.directory_datastore.get(directory_key) or []
+        listed = set(items)
+        added = [key for key in keys if key not in listed]
+        if added:
+          self.directory_datastore.put(directory_key, items + added)
+
+      count = 0
+      for collection_instance_key in members:
+        marker_key = self._marker_key(collection_instance_key)
+        if not self.datastore.contains(marker_key):
+          self.datastore.put(marker_key, str(marker_key))
+          count += 1
+      if count:
+        self._add_count(count)
+
+
+  def remove_many(self, instance_keys):
+    '''Removes the instances named by `instance_keys` (or the instances
+    given), rewriting each directory they are listed in once.
+    '''
+    members = []
+    for instance_key in instance_keys:
+      instance_key = self._instance_key(instance_key)
+      collection_instance_key = self.key.instance(instance_key.name)
+
+      # remove symlink/delete entry
+      self.symlink_datastore.delete(collection_instance_key)
+      members.append(collection_instance_key)
+
+    with self._lock:
+      # remove from collection list
+      for directory_key, keys in self._by_directory(members):
+        items = self.directory_datastore.get(directory_key) or []
+        removed = set(keys)
+        remaining = [item for item in items if item not in removed]
+        if len(remaining) < len(items):
+          self.directory_datastore.put(directory_key, remaining)
+
+      count = 0
+      for collection_instance_key in members:
+        marker_key = self._marker_key(collection_instance_key)
+        if self.datastore.contains(marker_key):
+          self.datastore.delete(marker_key)
+          count += 1
+      if count:
+        self._add_count(-count)
+
+
+  def clear(self):
+    '''Removes all the members, a directory at a time (see `remove_many`), so
+    the keys of only one directory are held at once.
+    '''
+    for directory_key in self._directory_keys():
+      keys = self.directory_datastore.directoryRead(directory_key)
+      if keys:
+        self.remove_many(keys)
+
+
+  def _by_directory(self, collection_instance_keys):
+    '''Returns `(directory_key, keys)` pairs grouping the (string) keys of
+    `collection_instance_keys` by directory, in order.
+    '''
+    directories = {}
+    order = []
+    seen = set()
+    for collection_instance_key in collection_instance_keys:
+      key = str(collection_instance_key)
+      if key in seen:
+        continue
+      seen.add(key)
+
+      directory_key = self._directory_key(collection_instance_key)
+      if directory_key not in directories:
+        directories[directory_key] = []
+        order.append(directory_key)
+      directories[directory_key].append(key)
+    return [(directory_key, directories[directory_key])
+        for directory_key in order]
+
+
+  def contains(self, instance_key):
+    '''Returns whether the instance named by `instance_key` (or the instance
+    given) is a member.
+    '''
+    instance_key = self._instance_key(instance_key)
     collection_instance_key = self.key.instance(instance_key.name)
+    return self.datastore.contains(self._marker_key(collection_instance_key))
 
-    # add symlink
-    if instance_key != collection_instance_key:
-      self.symlink_datastore.link(instance_key, collection_instance_key)
 
-    # add to collection
-    self.directory_datastore.directoryAdd(self.key, collection_instance_key)
+  def count(self):
+    '''Returns the number of members.'''
+    return self.datastore.get(self._count_key) or 0
 
 
-  def remove(self, instance_key):
+  def recount(self):
+    '''Rebuilds the member markers and count from the directory (e.g. for
+    collections stored before markers were kept, or when their markers stored
+    True rather than their key, which `page` needs).
+    '''
+    with self._lock:
+      count = 0
+      for collection_instance_key in self.keys:
+        marker_key = self._marker_key(collection_instance_key)
+        self.datastore.put(marker_key, str(marker_key))
+        count += 1
+      self.datastore.put(self._count_key, count)
+
+
+  def _instance_key(self, instance_key):
+    '''Returns `instance_key`, or the key of the instance given.'''
     if not isinstance(instance_key, Key):
       instance_key = instance_key.key
+    return instance_key
 
-    collection_instance_key = self.key.instance(instance_key.name)
 
-    # remove symlink/delete entry
-    self.symlink_datastore.delete(collection_instance_key)
+  def _marker_key(self, collection_instance_key):
+    '''Returns the key of the marker of member `collection_instance_key`.
+    Markers store their own key (as a string), which `page` queries.
+    '''
+    return self._members_key.instance(collection_instance_key.name)
+
+
+  @property
+  def _members_key(self):
+    '''The key under which member markers are stored.'''
+    return self.key.child('_members')
+
+
+  def _add_count(self, delta):
+    '''Adds `delta` to the member count (with the lock held).'''
+    count = self.datastore.get(self._count_key) or 0
+    self.datastore.put(self._count_key, count + delta)
+
+
+  @property
+  def _count_key(self):
+    '''The key of the member count.'''
+    # not directly under `key`, where instances with this key type are.
+    return self.key.child('_meta').instance('count')
 
-    # remove from collection list
-    self.directory_datastore.directoryRemove(self.key, collection_instance_key)
 
+  def _directory_key(self, collection_instance_key):
+    '''Returns the key of the directory listing `collection_instance_key`.'''
+    return self.key
 
-  def instance_data_generator(self):
+
+  def _directory_keys(self):
+    '''Returns the keys of the directories listing the members, in order.'''
+    return [self.key]
+
+
+  def instance_data_generator(self, workers=None, read_ahead=None,
+      ordered=None, keys=None):
     '''
-    Generator that returns all the data of all the instances.
-    (Can override this to parallelize the access).
+    Generator that returns all the data of all the instances (or of those
+    named by `keys`, collection keys of members).
+    Arguments override the collection's concurrency settings.
     '''
-    for key in self.keys:
-      yield self.directory_datastore.get(key)
+    if keys is None:
+      keys = self.keys
+
+    workers = workers or self.workers
+    if workers > 1:
+      read_ahead = read_ahead or self.read_ahead
+      ordered = self.ordered if ordered is None else ordered
+      data = parallel_map(self.directory_datastore.get, keys, workers,
+          read_ahead, ordered)
+    else:
+      data = imap(self.directory_datastore.get, keys)
+
+    for item in data:
+      yield item
+
+
+
+def _marker_getattr(marker, field):
+  '''Query attribute getter for member markers, which are their own key.'''
+  return marker if field == 'key' else None
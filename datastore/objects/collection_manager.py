@@ -4,7 +4,12 @@ from .collection import Collection
 
 
 class CollectionManager(Manager):
-  '''Collection manager for model instances.'''
+  '''Collection manager for model instances.
+
+  To fetch instances concurrently, set `Collection` to a Collection subclass
+  with the desired `workers`, `read_ahead` and `ordered` settings. For large
+  collections, use a ShardedCollection.
+  '''
 
 
   # the collection class to use
@@ -12,9 +17,12 @@ class CollectionManager(Manager):
 
 
   def key(self, key_or_name):
-    '''Overrides Manager.key'''
+    '''Overrides Manager.key: keys of any type are accepted. Names are
+    checked as Model.instanceKey does.
+    '''
     if not isinstance(key_or_name, Key):
-      return self.collection_key.instance(key_or_name)
+      # the collection key is the model key.
+      return self.model.instanceKey(key_or_name)
 
     return key_or_name
 
@@ -28,7 +36,15 @@ class CollectionManager(Manager):
   @property
   def collection(self):
     '''Returns the collection that corresponds to this manager.'''
-    return self.Collection(self.collection_key, self.datastore)
+    # built once, as it wraps the datastore (unless the settings change).
+    collection = self.__dict__.get('_collection')
+    if collection is None or not isinstance(collection, self.Collection) or \
+        collection.key != self.collection_key or \
+        collection.Model is not self.model:
+      collection = self.Collection(self.collection_key, self.datastore,
+          Model=self.model)
+      self._collection = collection
+    return collection
 
 
   @property
@@ -36,6 +52,11 @@ class CollectionManager(Manager):
     return self.collection.instances
 
 
+  def count(self):
+    '''Returns the number of instances in the collection.'''
+    return self.collection.count()
+
+
   def put(self, instance):
     '''Stores given `instance` and adds it to the collection'''
     super(CollectionManager, self).put(instance)
@@ -44,5 +65,33 @@ class CollectionManager(Manager):
 
   def delete(self, key):
     '''Deletes `instance` named by `key` and removes it from collection.'''
-    self.collection.remove(key)
+    # deleted first, so the index entries of its stored values are discarded.
     super(CollectionManager, self).delete(key)
+    self.collection.remove(self.key(key))
+
+
+  def put_many(self, instances):
+    '''Stores all given `instances` and adds them to the collection, updating
+    its directories once.
+    '''
+    instances = list(instances)
+    super(CollectionManager, self).put_many(instances)
+    self.collection.add_many(instances)
+
+
+  def delete_many(self, keys):
+    '''Deletes the instances named by each of `keys`, and removes them from
+    the collection, updating its directories once.
+    '''
+    keys = map(self.key, keys)
+    super(CollectionManager, self).delete_many(keys)
+    self.collection.remove_many(keys)
+
+
+  def truncate(self, **kwargs):
+    '''Deletes all the instances of the model (see Manager.truncate), and
+    empties the collection.
+    '''
+    deleted = super(CollectionManager, self).truncate(**kwargs)
+    self.collection.clear()
+    return deleted
@@ -0,0 +1,190 @@
+import json
+import struct
+
+from itertools import islice
+
+from datastore.core import SymlinkDatastore
+
+from .collection import Collection
+from .object_datastore import ObjectDatastore
+from .util import chunks
+
+
+class Exporter(object):
+  '''Streams the raw records stored for a Manager's instances (matching an
+  optional `query`), or for a Collection's, without creating instances.
+
+  Records are encoded with `serializer` in one of these formats:
+
+    'ndjson': a record per line.
+    'binary': each record prefixed with its length, as a 4-byte big-endian
+        unsigned integer, so readers can skip records without decoding them.
+
+  Records are read and encoded `chunk_size` at a time, so memory use does not
+  grow with the number of records. (Queries with orders are the exception:
+  datastores that cannot order them natively sort them in memory.)
+
+  Cursors count the records exported so far (or, for Collections, the keys
+  read). Exporting from a cursor skips those, so an interrupted export can
+  resume where it stopped, as long as the records are not modified meanwhile:
+
+      >>> exporter = Exporter(manager)
+      >>> def checkpoint(cursor, size):
+      ...   save_progress(cursor, size)
+      >>> exporter.export(open('people.ndjson', 'w'), checkpoint=checkpoint)
+
+      # after an interruption, truncate the file to the last checkpoint:
+      >>> cursor, size = load_progress()
+      >>> out = open('people.ndjson', 'r+')
+      >>> out.truncate(size)
+      >>> out.seek(size)
+      >>> exporter.export(out, cursor=cursor, checkpoint=checkpoint)
+
+  '''
+
+  # number of records read and written at a time.
+  chunk_size = 1000
+
+  # encodes records (it must not output newlines for 'ndjson').
+  serializer = json
+
+  format = 'ndjson'
+  formats = ('ndjson', 'binary')
+
+  _length = struct.Struct('>I')
+
+  def __init__(self, source, query=None, format=None, chunk_size=None,
+      serializer=None):
+    if format:
+      if format not in self.formats:
+        raise ValueError('format must be one of %s, not %s' %
+            (self.formats, format))
+      self.format = format
+    if chunk_size:
+      self.chunk_size = int(chunk_size)
+    if serializer:
+      self.serializer = serializer
+
+    if query is not None and isinstance(source, Collection):
+      raise ValueError('Collections cannot be queried')
+
+    self.source = source
+    self.query = query
+
+
+  def records(self, cursor=0):
+    '''Yields the raw records after `cursor`.'''
+    for _, record in self._records(cursor):
+      yield record
+
+
+  def chunks(self, cursor=0):
+    '''Yields `(cursor, data)` pairs, where `data` is the encoded form of a
+    chunk of records after `cursor`, and `cursor` is the one to resume from
+    after writing it.
+    '''
+    encode = self._encoder()
+    for chunk in chunks(self._records(cursor), self.chunk_size):
+      yield chunk[-1][0], ''.join(encode(record) for _, record in chunk)
+
+
+  def export(self, fileobj, cursor=0, checkpoint=None):
+    '''Writes the records after `cursor` to `fileobj`, a chunk at a time.
+    After each chunk, flushes `fileobj` and calls `checkpoint(cursor, size)`
+    with the cursor to resume from and the size `fileobj` must be truncated
+    to before resuming (its position). Returns the final cursor.
+    '''
+    for cursor, data in self.chunks(cursor):
+      fileobj.write(data)
+      if checkpoint:
+        fileobj.flush()
+        checkpoint(cursor, fileobj.tell())
+    return cursor
+
+
+  def read(self, fileobj):
+    '''Yields the records in `fileobj`, as written by `export` (in the same
+    format).
+    '''
+    loads = self.serializer.loads
+    if self.format == 'ndjson':
+      for line in fileobj:
+        if line.strip():
+          yield loads(line)
+      return
+
+    size = self._length.size
+    while True:
+      header = fileobj.read(size)
+      if not header:
+        return
+      if len(header) < size:
+        raise ValueError('truncated record length')
+
+      length, = self._length.unpack(header)
+      data = fileobj.read(length)
+      if len(data) < length:
+        raise ValueError('truncated record')
+      yield loads(data)
+
+
+  def _encoder(self):
+    '''Returns a function encoding a record in the export format.'''
+    dumps = self.serializer.dumps
+    if self.format == 'ndjson':
+      return lambda record: dumps(record) + '\n'
+
+    pack = self._length.pack
+    def encode(record):
+      data = dumps(record)
+      return pack(len(data)) + data
+    return encode
+
+
+  def _records(self, cursor):
+    '''Yields `(cursor, record)` pairs for the records after `cursor`, with
+    the cursor to resume from after each record.
+    '''
+    if isinstance(self.source, Collection):
+      return self._collection_records(cursor)
+    return self._manager_records(cursor)
+
+
+  def _manager_records(self, cursor):
+    '''Yields the records matching the query, skipping `cursor` of them.'''
+    query = self.query
+    if query is None:
+      query = self.source.init_query()
+
+    if cursor:
+      query = query.copy()
+      query.offset += cursor
+      if query.limit is not None:
+        query.limit = max(query.limit - cursor, 0)
+        if not query.limit:
+          return
+
+    for record in self.source.plan(query).records():
+      cursor += 1
+      yield cursor, record
+
+
+  def _collection_records(self, cursor):
+    '''Yields the records of the collection's instances, skipping the first
+    `cursor` keys. Keys whose record is missing are skipped.
+    '''
+    # read the data stored by any ObjectDatastores, not their instances.
+    datastore = self.source.datastore
+    decode = None
+    while isinstance(datastore, ObjectDatastore):
+      decode = decode or datastore.decode
+      datastore = datastore.child_datastore
+    datastore = SymlinkDatastore(datastore)
+
+    keys = islice(self.source.keys, cursor, None)
+    for position, key in enumerate(keys, cursor + 1):
+      record = datastore.get(key)
+      if record is not None:
+        if decode:
+          record = decode(record)
+        yield position, record
@@ -0,0 +1,96 @@
+import time
+import threading
+import collections
+
+
+class IdentityMap(object):
+  '''Bounded map from Key to model instance, used as an object cache.
+
+  Holds at most `size` instances, evicting the least recently used one when
+  full. If `ttl` (seconds) is given, instances also expire that long after
+  they were added. `hits`, `misses` and `evictions` count cache activity.
+
+  For example:
+
+      >>> mgr = Manager(ds, model=Scientist, identity_map=IdentityMap(1000))
+      >>> mgr.get('Tesla') is mgr.get('Tesla')
+      True
+
+  '''
+
+  def __init__(self, size=1000, ttl=None, clock=time.time):
+    if size < 1:
+      raise ValueError('identity map size must be positive, not %s' % size)
+
+    self.size = int(size)
+    self.ttl = ttl
+    self.clock = clock
+
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+    self._items = collections.OrderedDict()
+    self._lock = threading.Lock()
+
+
+  def get(self, key):
+    '''Returns the instance named by `key`, or None.'''
+    with self._lock:
+      entry = self._items.pop(key, None)
+      if entry is None:
+        self.misses += 1
+        return None
+
+      instance, expires = entry
+      if expires is not None and expires <= self.clock():
+        self.evictions += 1
+        self.misses += 1
+        return None
+
+      # re-insert, marking the entry as most recently used.
+      self._items[key] = entry
+      self.hits += 1
+      return instance
+
+
+  def put(self, key, instance):
+    '''Adds `instance`, named by `key`, evicting old instances if full.'''
+    expires = self.clock() + self.ttl if self.ttl else None
+    with self._lock:
+      self._items.pop(key, None)
+      self._items[key] = (instance, expires)
+      while len(self._items) > self.size:
+        self._items.popitem(last=False)
+        self.evictions += 1
+
+
+  def discard(self, key):
+    '''Removes the instance named by `key`, if any.'''
+    with self._lock:
+      self._items.pop(key, None)
+
+
+  def clear(self):
+    '''Removes all instances.'''
+    with self._lock:
+      self._items.clear()
+
+
+  def __contains__(self, key):
+    return key in self._items
+
+
+  def __len__(self):
+    return len(self._items)
+
+
+  @property
+  def stats(self):
+    '''Returns a dict with the cache counters and current size.'''
+    return {
+      'hits': self.hits,
+      'misses': self.misses,
+      'evictions': self.evictions,
+      'size': len(self._items),
+    }
@@ -0,0 +1,192 @@
+import time
+import bisect
+import threading
+
+
+class Histogram(object):
+  '''Latency histogram with fixed buckets (upper bounds, in seconds).'''
+
+  # roughly 3 buckets per decade, from 10us to 10s.
+  bounds = (1e-5, 2e-5, 5e-5, 1e-4, 2e-4, 5e-4, 1e-3, 2e-3, 5e-3, 1e-2, 2e-2,
+      5e-2, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0)
+
+  def __init__(self, bounds=None):
+    if bounds:
+      self.bounds = tuple(bounds)
+    self.counts = [0] * (len(self.bounds) + 1)
+    self.count = 0
+    self.total = 0.0
+    self.max = 0.0
+
+
+  def add(self, seconds):
+    '''Records a duration of `seconds`.'''
+    self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+    self.count += 1
+    self.total += seconds
+    if seconds > self.max:
+      self.max = seconds
+
+
+  def percentile(self, percent):
+    '''Returns the upper bound of the bucket holding the `percent`th
+    percentile (or the maximum, past the last bound), or None if empty.
+    '''
+    if not self.count:
+      return None
+
+    rank = self.count * percent / 100.0
+    seen = 0
+    for bound, count in zip(self.bounds, self.counts):
+      seen += count
+      if seen >= rank:
+        return min(bound, self.max)
+    return self.max
+
+
+  def stats(self):
+    '''Returns a dict describing the histogram.'''
+    return {
+      'count': self.count,
+      'total': self.total,
+      'mean': self.total / self.count if self.count else None,
+      'max': self.max,
+      'p50': self.percentile(50),
+      'p90': self.percentile(90),
+      'p99': self.percentile(99),
+      'buckets': zip(self.bounds + (None,), self.counts),
+    }
+
+
+
+class Timer(object):
+  '''Times the phases of one operation (see Instrumentation.timer).'''
+
+  __slots__ = ('instrumentation', 'operation', 'phases', 'start', 'mark')
+
+  def __init__(self, instrumentation, operation):
+    self.instrumentation = instrumentation
+    self.operation = operation
+    self.phases = {}
+    self.start = self.mark = instrumentation.clock()
+
+
+  def phase(self, name):
+    '''Ends phase `name`, which started at the previous phase's end (or when
+    the timer did).
+    '''
+    now = self.instrumentation.clock()
+    self.phases[name] = self.phases.get(name, 0.0) + now - self.mark
+    self.mark = now
+
+
+  def skip(self):
+    '''Excludes the time since the previous phase from any phase.'''
+    self.mark = self.instrumentation.clock()
+
+
+  def done(self, total=None):
+    '''Ends the operation, recording its phases and `total` duration (by
+    default, the time since the timer started).
+    '''
+    if total is None:
+      total = self.instrumentation.clock() - self.start
+    self.instrumentation.record(self.operation, self.phases, total)
+
+
+
+class Instrumentation(object):
+  '''Collects counters and latency histograms for the operations of
+  ObjectDatastores and Managers given it (as `instrumentation`).
+
+  Operations are named like 'object_datastore.get'. Each has a histogram of
+  its total duration, and one for each phase it is split into:
+
+    'io': in the child datastore.
+    'copy': copying data (see ObjectDatastore.isolation).
+    'deserialize': constructing model instances from data.
+    'index': maintaining attribute indexes.
+    'validate': validating instances (see Model.validate).
+
+  Hooks route measurements elsewhere (e.g. a metrics system): each is called
+  as `hook(operation, phase, seconds)` for every phase and for the 'total',
+  and as `hook(counter, None, n)` for counters.
+
+  Without instrumentation (the default), operations only check that it is
+  None, which costs next to nothing.
+
+      >>> instrumentation = Instrumentation()
+      >>> manager = Manager(ds, model=Person, instrumentation=instrumentation)
+      >>> ...
+      >>> instrumentation.stats()['operations']['object_datastore.get']
+      {'count': 1200, 'phases': {'io': {...}, 'copy': {...}, ...}, ...}
+
+  '''
+
+  Histogram = Histogram
+
+  def __init__(self, hooks=None, clock=time.time, bounds=None):
+    self.hooks = list(hooks or [])
+    self.clock = clock
+    self.bounds = bounds
+    self._lock = threading.Lock()
+    self.reset()
+
+
+  def reset(self):
+    '''Clears all measurements.'''
+    with self._lock:
+      self.counters = {}
+      self.operations = {}
+
+
+  def add_hook(self, hook):
+    '''Adds `hook`, called with each measurement.'''
+    self.hooks.append(hook)
+
+
+  def timer(self, operation):
+    '''Returns a Timer for an occurrence of `operation`.'''
+    return Timer(self, operation)
+
+
+  def count(self, counter, n=1):
+    '''Adds `n` to `counter`.'''
+    with self._lock:
+      self.counters[counter] = self.counters.get(counter, 0) + n
+
+    for hook in self.hooks:
+      hook(counter, None, n)
+
+
+  def record(self, operation, phases, total):
+    '''Records an occurrence of `operation`, which took `total` seconds,
+    split into `phases` (a dict of seconds by phase).
+    '''
+    with self._lock:
+      histograms = self.operations.get(operation)
+      if histograms is None:
+        histograms = self.operations[operation] = {}
+
+      for phase, seconds in phases.items() + [('total', total)]:
+        histogram = histograms.get(phase)
+        if histogram is None:
+          histogram = histograms[phase] = self.Histogram(self.bounds)
+        histogram.add(seconds)
+
+    for hook in self.hooks:
+      for phase, seconds in phases.items():
+        hook(operation, phase, seconds)
+      hook(operation, 'total', total)
+
+
+  def stats(self):
+    '''Returns a dict of the counters and the histograms' stats.'''
+    with self._lock:
+      operations = {}
+      for operation, histograms in self.operations.items():
+        phases = dict((phase, histogram.stats())
+            for phase, histogram in histograms.items() if phase != 'total')
+        total = histograms['total'].stats()
+        operations[operation] = dict(total, phases=phases)
+      return {'counters': dict(self.counters), 'operations': operations}
@@ -0,0 +1,65 @@
+import threading
+import collections
+
+from datastore import Key
+
+
+class KeyCache(object):
+  '''Bounded map from key string to Key, interning the keys of instances.
+
+  Parsing a Key (and its namespaces, for `type` and `name`) costs more than
+  looking it up: models whose instances are constructed repeatedly (e.g. on
+  every get) can set a KeyCache as `__key_cache__`, so that instances with
+  the same key share one, already parsed, Key. Holds at most `size` keys,
+  evicting the oldest one when full (lookups are a plain dict get, without
+  tracking recency).
+
+      >>> class Scientist(Model):
+      >>>   __key_cache__ = KeyCache(10000)
+
+  '''
+
+  def __init__(self, size=10000):
+    if size < 1:
+      raise ValueError('key cache size must be positive, not %s' % size)
+
+    self.size = int(size)
+    self.hits = 0
+    self.misses = 0
+
+    self._keys = {}
+    self._order = collections.deque()
+    self._lock = threading.Lock()
+
+
+  def get(self, string):
+    '''Returns the Key for key `string`.'''
+    key = self._keys.get(string)
+    if key is not None:
+      self.hits += 1
+      return key
+
+    key = Key(string)
+    with self._lock:
+      self.misses += 1
+      if string not in self._keys:
+        self._keys[string] = key
+        self._order.append(string)
+        if len(self._order) > self.size:
+          del self._keys[self._order.popleft()]
+    return key
+
+
+  def clear(self):
+    '''Removes all keys.'''
+    with self._lock:
+      self._keys.clear()
+      self._order.clear()
+
+
+  def __contains__(self, string):
+    return string in self._keys
+
+
+  def __len__(self):
+    return len(self._keys)
@@ -1,29 +1,103 @@
+import urllib
+
+from itertools import imap
+
+from datastore.core.serialize import NonSerializer
+
 from .model import Key
 from .model import Model
 from datastore import Query
 from .object_datastore import ObjectDatastore
+from .query_plan import QueryPlan
+from .util import chunks
+from .util import LockStripes
+from .util import parallel_map
 
 
 class Manager(object):
-  '''Simplified manager for model instances.'''
+  '''Simplified manager for model instances.
+
+  If given an `identity_map` (see IdentityMap), the manager caches the
+  instances it retrieves, and returns the cached instance on later gets of the
+  same key. Puts and deletes through the manager invalidate cached instances.
+
+  Puts validate instances whose model defers validation (see Model.validate),
+  and write them entirely. With `write_changes_only`, puts skip instances that
+  were not modified since they were retrieved or stored (see Model.isDirty),
+  unless they were deleted since, and if the child datastore can patch stored
+  data (see ObjectDatastore.patch), write only the modified fields. Only
+  attributes set are tracked as modified: changes made in place (to a list
+  value, or straight to `instance.data`) are lost unless followed by
+  `instance.markDirty()`.
+
+  For each indexed attribute of the model (see Attribute.indexed), puts and
+  deletes maintain an index in the child datastore, mapping each stored value
+  to the keys of the instances with that value. Instances stored otherwise
+  (before the attribute was indexed, or bypassing managers) are missing from
+  it until `build_indexes` adds them, and marks the index complete. `find_by`
+  and queries (see QueryPlan) use complete indexes only, and scan all
+  instances otherwise. Updates of each index entry are serialized across all the managers
+  (and BulkLoaders) of the process, by `index_locks`. Processes sharing a
+  datastore concurrently may still lose index entries.
+
+  With `instrumentation` (see Instrumentation), gets, puts and deletes are
+  timed, puts split into 'validate', 'index' and 'io' phases, and identity
+  map hits, misses and skipped puts counted. It is shared with the underlying
+  ObjectDatastore, which times its own operations.
+
+  Other keyword arguments (e.g. `isolation`, `batch_size`) are passed on to
+  the underlying ObjectDatastore.
+  '''
 
   model = Model
 
-  def __init__(self, datastore, model=None):
+  # optional IdentityMap caching retrieved instances.
+  identity_map = None
+
+  # optional Instrumentation measuring operations.
+  instrumentation = None
+
+  # whether puts write only what was modified (skipping clean instances).
+  write_changes_only = False
+
+  # locks serializing updates of index entries, by index key. Shared by all
+  # managers, as they may share datastores.
+  index_locks = LockStripes()
+
+  def __init__(self, datastore, model=None, identity_map=None,
+      instrumentation=None, write_changes_only=None, **kwargs):
     if model:
       self.model = model
 
-    self.datastore = ObjectDatastore(datastore, model=self.model)
+    if identity_map is not None:
+      self.identity_map = identity_map
+
+    if instrumentation is not None:
+      self.instrumentation = instrumentation
+
+    if write_changes_only is not None:
+      self.write_changes_only = bool(write_changes_only)
+
+    self.datastore = ObjectDatastore(datastore, model=self.model,
+        instrumentation=self.instrumentation, **kwargs)
+
+    # the model's indexed attributes, by data field.
+    self._indexed = dict((attr.name, attr)
+        for attr in self.model._attributes.values() if attr.indexed)
+
+    # fields whose index is known to be complete (see build_indexes).
+    self._built_indexes = set()
 
 
   def key(self, key_or_name):
     '''Coerces `key_or_name` to be a proper model Key'''
     if not isinstance(key_or_name, Key):
-      return self.model.key.instance(key_or_name)
+      return self.model.instanceKey(key_or_name)
 
-    if key_or_name.type != self.model.key.name:
+    key_name = self.model._class_keys()[2]
+    if key_or_name.type != key_name:
       err = 'key %s must have key type %s'
-      raise TypeError(err % (key_or_name, self.model.key.name))
+      raise TypeError(err % (key_or_name, key_name))
 
     return key_or_name
 
@@ -37,20 +111,392 @@ class Manager(object):
 
   def get(self, key):
     '''Retrieves instance named by `key_or_name`.'''
-    return self.datastore.get(self.key(key))
+    key = self.key(key)
+    timer = self._timer('manager.get')
+    if self.identity_map is None:
+      instance = self.datastore.get(key)
+    else:
+      instance = self.identity_map.get(key)
+      if instance is None:
+        self._count('manager.identity_map.miss')
+        instance = self.datastore.get(key)
+        self._cache(key, instance)
+      else:
+        self._count('manager.identity_map.hit')
+
+    if timer:
+      timer.done()
+    return instance
 
 
   def put(self, instance):
-    '''Stores given `instance`.'''
+    '''Stores given `instance` (if modified, with `write_changes_only`).'''
     if not isinstance(instance, self.model):
       raise TypeError('%s must be of type %s' % (instance, self.model))
 
-    self.datastore.put(instance.key, instance)
+    timer = self._timer('manager.put')
+    instance.validate()
+    if timer:
+      timer.phase('validate')
+
+    self._invalidate(instance.key)
+    if self._unmodified(instance):
+      self._count('manager.put.skipped')
+      return
+
+    fields = self._modified_fields(instance)
+    changes = self._index_put(instance.key, instance.data, fields)
+    if timer:
+      timer.phase('index')
+
+    if fields is None:
+      self.datastore.put(instance.key, instance)
+    else:
+      self.datastore.patch(instance.key, instance, fields)
+    instance.markClean()
+    if timer:
+      timer.phase('io')
+
+    self._index_discard(changes)
+    if timer:
+      timer.phase('index')
+      timer.done()
 
 
   def delete(self, key_or_name):
     '''Deletes instance named by `key_or_name`.'''
-    self.datastore.delete(self.key(key_or_name))
+    key = self.key(key_or_name)
+    timer = self._timer('manager.delete')
+    self._invalidate(key)
+    changes = self._index_delete([key])
+    if timer:
+      timer.phase('index')
+
+    self.datastore.delete(key)
+    if timer:
+      timer.phase('io')
+
+    self._index_discard(changes)
+    if timer:
+      timer.phase('index')
+      timer.done()
+
+
+  # batch api
+
+  def get_many(self, keys):
+    '''Retrieves a list with the instance named by each of `keys`, in order.
+    Missing instances are None in the list.
+    '''
+    keys = [self.key(key) for key in keys]
+    if self.identity_map is None:
+      return self.datastore.get_many(keys)
+
+    instances = map(self.identity_map.get, keys)
+    missing = [i for i, instance in enumerate(instances) if instance is None]
+    if self.instrumentation is not None:
+      self._count('manager.identity_map.hit', len(keys) - len(missing))
+      self._count('manager.identity_map.miss', len(missing))
+    if missing:
+      fetched = self.datastore.get_many([keys[i] for i in missing])
+      for i, instance in zip(missing, fetched):
+        instances[i] = instance
+        self._cache(keys[i], instance)
+    return instances
+
+
+  def put_many(self, instances):
+    '''Stores all given `instances` (those modified, with
+    `write_changes_only`).
+    '''
+    stored = []
+    changes = []
+    self.datastore.put_many(self._key_instance_gen(instances, stored, changes))
+    for instance in stored:
+      instance.markClean()
+    self._index_discard(changes)
+
+
+  def delete_many(self, keys):
+    '''Deletes the instances named by each of `keys`.'''
+    changes = []
+    self.datastore.delete_many(self._invalidated_key_gen(keys, changes))
+    self._index_discard(changes)
+
+
+  def _key_instance_gen(self, instances, stored, changes):
+    '''Yields `(key, instance)` pairs for `instances` to store (see `put`),
+    ensuring they are of type model. Instances the child datastore can patch
+    are patched instead. All instances written are appended to `stored`, and
+    their index changes to `changes`.
+    '''
+    patch = hasattr(self.datastore.child_datastore, 'patch')
+    for instance in instances:
+      if not isinstance(instance, self.model):
+        raise TypeError('%s must be of type %s' % (instance, self.model))
+
+      instance.validate()
+      self._invalidate(instance.key)
+      if self._unmodified(instance):
+        continue
+
+      stored.append(instance)
+      fields = self._modified_fields(instance)
+      changes.extend(self._index_put(instance.key, instance.data, fields))
+      if patch and fields is not None:
+        self.datastore.patch(instance.key, instance, fields)
+      else:
+        yield instance.key, instance
+
+
+  def _unmodified(self, instance):
+    '''Returns whether `instance` is already stored as it is, and need not be
+    written (only with `write_changes_only`).
+    '''
+    return self.write_changes_only and not instance.isDirty() and \
+        self.datastore.contains(instance.key)
+
+
+  def _modified_fields(self, instance):
+    '''Returns the fields of `instance` to write: the modified ones with
+    `write_changes_only`, or else None (all).
+    '''
+    return instance.dirtyFields() if self.write_changes_only else None
+
+
+  def _invalidated_key_gen(self, keys, changes):
+    '''Yields the model Key for each of `keys`, invalidating cached ones, and
+    appending their index changes to `changes`.
+    '''
+    for chunk in chunks(imap(self.key, keys), self.datastore.batch_size):
+      for key in chunk:
+        self._invalidate(key)
+      changes.extend(self._index_delete(chunk))
+      for key in chunk:
+        yield key
+
+
+  # instrumentation
+
+  def _timer(self, operation):
+    '''Returns a Timer for `operation` if instrumented, or None.'''
+    if self.instrumentation is not None:
+      return self.instrumentation.timer(operation)
+    return None
+
+
+  def _count(self, counter, n=1):
+    '''Adds `n` to `counter` if instrumented.'''
+    if self.instrumentation is not None:
+      self.instrumentation.count(counter, n)
+
+
+  # identity map
+
+  def _cache(self, key, instance):
+    '''Adds retrieved `instance` to the identity map.'''
+    if isinstance(instance, self.model):
+      self.identity_map.put(key, instance)
+
+
+  def _invalidate(self, key):
+    '''Removes the instance named by `key` from the identity map, if any.'''
+    if self.identity_map is not None:
+      self.identity_map.discard(key)
+
+
+  # indexes
+
+  def find_by(self, attr, value):
+    '''Returns the instances whose attribute `attr` equals `value`, found
+    through the attribute's index if it is complete (see `build_indexes`), or
+    else by scanning all instances. `attr` must be indexed.
+    '''
+    attribute = self.model._attributes.get(attr)
+    if attribute is None or not attribute.indexed:
+      raise ValueError('%s is not an indexed attribute of %s' %
+          (attr, self.model.__name__))
+
+    # values the attribute cannot coerce are not indexed: compare as is.
+    try:
+      value = attribute.stored_value(value)
+      indexable = True
+    except (TypeError, ValueError):
+      indexable = False
+
+    if value is None:
+      return []
+
+    if not indexable or not self.index_built(attribute.name):
+      records = self.datastore.query_records(self.init_query())
+      return list(self.datastore.model_instance_gen(record
+          for record in records if self._is_instance(record) and
+          record.get(attribute.name) == value))
+
+    index = self.datastore.child_datastore.get(
+        self.index_key(attribute.name, value))
+    if not index:
+      return []
+
+    # entries may be stale if a write was interrupted: check the instances.
+    instances = self.get_many(map(Key, index))
+    return [instance for instance in instances
+        if instance is not None and instance.data.get(attribute.name) == value]
+
+
+  def index_key(self, field, value):
+    '''Returns the Key of the index entry for stored `value` of `field`.'''
+    if isinstance(value, unicode):
+      value = value.encode('utf-8')
+    name = urllib.quote(str(value), safe='')
+    return self.model.key.child('_index').child(field).instance(name)
+
+
+  def index_built_key(self, field):
+    '''Returns the Key of the marker stored once the index of `field` is
+    complete (see `build_indexes`).
+    '''
+    return self.model.key.child('_index').child('_built').instance(field)
+
+
+  def index_built(self, field):
+    '''Returns whether the index of `field` lists all stored instances.'''
+    if field in self._built_indexes:
+      return True
+
+    # markers are never removed (but by truncate, which stores them again).
+    if self.datastore.child_datastore.contains(self.index_built_key(field)):
+      self._built_indexes.add(field)
+      return True
+    return False
+
+
+  def build_indexes(self, batch_size=None):
+    '''Adds all stored instances to the indexes of the model's indexed
+    attributes, then marks the indexes complete, so that `find_by` and queries
+    use them. Instances are read `batch_size` at a time (default: the
+    ObjectDatastore's), without creating them.
+
+    Needed once per indexed attribute, before or after storing instances
+    (e.g. when an attribute becomes indexed). Instances stored meanwhile
+    through managers are indexed by their puts. Returns the number of
+    instances indexed.
+    '''
+    fields = sorted(self._indexed)
+    if not fields:
+      return 0
+
+    batch_size = batch_size or self.datastore.batch_size
+    key_attr = self.model.key_attr
+    records = self.datastore.query_records(self.init_query())
+    indexed = 0
+    for batch in chunks(records, batch_size):
+      entries = {}
+      for record in batch:
+        if not self._is_instance(record):
+          continue
+        indexed += 1
+        for field in fields:
+          if record.get(field) is not None:
+            index_key = self.index_key(field, record[field])
+            entries.setdefault(index_key, []).append(str(record[key_attr]))
+
+      for index_key, keys in entries.iteritems():
+        self._index_merge(index_key, keys)
+
+    self._mark_indexes_built()
+    return indexed
+
+
+  def _mark_indexes_built(self):
+    '''Stores the markers of the indexes being complete.'''
+    child = self.datastore.child_datastore
+    for field in sorted(self._indexed):
+      child.put(self.index_built_key(field), True)
+      self._built_indexes.add(field)
+
+
+  def _index_put(self, key, data, fields):
+    '''Adds the index entries for `data`, about to be stored under `key`, and
+    returns the entries of the old values to discard afterwards, as
+    `(key, field, old_value)` tuples. `fields` are the modified fields (None
+    for all).
+    '''
+    indexed = sorted(self._indexed)
+    if fields is not None:
+      indexed = [field for field in indexed if field in fields]
+    if not indexed:
+      return []
+
+    stored = self.datastore.child_datastore.get(key)
+    old = self.datastore.decode(stored) or {}
+    changes = []
+    for field in indexed:
+      value = data.get(field)
+      if old.get(field) != value:
+        self._index_add(key, field, value)
+        changes.append((key, field, old.get(field)))
+    return changes
+
+
+  def _index_delete(self, keys):
+    '''Returns the index entries to discard once the instances named by
+    `keys` are deleted, as `(key, field, old_value)` tuples.
+    '''
+    if not self._indexed:
+      return []
+
+    changes = []
+    for key, old in zip(keys, self._stored_records(keys)):
+      old = old or {}
+      changes.extend((key, field, old.get(field))
+          for field in sorted(self._indexed))
+    return changes
+
+
+  def _stored_records(self, keys):
+    '''Returns the record (decoded) stored under each of `keys`, or None.'''
+    child = self.datastore.child_datastore
+    native = getattr(child, 'get_many', None)
+    values = native(keys) if native else map(child.get, keys)
+    return map(self.datastore.decode, values)
+
+
+  def _index_add(self, key, field, value):
+    '''Adds `key` to the index entry for `value` of `field`.'''
+    if value is None:
+      return
+
+    self._index_merge(self.index_key(field, value), [str(key)])
+
+
+  def _index_merge(self, index_key, keys):
+    '''Adds the `keys` (strings) missing from index entry `index_key`.'''
+    child = self.datastore.child_datastore
+    with self.index_locks.lock(index_key):
+      index = child.get(index_key) or []
+      listed = set(index)
+      added = [key for key in keys if key not in listed]
+      if added:
+        child.put(index_key, index + added)
+
+
+  def _index_discard(self, changes):
+    '''Removes the keys in `changes` from the index entries of their old
+    values.
+    '''
+    child = self.datastore.child_datastore
+    for key, field, value in changes:
+      if value is None:
+        continue
+
+      index_key = self.index_key(field, value)
+      with self.index_locks.lock(index_key):
+        index = [k for k in child.get(index_key) or [] if k != str(key)]
+        if index:
+          child.put(index_key, index)
+        else:
+          child.delete(index_key)
 
 
   def init_query(self):
@@ -61,11 +507,238 @@ class Manager(object):
 
 
   def query(self, query):
-    '''Execute a query on the underlying datastore'''
-    return self.datastore.query(query)
+    '''Execute a query on the underlying datastore.
+
+    Queries filtering on the key or an indexed attribute read only the
+    instances named by the key or index (see QueryPlan).
+    '''
+    return self.plan(query).execute()
+
+
+  def plan(self, query):
+    '''Returns the QueryPlan for running `query`.'''
+    return QueryPlan(self, query)
+
+
+  def explain(self, query):
+    '''Returns a dict describing how `query` would run (see QueryPlan).'''
+    return self.plan(query).explain()
+
+
+  # numpy array dtypes for Attribute data types. Others use object arrays.
+  column_dtypes = {
+    int: 'int64',
+    long: 'int64',
+    float: 'float64',
+    bool: 'bool',
+  }
+
+  def query_columns(self, query, attrs, chunk_size=10000):
+    '''Returns a dict with a numpy array of the values of each attribute in
+    `attrs` (or the key attribute) for the instances matching `query`.
+
+    Values are read from the raw records, `chunk_size` records at a time,
+    without creating instances. Array dtypes follow the attributes' data_type
+    (see `column_dtypes`). Empty values read as the attribute's default, or NaN
+    in float arrays; integer and bool arrays cannot hold them (ValueError).
+
+    Requires numpy (imported on first use).
+    '''
+    try:
+      import numpy
+    except ImportError:
+      raise ImportError('Manager.query_columns requires numpy')
+
+    columns = [self._column(numpy, attr) for attr in attrs]
+    parts = [[] for column in columns]
+    for records in chunks(self.plan(query).records(), chunk_size):
+      for column, column_parts in zip(columns, parts):
+        column_parts.append(column(records))
+
+    arrays = {}
+    for attr, column, column_parts in zip(attrs, columns, parts):
+      if column_parts:
+        arrays[attr] = numpy.concatenate(column_parts)
+      else:
+        arrays[attr] = numpy.empty(0, dtype=column.dtype)
+    return arrays
+
+
+  def _column(self, numpy, attr):
+    '''Returns a function making an array (with module `numpy`) of the values
+    of `attr` in a list of raw records.
+    '''
+    if attr == self.model.key_attr:
+      field, dtype, default, loads = attr, object, None, None
+    elif attr in self.model._attributes:
+      attribute = self.model._attributes[attr]
+      field = attribute.name
+      dtype = self.column_dtypes.get(attribute.data_type, object)
+      default = attribute.default_value()
+      loads = None
+      if attribute.serializer is not NonSerializer:
+        loads = attribute.serializer.loads
+    else:
+      raise ValueError('%s is not an attribute of %s' %
+          (attr, self.model.__name__))
+
+    def column(records):
+      values = [record.get(field) for record in records]
+      if default is not None:
+        values = [default if value is None else value for value in values]
+      if loads:
+        values = map(loads, values)
+
+      if dtype is object:
+        # filled one by one, so sequence values are not made into dimensions.
+        array = numpy.empty(len(values), dtype=object)
+        for i, value in enumerate(values):
+          array[i] = value
+        return array
+
+      if dtype != 'float64' and None in values:
+        raise ValueError('%s has empty values, which %s arrays cannot hold' %
+            (attr, dtype))
+      return numpy.array(values, dtype=dtype)
+
+    column.dtype = dtype
+    return column
+
+
+  # number of batches per thread whose keys truncate reads at a time.
+  truncate_rounds = 10
+
+  # most rounds of keys a truncate call reads before giving up.
+  truncate_max_rounds = 10000
+
+  def truncate(self, batch_size=None, workers=1, progress=None, count=True):
+    '''Deletes all the instances of the model, with their index entries.
+
+    The records stored under the model key are read (without creating the
+    instances) a round at a time, and the instances among them deleted
+    `batch_size` at a time (default: the ObjectDatastore's), from `workers`
+    threads. `progress(deleted)` is called after each batch with the number
+    of instances deleted so far. Each round reads up to `truncate_rounds`
+    batches per thread, plus the records the previous round left in place:
+    those that are not instances, and instances read again after being
+    deleted (e.g. stored under another key than the one they name). Rounds
+    stop once one reads all the records left and deletes none, or after
+    `truncate_max_rounds` rounds (RuntimeError).
+
+    If the child datastore implements `delete_prefix(key)`, deleting all
+    values under `key`, everything under the model key is deleted at once,
+    and `progress` called once. The instances are counted first, which still
+    reads every record under the model key (though without decoding them).
+    With `count=False` they are not, so nothing is read: `progress` is not
+    called, and None is returned.
+
+    Truncating again after an interruption deletes the remaining instances.
+    Once done, the (empty) indexes are marked complete (see `build_indexes`).
+    Returns the number of instances deleted.
+    '''
+    if self.identity_map is not None:
+      self.identity_map.clear()
+
+    child = self.datastore.child_datastore
+    native = getattr(child, 'delete_prefix', None)
+    if native:
+      deleted = None
+      if count:
+        # raw records: instances need no decoding to be counted.
+        codec = self.datastore.codec
+        records = child.query(self.init_query())
+        deleted = sum(1 for record in records if self._is_instance(record) or
+            codec is not None and codec.is_encoded(record))
+      native(self.model.key)
+      if progress and count:
+        progress(deleted)
+      self._mark_indexes_built()
+      return deleted
+
+    batch_size = batch_size or self.datastore.batch_size
+    key_attr = self.model.key_attr
+    deleted = 0
+    skipped = 0
+    previous = set()
+    stuck = set()
+    for _ in xrange(self.truncate_max_rounds):
+      # read a round of keys, then delete them: datastores may not support
+      # deleting while a query is being iterated.
+      query = self.init_query()
+      query.limit = batch_size * workers * self.truncate_rounds + skipped
+      records = list(self.datastore.query_records(query))
+
+      instances = []
+      keys = set()
+      for record in records:
+        if not self._is_instance(record):
+          continue
+        key = record[key_attr]
+        if key in stuck:
+          continue
+        elif key in previous:
+          # counted as deleted last round, but was not.
+          stuck.add(key)
+          deleted -= 1
+        else:
+          instances.append(record)
+          keys.add(key)
+      skipped = len(records) - len(instances)
+      previous = keys
+
+      batches = chunks(instances, batch_size)
+      if workers > 1:
+        counts = parallel_map(self._truncate_batch, batches, workers,
+            ordered=False)
+      else:
+        counts = imap(self._truncate_batch, batches)
+
+      for count in counts:
+        deleted += count
+        if progress:
+          progress(deleted)
+
+      # stop once all the records left were read, and none was deleted.
+      if len(records) < query.limit and not instances:
+        # no instances are left to index.
+        self._mark_indexes_built()
+        return deleted
+
+    raise RuntimeError('truncating %s stopped after %d rounds (%d deleted); '
+        'truncate again to resume' % (self.model.__name__,
+        self.truncate_max_rounds, deleted))
+
+
+  def _is_instance(self, record):
+    '''Returns whether raw `record` is the data of an instance.'''
+    return isinstance(record, dict) and self.model.key_attr in record
+
+
+  def _truncate_batch(self, records):
+    '''Deletes the instances stored as `records`, and the index entries of
+    their values. Returns the number of instances deleted.
+    '''
+    child = self.datastore.child_datastore
+    keys = [Key(record[self.model.key_attr]) for record in records]
+    native = getattr(child, 'delete_many', None)
+    if native:
+      native(keys)
+    else:
+      for key in keys:
+        child.delete(key)
+
+    # all instances go, so their values' index entries can go whole.
+    index_keys = set()
+    for record in records:
+      for field in self._indexed:
+        if record.get(field) is not None:
+          index_keys.add(self.index_key(field, record[field]))
+    for index_key in index_keys:
+      with self.index_locks.lock(index_key):
+        child.delete(index_key)
+    return len(keys)
 
 
   def remove_all_items(self):
-    '''Removes all items from the datastore'''
-    for obj in self.query(self.init_query()):
-      self.delete(obj.key)
\ No newline at end of file
+    '''Removes all items from the datastore (see `truncate`).'''
+    self.truncate()
\ No newline at end of file
@@ -1,5 +1,7 @@
 from datastore import Key
 from .util import classproperty
+from .util import missing
+from .attribute import _overrides
 from .attribute_metaclass import AttributeMetaclass
 
 
@@ -8,14 +10,42 @@ from .attribute_metaclass import AttributeMetaclass
 class Model(object):
   '''Implements a basic model with keys. It uses a per-class (or per-instance)
   ObjectManager to save and fetch its values.
+
+  Instances loaded from an ObjectDatastore track which attributes have been
+  set since (see `markClean`), so that Manager.put can skip unmodified ones,
+  and write only the modified fields when possible. Changes made directly to
+  `data` are not tracked, except through `updateData`: call `markDirty` after
+  making them.
+
+  Setting an attribute coerces and validates the value. Models setting
+  `__deferred_validation__` instead keep values as set, until `validate`
+  checks them all at once; Manager.put validates instances before storing
+  them. Until then, attributes read back the values as set. Attributes with a
+  serializer are still validated when set. `validate_many` checks a batch of
+  records without creating instances.
   '''
 
   __metaclass__ = AttributeMetaclass
 
+  # have AttributeMetaclass access attribute values in `data` directly.
+  __compile_attributes__ = True
+
+  # keep `data` in a list with a position per attribute, which saves memory
+  # when holding many instances (see AttributeMetaclass._compact_layout).
+  __compact__ = False
 
   # name of the key attribute in model data
   key_attr = 'key'
 
+  # optional KeyCache interning the keys of instances (see instanceKey).
+  __key_cache__ = None
+
+  # validate attribute values in `validate`, rather than when set.
+  __deferred_validation__ = False
+
+  # construct instances from stored data without __init__ (see withStoredData).
+  __trusted_hydration__ = False
+
 
   def __init__(self, keyOrName):
     self._set_data({})
@@ -38,14 +68,19 @@ class Model(object):
     '''validates keyOrName and sets internal key'''
     if isinstance(keyOrName, Key):
       key = keyOrName
+      key_name = self._class_keys()[2]
+      if key.type != key_name:
+        raise TypeError('key.type should be %s' % key_name)
     elif isinstance(keyOrName, basestring):
-      key = self.__class__.key.instance(str(keyOrName))
+      # keys built from names have the right type.
+      key = self.instanceKey(keyOrName)
     else:
       err = 'key must be of type %s, not %s'
       raise TypeError(err % (Key, keyOrName.__class__))
 
-    if key.type != self.__class__.key.name:
-      raise TypeError('key.type should be %s' % self.__class__.key.name)
+    # a new key names a different object, which must be written in full.
+    if self.__dict__.get('_key', key) != key:
+      self.markDirty()
 
     self._key = key
     self.data[self.key_attr] = str(key)
@@ -86,6 +121,10 @@ class Model(object):
 
     self.data[name] = value
 
+  # models whose attributes are all compiled do without __setattr__ (see
+  # AttributeMetaclass._direct_setattr).
+  __raw_setattr__ = __setattr__
+
 
   def __repr__(self):
     return '%s.withData(%s)' % (self.__class__.__name__, self.data)
@@ -105,11 +144,7 @@ class Model(object):
     # ensure cls is not instance (classproperty)
     if not isinstance(cls, type):
       cls = cls.__class__
-
-    key_type = getattr(cls, '__key_type__', None)
-    if not key_type:
-      key_type = cls.__name__.lower()
-    return key_type
+    return cls._class_keys()[0]
 
 
   @classproperty
@@ -124,13 +159,113 @@ class Model(object):
 
     '''
     if isinstance(cls_or_self, type):
-      return Key(cls_or_self.key_type)
+      return cls_or_self._class_keys()[1]
     return cls_or_self._key
 
 
+  @classmethod
+  def _class_keys(cls):
+    '''Returns `(key_type, key, key.name)` for this model, memoized per class
+    (and per `__key_type__`, which may be changed).
+    '''
+    key_type = getattr(cls, '__key_type__', None)
+    memo = cls.__dict__.get('_class_keys_memo')
+    if memo is None or memo[0] != key_type or memo[1] != cls.__name__:
+      derived = key_type or cls.__name__.lower()
+      key = Key(derived)
+      memo = (key_type, cls.__name__, (derived, key, key.name))
+      cls._class_keys_memo = memo
+    return memo[2]
+
+
+  @classmethod
+  def instanceKey(cls, name):
+    '''Returns the Key of the instance of this model named `name`, interned
+    in `__key_cache__` if set. Names cannot contain '/' (ValueError).
+    '''
+    name = str(name)
+    if '/' in name:
+      raise ValueError('instance name %r must not contain "/"' % name)
+
+    key_cache = cls.__key_cache__
+    if key_cache is None:
+      return cls._class_keys()[1].instance(name)
+    return key_cache.get(str(cls._class_keys()[1]) + ':' + name)
+
+
+  @classmethod
+  def _parse_key(cls, string):
+    '''Returns the Key for key `string`, interned if `__key_cache__` is set.'''
+    key_cache = cls.__key_cache__
+    if key_cache is None:
+      return Key(string)
+    return key_cache.get(str(string))
+
+
   def updateData(self, data):
+    # drop attribute values cached by Attribute serializers.
+    self.__dict__.pop('_decoded', None)
     self.data.update(data)
 
+    dirty = self.__dict__.get('_dirty')
+    if dirty is not None:
+      dirty.update(data)
+
+
+  def markClean(self):
+    '''Marks the instance unmodified, as it is when loaded or stored. Setting
+    attributes (or calling `updateData`) marks them modified.
+    '''
+    self.__dict__['_dirty'] = set()
+
+
+  def markDirty(self, *names):
+    '''Marks the fields `names` modified, or the whole instance if no names
+    are given. New instances are entirely modified.
+    '''
+    if not names:
+      self.__dict__.pop('_dirty', None)
+      return
+
+    dirty = self.__dict__.get('_dirty')
+    if dirty is not None:
+      dirty.update(names)
+
+
+  def isDirty(self):
+    '''Returns whether the instance was modified since marked clean.'''
+    dirty = self.__dict__.get('_dirty')
+    return dirty is None or bool(dirty)
+
+
+  def dirtyFields(self):
+    '''Returns the set of fields modified since the instance was marked
+    clean, or None if the whole instance is modified.
+    '''
+    dirty = self.__dict__.get('_dirty')
+    return None if dirty is None else set(dirty)
+
+
+  def validate(self):
+    '''Coerces and validates the attribute values set since last validated
+    (see `__deferred_validation__`), raising the first error (TypeError or
+    ValueError). Invalid values are validated again on the next call.
+    '''
+    unvalidated = self.__dict__.get('_unvalidated')
+    if not unvalidated:
+      return
+
+    data = self.data
+    for name, attribute in unvalidated.items():
+      value = attribute.type_coerced_value(data.get(name))
+      data[name] = attribute.validated_value(value)
+      del unvalidated[name]
+
+
+  def isValidated(self):
+    '''Returns whether all attribute values set have been validated.'''
+    return not self.__dict__.get('_unvalidated')
+
 
   def updateAttributes(self, data):
     if self.key_attr in data:
@@ -146,6 +281,120 @@ class Model(object):
   def withData(cls, data):
     '''Constructs a version of this model with given data'''
     key = data[cls.key_attr]
-    instance = cls(Key(key))
+    instance = cls(cls._parse_key(key))
     instance.updateData(data)
     return instance
+
+
+  @classmethod
+  def withStoredData(cls, data):
+    '''Constructs a version of this model that adopts `data`, as read from
+    storage, and is marked clean.
+
+    Unlike `withData`, `data` itself becomes the instance's data (except for
+    compact models, which copy it into their list), so it must not be shared.
+    The defaults of the attributes fill in the fields missing from `data`.
+
+    Instances of models constructed by Model's own __init__ are not
+    constructed with it, as it would set up nothing more: the key type is not
+    checked, and the defaults come from the model's `_defaults` (see
+    AttributeMetaclass). Other models' instances are constructed as usual.
+
+    Models setting `__trusted_hydration__` trust `data` further: their
+    instances are never constructed with `__init__`, and defaults are not
+    filled in (attributes read them when empty anyway, but they are not
+    stored again). Only models whose `__init__` sets up no other state should
+    set it.
+    '''
+    key = cls._parse_key(data[cls.key_attr])
+    if cls.__trusted_hydration__:
+      instance = cls._adopt(data, key)
+    elif cls._plain_construction():
+      instance = cls._adopt(data, key)
+      if cls.__compact__:
+        values = instance._values
+        index = cls._layout_index
+        for name, default, default_value in cls._defaults:
+          if values[index[name]] is missing:
+            values[index[name]] = \
+                default if default_value is None else default_value()
+      else:
+        for name, default, default_value in cls._defaults:
+          if name not in data:
+            data[name] = default if default_value is None else default_value()
+    else:
+      instance = cls(key)
+      defaults = instance.data
+      if isinstance(defaults, dict):
+        instance.data = data
+        for name in set(defaults).difference(data):
+          data[name] = defaults[name]
+      else:
+        # compact instances copy `data` into their list anyway.
+        defaults.update(data)
+
+    instance.__dict__['_dirty'] = set()
+    return instance
+
+
+  @classmethod
+  def _adopt(cls, data, key):
+    '''Returns an instance with `data` and `key`, not constructed.'''
+    instance = cls.__new__(cls)
+    if cls.__compact__:
+      instance.data = data
+    else:
+      instance.__dict__['data'] = data
+    instance.__dict__['_key'] = key
+    return instance
+
+
+  @classmethod
+  def _plain_construction(cls):
+    '''Returns whether instances of this model are constructed by Model's
+    own __init__, _set_data and _set_key, memoized per class.
+    '''
+    plain = cls.__dict__.get('_plain_construction_memo')
+    if plain is None:
+      plain = all(getattr(cls, name).im_func is getattr(Model, name).im_func
+          for name in ['__init__', '_set_data', '_set_key'])
+      cls._plain_construction_memo = plain
+    return plain
+
+
+  @classmethod
+  def validate_many(cls, records):
+    '''Checks `records` (dicts of attribute values, as given to
+    updateAttributes) against the model's attributes, as setting them would,
+    and as if missing values were the defaults. Values given as None are
+    checked as such (so they fail required attributes, as when set). No
+    instances are created.
+
+    Attributes are checked one at a time across all records. Returns a list
+    of `(index, attr_name, error)` for all the errors, ordered by record.
+    '''
+    records = list(records)
+    errors = []
+    for attr_name, attribute in sorted(cls._attributes.items()):
+      default = attribute.default_value()
+      coerce = attribute.type_coerced_value
+      validate = attribute.validated_value
+
+      # values of the data type need no coercion (unless customized).
+      data_type = attribute.data_type
+      if _overrides(attribute, 'type_coerced_value'):
+        data_type = ()
+
+      for index, record in enumerate(records):
+        value = record.get(attr_name, missing)
+        if value is missing:
+          value = default
+        try:
+          if not isinstance(value, data_type):
+            value = coerce(value)
+          validate(value)
+        except (TypeError, ValueError), error:
+          errors.append((index, attr_name, error))
+
+    errors.sort(key=lambda error: error[0])
+    return errors
@@ -1,7 +1,14 @@
 import copy
 import datastore
 
+from itertools import imap
+
+from .model import Key
 from .model import Model
+from .util import chunks
+from .util import copy_values
+from .util import CopyOnReadDict
+from .util import CopyOnWriteDict
 
 
 class ObjectDatastore(datastore.ShimDatastore):
@@ -12,39 +19,411 @@ class ObjectDatastore(datastore.ShimDatastore):
 
   It is also heavily inspired by Backbone Model and Collection, in order to
   keep similar semantics in both backend and frontend.
+
+  The `get_many`, `put_many` and `delete_many` calls operate on many keys at
+  once. They use the child datastore's methods of the same name when it has
+  them, and otherwise loop over `batch_size` keys at a time.
+
+  The `isolation` mode controls how model data is copied between instances
+  and the child datastore:
+
+    'deepcopy' (default): get and put deep-copy the data, so instances never
+        share any state with stored values.
+    'copy': get and put copy the top-level dict, and nested values are copied
+        on write: instances get a CopyOnReadDict, which shares nested values
+        with the stored data until they are read through it. Put stores the
+        instance's data, and shares its nested values again.
+    'trusted': no copying. Instances get a read-only view of the stored data,
+        which is copied (shallowly) on the first mutation. Put stores the
+        instance's data as is, and turns it into such a view. Nested values
+        stay shared with the stored data, so must not be mutated in place.
+
+  With `instrumentation` (an Instrumentation), operations are timed, split
+  into phases: child datastore 'io', 'copy' and 'deserialize'.
+
+  With a `codec` (a RecordCodec for the model), instances are stored as
+  compact binary records rather than dicts, so the child datastore must
+  store strings as they are (no JSON serializer). Encoding and decoding
+  replace copying, whatever the isolation mode. Data the codec cannot encode
+  is stored as a dict, and dicts stored before are still read. The schemas of
+  records written are stored under `/_schemas/<key_type>`, so that records
+  keep decoding after the model's attributes change. Queries read all the
+  records under the query's key, decoding them before filtering.
+
+  Instances retrieved are marked clean (see Model.markClean). `patch` stores
+  only their modified fields, if the child datastore implements
+  `patch(key, fields)`, which updates the data stored under `key` with the
+  `fields` dict, or raises KeyError if there is none.
   '''
 
   model = Model
 
+  # number of keys handed to the child datastore at a time by batch calls.
+  batch_size = 100
+
+  # how data is copied between model instances and the child datastore.
+  isolation = 'deepcopy'
+  isolation_modes = ('deepcopy', 'copy', 'trusted')
+
+  # optional Instrumentation measuring operations.
+  instrumentation = None
+
+  # optional RecordCodec encoding stored instance data.
+  codec = None
+
   def __init__(self, *args, **kwargs):
     model = kwargs.pop('model', None)
     if model:
       self.model = model
 
+    batch_size = kwargs.pop('batch_size', None)
+    if batch_size:
+      self.batch_size = int(batch_size)
+
+    isolation = kwargs.pop('isolation', None)
+    if isolation:
+      if isolation not in self.isolation_modes:
+        raise ValueError('isolation must be one of %s, not %s' %
+            (self.isolation_modes, isolation))
+      self.isolation = isolation
+
+    instrumentation = kwargs.pop('instrumentation', None)
+    if instrumentation is not None:
+      self.instrumentation = instrumentation
+
+    codec = kwargs.pop('codec', None)
+    if codec is not None:
+      self.codec = codec
+
+    # versions of the codec schemas stored (or known to be).
+    self._stored_schemas = set()
+
     super(ObjectDatastore, self).__init__(*args, **kwargs)
 
 
   def get(self, key):
+    timer = self._timer('object_datastore.get')
     data = super(ObjectDatastore, self).get(key)
-    if data and isinstance(data, dict) and 'key' in data:
-      data = copy.deepcopy(data)
-      return self.model.withData(data)
-    return data
+    if timer:
+      timer.phase('io')
+
+    instance = self._instance(data, timer)
+    if timer:
+      timer.done()
+    return instance
 
 
   def put(self, key, value):
-    if isinstance(value, self.model):
-      value = copy.deepcopy(value.data)
+    timer = self._timer('object_datastore.put')
+    value = self._value(value)
+    if timer:
+      timer.phase('copy')
+
     super(ObjectDatastore, self).put(key, value)
+    if timer:
+      timer.phase('io')
+      timer.done()
+
+
+  def contains(self, key):
+    '''Returns whether the object named by `key` exists, without retrieving
+    it (as Datastore.contains does).
+    '''
+    return self.child_datastore.contains(key)
+
+
+  def patch(self, key, value, fields):
+    '''Stores the `fields` of model instance `value` under `key`. Stores all
+    of `value` instead if the child datastore cannot patch, if records are
+    encoded (see `codec`), if nothing is stored under `key` yet, or if some of
+    the fields were removed from `value.data`.
+    '''
+    native = getattr(self.child_datastore, 'patch', None)
+    data = value.data
+    if not native or self.codec is not None or any(field not in data
+        for field in fields):
+      return self.put(key, value)
+
+    timer = self._timer('object_datastore.patch')
+    changes = dict((field, data[field]) for field in fields)
+    if self.isolation == 'deepcopy':
+      changes = copy.deepcopy(changes)
+    elif self.isolation == 'copy':
+      changes = copy_values(changes)
+    if timer:
+      timer.phase('copy')
+
+    try:
+      native(key, changes)
+    except KeyError:
+      self.put(key, value)
+    if timer:
+      timer.phase('io')
+      timer.done()
+
+
+  def get_many(self, keys):
+    '''Returns a list with the object named by each of `keys`, in order.
+    Keys that do not exist yield None in their position.
+    '''
+    timer = self._timer('object_datastore.get_many')
+    results = []
+    native = getattr(self.child_datastore, 'get_many', None)
+    for chunk in chunks(keys, self.batch_size):
+      if timer:
+        timer.skip()
+      if native:
+        values = native(chunk)
+      else:
+        values = map(self.child_datastore.get, chunk)
+      if timer:
+        timer.phase('io')
+      results.extend(self._instance(value, timer) for value in values)
+
+    if timer:
+      timer.done()
+    return results
+
+
+  def put_many(self, items):
+    '''Stores each `(key, value)` pair in `items`.'''
+    self._put_chunks('object_datastore.put_many', items, self._value)
+
+
+  def put_records(self, items):
+    '''Stores each `(key, data)` pair in `items`, where `data` is the data of
+    an instance (a dict, as `query_records` returns), without creating the
+    instance. The data is stored as is (or encoded, with a codec), so must not
+    be modified afterwards.
+    '''
+    self._put_chunks('object_datastore.put_records', items, self.encode)
+
+
+  def _put_chunks(self, operation, items, stored):
+    '''Stores `(key, item)` pairs in `items` a batch at a time, storing
+    `stored(item)` under each key.
+    '''
+    timer = self._timer(operation)
+    native = getattr(self.child_datastore, 'put_many', None)
+    for chunk in chunks(items, self.batch_size):
+      if timer:
+        timer.skip()
+      chunk = [(key, stored(item)) for key, item in chunk]
+      if timer:
+        timer.phase('copy')
+      if native:
+        native(chunk)
+      else:
+        for key, value in chunk:
+          self.child_datastore.put(key, value)
+      if timer:
+        timer.phase('io')
+
+    if timer:
+      timer.done(sum(timer.phases.values()))
+
+
+  def delete_many(self, keys):
+    '''Removes the objects named by `keys`.'''
+    native = getattr(self.child_datastore, 'delete_many', None)
+    for chunk in chunks(keys, self.batch_size):
+      if native:
+        native(chunk)
+      else:
+        for key in chunk:
+          self.child_datastore.delete(key)
 
 
   def query(self, query):
     '''disable query access'''
-    results = super(ObjectDatastore, self).query(query)
-    return self.model_instance_gen(results)
+    return self.model_instance_gen(self.query_records(query))
+
+
+  def query_records(self, query):
+    '''Runs `query` on the child datastore, returning an iterable of the
+    matching raw records (decoded, with a codec).
+    '''
+    if self.codec is None:
+      return self.child_datastore.query(query)
+
+    # filters and orders apply to decoded records only.
+    records = self.child_datastore.query(datastore.Query(query.key))
+    return query(imap(self.decode, records))
+
+
+  def encode(self, data):
+    '''Returns the value to store for instance `data` (a dict): its encoded
+    record with a codec, or else (or if it cannot be encoded) `data` itself.
+    '''
+    codec = self.codec
+    if codec is None:
+      return data
+
+    try:
+      value = codec.encode(data)
+    except ValueError:
+      return data
+
+    if codec.version not in self._stored_schemas:
+      self.child_datastore.put(self._schema_key(codec.version), codec.schema)
+      self._stored_schemas.add(codec.version)
+    return value
+
+
+  def decode(self, value):
+    '''Returns the data of stored `value`: decoded if it is an encoded
+    record, or else `value` itself.
+    '''
+    codec = self.codec
+    if codec is None or not codec.is_encoded(value):
+      return value
+
+    try:
+      return codec.decode(value)
+    except KeyError:
+      # written with another schema: look it up.
+      version = codec.record_version(value)
+      schema = self.child_datastore.get(self._schema_key(version))
+      if schema is None:
+        raise
+      codec.add_schema(schema)
+      self._stored_schemas.add(version)
+      return codec.decode(value)
+
+
+  def _schema_key(self, version):
+    '''Returns the key of the codec schema with `version`.'''
+    # not under the model's key, so truncating the model keeps schemas.
+    return Key('/_schemas').child(self.model.key_type).instance(str(version))
 
 
   def model_instance_gen(self, iterable):
     '''Yields model instances from an iterable of data'''
-    for data in iterable:
-      yield self.model.withData(data)
+    if self.instrumentation is not None:
+      return self._timed_instance_gen(iterable)
+    return self._instance_gen(iterable)
+
+
+  def _instance_gen(self, iterable):
+    '''Yields model instances from an iterable of data'''
+    if self.isolation == 'trusted':
+      for data in iterable:
+        yield self._view_instance(data)
+    elif self.isolation == 'copy':
+      for data in iterable:
+        yield self.model.withStoredData(CopyOnReadDict(data))
+    else:
+      # instances get their own dict, but share nested values (as withData
+      # did) even when deep-copying on get.
+      for data in iterable:
+        yield self.model.withStoredData(dict(data))
+
+
+  def _timed_instance_gen(self, iterable):
+    '''Yields model instances from an iterable of data, timing the query
+    (but not the time spent by the consumer).
+    '''
+    timer = self._timer('object_datastore.query')
+    iterator = iter(iterable)
+    trusted = self.isolation == 'trusted'
+    isolate = CopyOnReadDict if self.isolation == 'copy' else dict
+    try:
+      while True:
+        timer.skip()
+        try:
+          data = next(iterator)
+        except StopIteration:
+          return
+        timer.phase('io')
+
+        if trusted:
+          instance = self._view_instance(data)
+        else:
+          data = isolate(data)
+          timer.phase('copy')
+          instance = self.model.withStoredData(data)
+        timer.phase('deserialize')
+        yield instance
+
+    finally:
+      timer.done(sum(timer.phases.values()))
+
+
+  def _instance(self, data, timer=None):
+    '''Returns the model instance for stored `data` (or `data` itself).'''
+    if self.codec is not None and self.codec.is_encoded(data):
+      # decoded data is not shared, so needs no copying.
+      instance = self.model.withStoredData(self.decode(data))
+      if timer:
+        timer.phase('deserialize')
+      return instance
+
+    if data and isinstance(data, dict) and 'key' in data:
+      if self.isolation == 'trusted':
+        instance = self._view_instance(data)
+      else:
+        if self.isolation == 'deepcopy':
+          data = copy.deepcopy(data)
+        else:
+          data = CopyOnReadDict(data)
+        if timer:
+          timer.phase('copy')
+        instance = self.model.withStoredData(data)
+
+      if timer:
+        timer.phase('deserialize')
+      return instance
+    return data
+
+
+  def _view_instance(self, data):
+    '''Returns a model instance backed by a read-only view of `data`.'''
+    return self.model.withStoredData(CopyOnWriteDict(data))
+
+
+  def _timer(self, operation):
+    '''Returns a Timer for `operation` if instrumented, or None.'''
+    if self.instrumentation is not None:
+      return self.instrumentation.timer(operation)
+    return None
+
+
+  def _value(self, value):
+    '''Returns the data to store for `value`.'''
+    if not isinstance(value, self.model):
+      return value
+
+    data = value.data
+    if isinstance(data, CopyOnReadDict):
+      data = data.share()
+
+    if self.codec is not None:
+      # encoding copies the data.
+      encoded = self.encode(data)
+      if encoded is not data:
+        return encoded
+
+    if self.isolation == 'trusted':
+      # store the data itself, and stop the instance from modifying it.
+      if isinstance(data, CopyOnWriteDict):
+        return data.freeze()
+      if isinstance(data, dict):
+        value.data = CopyOnWriteDict(data)
+        return data
+
+    if self.isolation == 'copy':
+      if not isinstance(data, dict):
+        # views (like compact models' data) are stored as dicts.
+        return copy_values(data)
+      if type(value.data) is dict:
+        # store the data itself, giving the instance a copy of it.
+        value.data = CopyOnReadDict(data)
+      return data
+
+    # views (like CopyOnWriteDict or compact models' data) are stored as dicts.
+    if not isinstance(data, dict):
+      data = dict(data)
+
+    if self.isolation == 'deepcopy':
+      data = copy.deepcopy(data)
+    return data
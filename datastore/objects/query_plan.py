@@ -0,0 +1,144 @@
+from datastore.core.serialize import NonSerializer
+
+from .model import Key
+from .util import chunks
+
+
+class QueryPlan(object):
+  '''How a Manager runs a Query. The plan uses one of these strategies:
+
+    'key': the query filters for a single key (`key = ...`), so only that
+        instance is read.
+    'index': the query filters an indexed attribute for equality, and its
+        index is complete (see Manager.build_indexes), so only the instances
+        listed in the attribute's index entry are read. If several filters
+        qualify, the one with the fewest instances is used.
+    'scan': the query is run by the datastore, which reads every instance
+        under the query's key.
+
+  For 'key' and 'index' plans, the whole query (filters, orders, offset and
+  limit) is then evaluated on the raw records read (decoded, if the manager's
+  datastore has a codec), before creating instances, so results are the same
+  as a scan's.
+
+  Attributes with a serializer are not used, as query filters compare raw
+  stored values with the filter's value. Neither are filters whose value the
+  attribute cannot coerce (e.g. 'abc' for an int attribute).
+
+      >>> plan = QueryPlan(manager, Query(Key('/person')).filter('age', '=', 30))
+      >>> plan.explain()
+      {'strategy': 'index', 'field': 'age', 'estimated_records': 12, ...}
+
+  '''
+
+  def __init__(self, manager, query):
+    self.manager = manager
+    self.query = query
+
+    self.strategy = 'scan'
+    self.field = None
+
+    # keys of the instances to read, unless scanning.
+    self.candidates = None
+
+    self._plan()
+
+
+  def _plan(self):
+    '''Chooses the strategy with the fewest candidates.'''
+    model = self.manager.model
+    indexed = self.manager._indexed
+
+    for query_filter in self.query.filters:
+      if query_filter.op != '=':
+        continue
+
+      if query_filter.field == model.key_attr:
+        strategy = 'key'
+        candidates = [Key(str(query_filter.value))]
+      elif query_filter.field in indexed:
+        attribute = indexed[query_filter.field]
+        if attribute.serializer is not NonSerializer or \
+            not self.manager.index_built(attribute.name):
+          continue
+        strategy = 'index'
+        candidates = self._index_candidates(attribute, query_filter.value)
+        if candidates is None:
+          continue
+      else:
+        continue
+
+      # only instances under the query's key can match.
+      candidates = [key for key in candidates if key.path == self.query.key]
+      if self.candidates is None or len(candidates) < len(self.candidates):
+        self.strategy = strategy
+        self.field = query_filter.field
+        self.candidates = candidates
+
+
+  def _index_candidates(self, attribute, value):
+    '''Returns the keys in the index entry for `value` of `attribute`, or None
+    if `value` cannot be stored as the attribute's value (so the index cannot
+    be used, and the filter is left to a scan).
+    '''
+    try:
+      value = attribute.stored_value(value)
+    except (TypeError, ValueError):
+      return None
+
+    if value is None:
+      return []
+
+    index_key = self.manager.index_key(attribute.name, value)
+    index = self.manager.datastore.child_datastore.get(index_key)
+    return map(Key, index or [])
+
+
+  @property
+  def estimated_records(self):
+    '''The number of instances the plan reads, or None if unknown (scans).'''
+    if self.candidates is None:
+      return None
+    return len(self.candidates)
+
+
+  def explain(self):
+    '''Returns a dict describing the plan.'''
+    return {
+      'strategy': self.strategy,
+      'field': self.field,
+      'estimated_records': self.estimated_records,
+      'filters': [str(query_filter) for query_filter in self.query.filters],
+      'orders': [str(order) for order in self.query.orders],
+    }
+
+
+  def execute(self):
+    '''Runs the query, returning an iterable of the matching instances.'''
+    datastore = self.manager.datastore
+    if self.strategy == 'scan':
+      return datastore.query(self.query)
+    return datastore.model_instance_gen(self.records())
+
+
+  def records(self):
+    '''Runs the query, returning an iterable of the matching raw records (as
+    stored in the child datastore), without creating instances.
+    '''
+    if self.strategy == 'scan':
+      return self.manager.datastore.query_records(self.query)
+    return self.query(self._read(self.candidates))
+
+
+  def _read(self, keys):
+    '''Returns the raw records stored under `keys`, skipping missing ones.'''
+    datastore = self.manager.datastore
+    native = getattr(datastore.child_datastore, 'get_many', None)
+    records = []
+    for chunk in chunks(keys, datastore.batch_size):
+      if native:
+        records.extend(native(chunk))
+      else:
+        records.extend(map(datastore.child_datastore.get, chunk))
+    return [datastore.decode(record) for record in records
+        if record is not None]
@@ -0,0 +1,341 @@
+import json
+import zlib
+import struct
+
+
+# marks fields missing from the data being encoded.
+_absent = object()
+
+
+class RecordCodec(object):
+  '''Packs the data of instances of `model` into a compact binary record.
+
+  Plain dicts repeat every field name in every record. A RecordCodec instead
+  derives a schema from the model's attributes (the key attribute, then the
+  attributes by name, with their data types), and stores the values in
+  schema order, after a header:
+
+    magic (4 bytes) | format (1 byte) | kind (1 byte) | version (4 bytes)
+
+  `format` is the version of the encoding below, and `version` names the
+  schema. Unless the data has exactly the schema's fields (kind 0), the
+  record is extended (kind 1): the values are followed by `absent`, the
+  positions of fields missing from the data (as opposed to None), and
+  `extras`, the fields outside the schema (or None), so records decode to the
+  same data they were encoded from.
+
+  Each value is a type tag (1 byte) followed by its contents, all in network
+  byte order:
+
+    'N' None, 'T' True, 'F' False
+    'i' int (4 bytes), 'q' int (8 bytes), 'L' larger int (as a string)
+    'd' float (8 bytes)
+    's' str, 'u' unicode (UTF-8): length (4 bytes) and bytes
+    '[' list, '(' tuple: length (4 bytes) and values
+    '{' dict: length (4 bytes) and key, value pairs
+
+  Values of other types cannot be encoded (ValueError). Decoding only builds
+  values of these types, and raises ValueError for malformed records.
+
+  The version is a checksum of the schema, so it changes with the model's
+  attributes. Records of other versions decode with their own schema, once
+  it is added (see `add_schema`): fields since removed from the model come
+  back as extras, and are kept when the record is encoded again.
+
+      >>> codec = RecordCodec(Person)
+      >>> value = codec.encode({'key': '/person:ada', 'name': 'Ada'})
+      >>> codec.decode(value)
+      {'key': '/person:ada', 'name': 'Ada'}
+
+  '''
+
+  magic = '\xdbREC'
+  format = 1
+  header = struct.Struct('>4sBBI')
+
+  # kinds of records: with exactly the schema's fields, and others.
+  exact = 0
+  extended = 1
+
+  # deepest nesting of lists, tuples and dicts decoded.
+  max_depth = 64
+
+  def __init__(self, model):
+    self.model = model
+
+    attributes = sorted(model._attributes.values(), key=lambda a: a.name)
+    self.schema = [[model.key_attr, 'str']] + [[attribute.name,
+        getattr(attribute.data_type, '__name__', None)]
+        for attribute in attributes]
+    self.version = self.schema_version(self.schema)
+
+    self.fields = tuple(name for name, data_type in self.schema)
+    self._field_set = frozenset(self.fields)
+    self._prefix = self.header.pack(self.magic, self.format, self.exact,
+        self.version)
+    self._extended_prefix = self.header.pack(self.magic, self.format,
+        self.extended, self.version)
+
+    # field names of each known schema, by version.
+    self.schemas = {self.version: self.fields}
+
+
+  @staticmethod
+  def schema_version(schema):
+    '''Returns the version number of `schema` (a checksum).'''
+    return zlib.crc32(json.dumps(schema)) & 0xffffffff
+
+
+  def add_schema(self, schema):
+    '''Adds `schema` (as in `self.schema`), so that records of its version
+    can be decoded.
+    '''
+    fields = tuple(name for name, data_type in schema)
+    self.schemas[self.schema_version(schema)] = fields
+
+
+  def is_encoded(self, value):
+    '''Returns whether `value` is a record encoded by a RecordCodec: a string
+    starting with the magic bytes and a header.
+    '''
+    return isinstance(value, str) and len(value) >= self.header.size and \
+        value.startswith(self.magic)
+
+
+  def record_version(self, value):
+    '''Returns the schema version of record `value`.'''
+    return self._header(value)[2]
+
+
+  def encode(self, data):
+    '''Returns the record for `data` (a dict of field values).'''
+    get = data.get
+    values = [get(field, _absent) for field in self.fields]
+    absent = [i for i, value in enumerate(values) if value is _absent]
+    for i in absent:
+      values[i] = None
+
+    parts = []
+    if not absent and len(data) == len(self.fields):
+      parts.append(self._prefix)
+      _pack_values(values, parts)
+      return ''.join(parts)
+
+    extras = None
+    if len(data) + len(absent) > len(self.fields):
+      extras = dict((field, value) for field, value in data.iteritems()
+          if field not in self._field_set)
+
+    parts.append(self._extended_prefix)
+    _pack_values(values, parts)
+    _pack(absent, parts)
+    _pack(extras, parts)
+    return ''.join(parts)
+
+
+  def decode(self, value):
+    '''Returns the data (a new dict) of record `value`. Raises ValueError if
+    it is not a well-formed record, and KeyError if its schema version is not
+    known.
+    '''
+    # records of the current schema need no parsing of their header.
+    prefix = value[:self.header.size] if isinstance(value, str) else None
+    if prefix == self._prefix:
+      kind, fields = self.exact, self.fields
+    elif prefix == self._extended_prefix:
+      kind, fields = self.extended, self.fields
+    else:
+      record_format, kind, version = self._header(value)
+      fields = self.schemas.get(version)
+      if fields is None:
+        raise KeyError('unknown record schema version %d' % version)
+
+    try:
+      values, position = _unpack_values(value, self.header.size,
+          len(fields), self.max_depth)
+      data = dict(zip(fields, values))
+      if kind == self.extended:
+        absent, position = _unpack(value, position, self.max_depth)
+        extras, position = _unpack(value, position, self.max_depth)
+        for i in absent:
+          del data[fields[i]]
+        if extras:
+          data.update(extras)
+    except (struct.error, IndexError, KeyError, TypeError,
+        UnicodeDecodeError), error:
+      raise ValueError('malformed record: %s' % error)
+
+    if position != len(value):
+      raise ValueError('malformed record: %d bytes after the values' %
+          (len(value) - position))
+    return data
+
+
+  def _header(self, value):
+    '''Returns the `(format, kind, version)` of record `value`, or raises
+    ValueError if it is not one this codec reads.
+    '''
+    if not self.is_encoded(value):
+      raise ValueError('not an encoded record: %s' % repr(value)[:40])
+
+    magic, record_format, kind, version = self.header.unpack_from(value)
+    if record_format != self.format:
+      raise ValueError('unknown record format %d' % record_format)
+    if kind != self.exact and kind != self.extended:
+      raise ValueError('unknown record kind %d' % kind)
+    return record_format, kind, version
+
+
+
+# packing of values, by type tag (see RecordCodec).
+
+_int = struct.Struct('>ci')
+_long = struct.Struct('>cq')
+_float = struct.Struct('>cd')
+_sized = struct.Struct('>cI')
+
+_unpack_int = struct.Struct('>i').unpack_from
+_unpack_float = struct.Struct('>d').unpack_from
+_unpack_length = struct.Struct('>I').unpack_from
+
+_constants = {'N': None, 'T': True, 'F': False}
+
+_int_min, _int_max = -2 ** 31, 2 ** 31 - 1
+_long_min, _long_max = -2 ** 63, 2 ** 63 - 1
+
+
+def _pack_values(values, parts):
+  '''Appends the packed `values` to list `parts`.'''
+  # the common types are packed inline, as records are mostly made of them.
+  append = parts.append
+  for value in values:
+    kind = type(value)
+    if kind is str:
+      append(_sized.pack('s', len(value)))
+      append(value)
+    elif kind is int and _int_min <= value <= _int_max:
+      append(_int.pack('i', value))
+    elif value is None:
+      append('N')
+    elif kind is float:
+      append(_float.pack('d', value))
+    else:
+      _pack(value, parts)
+
+
+def _pack(value, parts):
+  '''Appends packed `value` to list `parts`.'''
+  kind = type(value)
+  if value is None:
+    parts.append('N')
+  elif kind is str:
+    parts.append(_sized.pack('s', len(value)))
+    parts.append(value)
+  elif kind is bool:
+    parts.append('T' if value else 'F')
+  elif kind is int or kind is long:
+    if _int_min <= value <= _int_max:
+      parts.append(_int.pack('i', value))
+    elif _long_min <= value <= _long_max:
+      parts.append(_long.pack('q', value))
+    else:
+      value = str(value)
+      parts.append(_sized.pack('L', len(value)))
+      parts.append(value)
+  elif kind is float:
+    parts.append(_float.pack('d', value))
+  elif kind is unicode:
+    value = value.encode('utf-8')
+    parts.append(_sized.pack('u', len(value)))
+    parts.append(value)
+  elif kind is list or kind is tuple:
+    parts.append(_sized.pack('[' if kind is list else '(', len(value)))
+    _pack_values(value, parts)
+  elif kind is dict:
+    parts.append(_sized.pack('{', len(value)))
+    for item in value.iteritems():
+      _pack_values(item, parts)
+  else:
+    raise ValueError('cannot encode values of %s' % kind)
+
+
+def _unpack_values(data, position, count, depth):
+  '''Returns `(values, position)`: a list of the `count` values packed in
+  string `data` from `position`, and the position following them.
+  '''
+  values = []
+  append = values.append
+  size = len(data)
+  for _ in xrange(count):
+    # the common types are unpacked inline, as in _pack_values.
+    tag = data[position]
+    if tag == 's':
+      start = position + 5
+      position = start + _unpack_length(data, position + 1)[0]
+      if position > size:
+        raise ValueError('malformed record: truncated value')
+      append(data[start:position])
+    elif tag == 'i':
+      append(_unpack_int(data, position + 1)[0])
+      position += 5
+    elif tag == 'N' or tag == 'T' or tag == 'F':
+      append(_constants[tag])
+      position += 1
+    elif tag == 'd':
+      append(_unpack_float(data, position + 1)[0])
+      position += 9
+    else:
+      value, position = _unpack(data, position, depth)
+      append(value)
+  return values, position
+
+
+def _unpack(data, position, depth):
+  '''Returns `(value, position)`: the value packed in string `data` at
+  `position`, and the position following it.
+  '''
+  tag = data[position]
+  if tag == 'N':
+    return None, position + 1
+  if tag == 'T':
+    return True, position + 1
+  if tag == 'F':
+    return False, position + 1
+  if tag == 'i':
+    return _int.unpack_from(data, position)[1], position + _int.size
+  if tag == 'q':
+    return _long.unpack_from(data, position)[1], position + _long.size
+  if tag == 'd':
+    return _float.unpack_from(data, position)[1], position + _float.size
+
+  length = _sized.unpack_from(data, position)[1]
+  position += _sized.size
+  if tag in 'suL':
+    end = position + length
+    if end > len(data):
+      raise ValueError('malformed record: truncated value')
+    value = data[position:end]
+    if tag == 'u':
+      value = value.decode('utf-8')
+    elif tag == 'L':
+      if not value.lstrip('-').isdigit():
+        raise ValueError('malformed record: invalid integer')
+      value = long(value)
+    return value, end
+
+  if tag not in '[({':
+    raise ValueError('malformed record: unknown type tag %r' % tag)
+  if depth <= 0:
+    raise ValueError('malformed record: values nested too deeply')
+
+  # every value takes a byte at least.
+  count = length * 2 if tag == '{' else length
+  if position + count > len(data):
+    raise ValueError('malformed record: truncated value')
+
+  values, position = _unpack_values(data, position, count, depth - 1)
+  if tag == '[':
+    return values, position
+  if tag == '(':
+    return tuple(values), position
+  return dict(zip(values[::2], values[1::2])), position
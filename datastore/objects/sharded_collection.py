@@ -0,0 +1,126 @@
+import zlib
+import urllib
+
+from .model import Key
+from .collection import Collection
+
+
+class ShardedCollection(Collection):
+  '''Collection whose member list is split across `shards` directories
+  (buckets), each listing the members whose name hashes to it.
+
+  Collection keeps all members in a single directory, which add and remove
+  read and rewrite whole, so their cost grows with the collection. Here they
+  only rewrite one bucket, about `1 / shards` of the collection. Choose
+  `shards` so that buckets stay small (say, under a few thousand members).
+
+  Buckets are stored under `key.child('_shards')`. `keys` and `page` list the
+  members a bucket at a time: in order of insertion within each bucket, but
+  not overall. Pages only read the buckets they list (rather than querying
+  the member markers, as Collection's do), so their cost depends on the size
+  of buckets rather than of the collection, whatever the datastore.
+
+  The bucket of a member must not change, so neither must `shards` once the
+  collection has members.
+  '''
+
+  # number of buckets members are split across.
+  shards = 256
+
+  def __init__(self, key, datastore, shards=None, **kwargs):
+    super(ShardedCollection, self).__init__(key, datastore, **kwargs)
+    if shards:
+      self.shards = int(shards)
+
+
+  def shard_keys(self):
+    '''Returns the keys of the bucket directories.'''
+    shards_key = self.key.child('_shards')
+    return [shards_key.instance(str(shard)) for shard in xrange(self.shards)]
+
+
+  def shard(self, collection_instance_key):
+    '''Returns the number of the bucket listing `collection_instance_key`.'''
+    # crc32 is stable across processes and platforms, unlike hash().
+    name = collection_instance_key.name
+    if isinstance(name, unicode):
+      name = name.encode('utf-8')
+    return (zlib.crc32(name) & 0xffffffff) % self.shards
+
+
+  def page(self, cursor=None, limit=None):
+    '''Returns `(keys, cursor)`: the keys of up to `limit` (default:
+    `page_size`) members following `cursor` (or the first ones), and the
+    cursor of the next page, or None after the last page.
+
+    Cursors are strings naming the position of the next page, and the members
+    around it. If members are removed meanwhile, the next page resumes after
+    the last member listed, or at the first member not listed yet.
+
+    Overrides Collection.page, listing members from the buckets rather than
+    the markers: each page reads whole only the buckets it lists members from.
+    '''
+    limit = limit or self.page_size
+    directory_keys = self._directory_keys()
+    directory, position, last, following = self._parse_cursor(cursor)
+
+    keys = []
+    while directory < len(directory_keys) and len(keys) < limit:
+      items = self.directory_datastore.get(directory_keys[directory]) or []
+      start = self._resume_position(items, position, last, following)
+      listed = items[start:start + limit - len(keys)]
+      keys.extend(listed)
+
+      position = start + len(listed)
+      if position < len(items):
+        last, following = items[position - 1], items[position]
+      else:
+        directory, position, last, following = directory + 1, 0, '', ''
+
+    if directory >= len(directory_keys):
+      cursor = None
+    else:
+      cursor = '%d:%d:%s:%s' % (directory, position,
+          urllib.quote(last, safe=''), urllib.quote(following, safe=''))
+    return map(Key, keys), cursor
+
+
+  def _parse_cursor(self, cursor):
+    '''Returns the `(directory, position, last, following)` named by
+    `cursor`.
+    '''
+    if not cursor:
+      return 0, 0, '', ''
+
+    try:
+      directory, position, last, following = cursor.split(':')
+      return (int(directory), int(position), urllib.unquote(last),
+          urllib.unquote(following))
+    except ValueError:
+      raise ValueError('invalid collection cursor: %r' % cursor)
+
+
+  def _resume_position(self, items, position, last, following):
+    '''Returns the position in directory `items` following member `last`
+    (which was at `position - 1`), or else that of member `following`.
+    '''
+    if position == 0 or items[position - 1:position] == [last]:
+      return position
+    if last in items:
+      return items.index(last) + 1
+    if following in items:
+      return items.index(following)
+
+    # both were removed: resume at their position.
+    return min(position, len(items))
+
+
+  def _directory_key(self, collection_instance_key):
+    '''Overrides Collection._directory_key'''
+    shard = self.shard(collection_instance_key)
+    return self.key.child('_shards').instance(str(shard))
+
+
+  def _directory_keys(self):
+    '''Overrides Collection._directory_keys'''
+    return self.shard_keys()
@@ -30,6 +30,33 @@ class TestObjects(unittest.TestCase):
   def test_has_manager(self):
     self.assertTrue(hasattr(objects, 'Manager'))
 
+  def test_has_async_manager(self):
+    self.assertTrue(hasattr(objects, 'AsyncManager'))
+
+  def test_has_async_object_datastore(self):
+    self.assertTrue(hasattr(objects, 'AsyncObjectDatastore'))
+
+  def test_has_identity_map(self):
+    self.assertTrue(hasattr(objects, 'IdentityMap'))
+
+  def test_has_query_plan(self):
+    self.assertTrue(hasattr(objects, 'QueryPlan'))
+
+  def test_has_bulk_loader(self):
+    self.assertTrue(hasattr(objects, 'BulkLoader'))
+
+  def test_has_exporter(self):
+    self.assertTrue(hasattr(objects, 'Exporter'))
+
+  def test_has_instrumentation(self):
+    self.assertTrue(hasattr(objects, 'Instrumentation'))
+
+  def test_has_key_cache(self):
+    self.assertTrue(hasattr(objects, 'KeyCache'))
+
+  def test_has_record_codec(self):
+    self.assertTrue(hasattr(objects, 'RecordCodec'))
+
 
 if __name__ == '__main__':
   unittest.main()
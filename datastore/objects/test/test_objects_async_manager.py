@@ -0,0 +1,120 @@
+import time
+import unittest
+import datastore
+
+from .. import async_manager
+from ..async_manager import AsyncManager
+from ..collection_manager import CollectionManager
+from ..identity_map import IdentityMap
+from ..manager import Manager
+from ..model import Key
+from ..model import Model
+
+
+class TestAsyncManager(unittest.TestCase):
+
+  def test_exists(self):
+    self.assertTrue(hasattr(async_manager, 'AsyncManager'))
+
+
+  def test_is_class(self):
+    self.assertTrue(isinstance(AsyncManager, type))
+
+
+  def test_construct(self):
+    class Foo(Model): pass
+
+    im = IdentityMap()
+    mgr = AsyncManager(datastore.DictDatastore(), model=Foo, workers=2,
+        identity_map=im)
+    self.assertTrue(isinstance(mgr.manager, Manager))
+    self.assertTrue(mgr.model is Foo)
+    self.assertTrue(mgr.manager.identity_map is im)
+    self.assertEqual(mgr.workers, 2)
+    self.assertEqual(mgr.key('bar'), Key('/foo:bar'))
+
+
+  def test_get_put_delete_contains(self):
+    class Foo(Model): pass
+
+    ds = datastore.DictDatastore()
+    mgr = AsyncManager(ds, model=Foo)
+    instance = Foo.withData({'key': '/foo:bar', 'foo': 'bar'})
+
+    self.assertEqual(mgr.contains('bar').get(), False)
+    mgr.put(instance).get()
+    self.assertEqual(mgr.contains('bar').get(), True)
+    self.assertEqual(mgr.get('bar').get().data, instance.data)
+    mgr.delete('bar').get()
+    self.assertEqual(mgr.get('bar').get(), None)
+
+
+  def test_errors_raise_on_get(self):
+    mgr = AsyncManager(datastore.DictDatastore())
+    result = mgr.put('not a model')
+    self.assertRaises(TypeError, result.get)
+
+
+  def test_batch_calls(self):
+    class Foo(Model): pass
+
+    ds = datastore.DictDatastore()
+    mgr = AsyncManager(ds, model=Foo)
+    instances = [Foo('bar%d' % i) for i in range(3)]
+
+    mgr.put_many(instances).get()
+    results = mgr.get_many(['bar0', 'bar1', 'bar2', 'bar3']).get()
+    self.assertEqual([r.data for r in results[:3]],
+        [i.data for i in instances])
+    self.assertEqual(results[3], None)
+
+    mgr.delete_many(['bar0']).get()
+    self.assertFalse(ds.contains(Key('/foo:bar0')))
+
+
+  def test_calls_run_concurrently(self):
+    class SlowManager(Manager):
+      def get(self, key):
+        time.sleep(0.02)
+        return super(SlowManager, self).get(key)
+
+    class SlowAsyncManager(AsyncManager):
+      Manager = SlowManager
+
+    mgr = SlowAsyncManager(datastore.DictDatastore(), workers=8)
+    start = time.time()
+    results = [mgr.get('bar%d' % i) for i in range(8)]
+    self.assertEqual([r.get() for r in results], [None] * 8)
+    self.assertTrue(time.time() - start < 0.16)
+
+
+  def test_query(self):
+    class Foo(Model): pass
+
+    mgr = AsyncManager(datastore.DictDatastore(), model=Foo, read_ahead=2)
+    for i in range(10):
+      mgr.put(Foo.withData({'key': '/foo:bar%d' % i, 'foo': i})).get()
+
+    query = mgr.init_query().order('+foo')
+    results = list(mgr.query(query))
+    self.assertEqual([r.data['foo'] for r in results], range(10))
+
+
+  def test_instances(self):
+    class Foo(Model): pass
+
+    class AsyncCollectionManager(AsyncManager):
+      Manager = CollectionManager
+
+    mgr = AsyncCollectionManager(datastore.DictDatastore(), model=Foo)
+    instances = [Foo('bar%d' % i) for i in range(5)]
+    for instance in instances:
+      mgr.put(instance).get()
+
+    results = list(mgr.instances)
+    self.assertEqual([r.data for r in results], [i.data for i in instances])
+
+
+
+if __name__ == '__main__':
+  unittest.main()
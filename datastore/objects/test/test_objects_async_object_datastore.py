@@ -0,0 +1,165 @@
+import time
+import unittest
+import datastore
+
+from .. import async_object_datastore
+from ..async_object_datastore import AsyncObjectDatastore
+from ..model import Key
+from ..model import Model
+from ..object_datastore import ObjectDatastore
+
+
+class ReadyResult(object):
+  '''Result object of a call that already completed.'''
+
+  def __init__(self, value):
+    self.value = value
+
+  def ready(self):
+    return True
+
+  def wait(self, timeout=None):
+    pass
+
+  def get(self, timeout=None):
+    return self.value
+
+
+
+class AsyncDictDatastore(datastore.DictDatastore):
+  '''DictDatastore with native asynchronous calls, recording their use.'''
+
+  def __init__(self):
+    super(AsyncDictDatastore, self).__init__()
+    self.async_calls = []
+
+  def get_async(self, key):
+    self.async_calls.append('get')
+    return ReadyResult(self.get(key))
+
+  def put_async(self, key, value):
+    self.async_calls.append('put')
+    return ReadyResult(self.put(key, value))
+
+  def delete_async(self, key):
+    self.async_calls.append('delete')
+    return ReadyResult(self.delete(key))
+
+  def contains_async(self, key):
+    self.async_calls.append('contains')
+    return ReadyResult(self.contains(key))
+
+
+
+class SlowDictDatastore(datastore.DictDatastore):
+
+  def get(self, key):
+    time.sleep(0.02)
+    return super(SlowDictDatastore, self).get(key)
+
+
+
+class TestAsyncObjectDatastore(unittest.TestCase):
+
+  def test_exists(self):
+    self.assertTrue(hasattr(async_object_datastore, 'AsyncObjectDatastore'))
+
+
+  def test_is_class(self):
+    self.assertTrue(isinstance(AsyncObjectDatastore, type))
+
+
+  def test_construct(self):
+    class Foo(Model): pass
+
+    ads = AsyncObjectDatastore(datastore.DictDatastore(), model=Foo,
+        workers=3, read_ahead=5, isolation='copy')
+    self.assertTrue(isinstance(ads.datastore, ObjectDatastore))
+    self.assertTrue(ads.model is Foo)
+    self.assertEqual(ads.datastore.isolation, 'copy')
+    self.assertEqual(ads.workers, 3)
+    self.assertEqual(ads.read_ahead, 5)
+
+    ods = ObjectDatastore(datastore.DictDatastore())
+    self.assertTrue(AsyncObjectDatastore(ods).datastore is ods)
+
+
+  def test_get_put_delete_contains(self):
+    dds = datastore.DictDatastore()
+    ads = AsyncObjectDatastore(dds)
+    key = Key('/model:foo')
+    instance = Model.withData({'key': str(key), 'foo': 'bar'})
+
+    self.assertEqual(ads.contains(key).get(), False)
+    self.assertEqual(ads.put(key, instance).get(), None)
+    self.assertEqual(dds.get(key), instance.data)
+    self.assertEqual(ads.contains(key).get(), True)
+    self.assertEqual(ads.get(key).get().data, instance.data)
+    ads.delete(key).get()
+    self.assertEqual(ads.get(key).get(), None)
+
+
+  def test_batch_calls(self):
+    dds = datastore.DictDatastore()
+    ads = AsyncObjectDatastore(dds)
+    instances = [Model('%d' % i) for i in range(3)]
+
+    ads.put_many((i.key, i) for i in instances).get()
+    results = ads.get_many(i.key for i in instances).get()
+    self.assertEqual([r.data for r in results], [i.data for i in instances])
+
+    ads.delete_many([instances[0].key]).get()
+    self.assertFalse(dds.contains(instances[0].key))
+
+
+  def test_calls_run_concurrently(self):
+    dds = SlowDictDatastore()
+    ads = AsyncObjectDatastore(dds, workers=8)
+    keys = [Key('/model:%d' % i) for i in range(8)]
+    for key in keys:
+      dds.put(key, {'key': str(key)})
+
+    start = time.time()
+    results = [ads.get(key) for key in keys]
+    self.assertEqual([r.get().key for r in results], keys)
+    self.assertTrue(time.time() - start < 0.16)
+
+
+  def test_uses_native_async_calls(self):
+    ads_child = AsyncDictDatastore()
+    ads = AsyncObjectDatastore(ads_child)
+    key = Key('/model:foo')
+    instance = Model.withData({'key': str(key), 'foo': {'bar': 'biz'}})
+
+    ads.put(key, instance).get()
+    self.assertEqual(ads_child.get(key), instance.data)
+    self.assertFalse(ads_child.get(key) is instance.data)
+
+    result = ads.get(key)
+    self.assertTrue(result.ready())
+    self.assertTrue(isinstance(result.get(), Model))
+    self.assertEqual(result.get().data, instance.data)
+
+    self.assertEqual(ads.contains(key).get(), True)
+    ads.delete(key).get()
+    self.assertEqual(ads.get(key).get(), None)
+    self.assertEqual(ads_child.async_calls,
+        ['put', 'get', 'contains', 'delete', 'get'])
+
+
+  def test_query(self):
+    dds = datastore.DictDatastore()
+    ads = AsyncObjectDatastore(dds, read_ahead=2)
+    for i in range(10):
+      key = Key('/model:%d' % i)
+      dds.put(key, {'key': str(key), 'foo': i})
+
+    query = datastore.Query(Key('/model')).order('+foo')
+    results = list(ads.query(query))
+    self.assertEqual([r.data['foo'] for r in results], range(10))
+    self.assertTrue(all(isinstance(r, Model) for r in results))
+
+
+
+if __name__ == '__main__':
+  unittest.main()
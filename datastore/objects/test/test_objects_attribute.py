@@ -6,12 +6,35 @@ from datastore.core.serialize import NonSerializer
 
 from .. import attribute
 from ..attribute import Attribute
+from ..attribute import AttributeAccessor
+from ..util import missing
 
 
 class Object(object):
   '''Need to subclass object to be able to add attributes'''
 
 
+class DataObject(object):
+  '''Keeps attribute values in a `data` dict, as Model does.'''
+
+  def __init__(self):
+    self.data = {}
+
+
+class CountingSerializer(object):
+  '''json serializer counting the values it decodes.'''
+
+  def __init__(self):
+    self.loaded = 0
+
+  def loads(self, value):
+    self.loaded += 1
+    return json.loads(value)
+
+  def dumps(self, value):
+    return json.dumps(value)
+
+
 class TestAttribute(unittest.TestCase):
 
   def test_exists(self):
@@ -41,6 +64,21 @@ class TestAttribute(unittest.TestCase):
     self.assertEqual(a.data_type, int)
     self.assertEqual(a.serializer, json)
 
+  def test_construct_indexed(self):
+    self.assertFalse(Attribute().indexed)
+    self.assertTrue(Attribute(indexed=1).indexed)
+
+  def test_stored_value(self):
+    self.assertEqual(Attribute().stored_value(5), '5')
+    self.assertEqual(Attribute(data_type=int).stored_value('5'), 5)
+    self.assertEqual(Attribute(serializer=json).stored_value('a'), '"a"')
+    self.assertEqual(Attribute().stored_value(None), None)
+
+  def test_construct_cache(self):
+    self.assertFalse(Attribute(serializer=json).cache)
+    self.assertTrue(Attribute(serializer=json, cache=True).cache)
+    self.assertFalse(Attribute(cache=True).cache)
+
 
   # attr raw get/set
 
@@ -229,6 +267,40 @@ class TestAttribute(unittest.TestCase):
     m._foo = '"bar"'
     self.assertEqual(m.foo, 'bar')
 
+  def test_get_cls_member_serializer_cached(self):
+    serializer = CountingSerializer()
+    class Foo(object):
+      foo = Attribute(name='foo', serializer=serializer, data_type=list,
+          cache=True)
+
+    m = Foo()
+    m._foo = '["bar"]'
+    self.assertEqual(m.foo, ['bar'])
+    self.assertTrue(m.foo is m.foo)
+    self.assertEqual(serializer.loaded, 1)
+
+    # a different stored value is decoded again.
+    m._foo = '["biz"]'
+    self.assertEqual(m.foo, ['biz'])
+    self.assertEqual(serializer.loaded, 2)
+
+    m.foo = ['baz']
+    self.assertFalse('foo' in m._decoded)
+    self.assertEqual(m.foo, ['baz'])
+    self.assertEqual(serializer.loaded, 3)
+
+  def test_get_cls_member_serializer_not_cached(self):
+    serializer = CountingSerializer()
+    class Foo(object):
+      foo = Attribute(name='foo', serializer=serializer)
+
+    m = Foo()
+    m._foo = '["bar"]'
+    self.assertEqual(m.foo, ['bar'])
+    self.assertFalse(m.foo is m.foo)
+    self.assertEqual(serializer.loaded, 3)
+    self.assertFalse(hasattr(m, '_decoded'))
+
 
   # descriptor __set__ direct
 
@@ -304,6 +376,18 @@ class TestAttribute(unittest.TestCase):
     m.foo = 'bar'
     self.assertEqual(m._foo, '"bar"')
 
+  def test_set_cls_member_marks_dirty(self):
+    class Foo(object):
+      foo = Attribute(name='foo')
+
+    m = Foo()
+    m.foo = 'bar'
+    self.assertFalse(hasattr(m, '_dirty'))
+
+    m._dirty = set()
+    m.foo = 'biz'
+    self.assertEqual(m._dirty, set(['foo']))
+
   def test_set_cls_member_type_coercion(self):
     class Foo(object):
       foo = Attribute(name='foo')
@@ -334,5 +418,189 @@ class TestAttribute(unittest.TestCase):
 
 
 
+
+class TestAttributeAccessor(unittest.TestCase):
+
+  def accessor_class(self, **kwargs):
+    '''Returns a DataObject class with an accessor `foo` for an Attribute.'''
+    attr = kwargs.pop('attribute', None) or Attribute(name='foo', **kwargs)
+    class Foo(DataObject):
+      foo = AttributeAccessor.compile(attr)
+    return Foo
+
+
+  def test_exists(self):
+    self.assertTrue(hasattr(attribute, 'AttributeAccessor'))
+
+
+  def test_compile(self):
+    attr = Attribute(name='foo')
+    accessor = AttributeAccessor.compile(attr)
+    self.assertTrue(isinstance(accessor, AttributeAccessor))
+    self.assertTrue(accessor.attribute is attr)
+
+
+  def test_compile_specializes_per_attribute(self):
+    a = AttributeAccessor.compile(Attribute(name='foo'))
+    b = AttributeAccessor.compile(Attribute(name='foo'))
+    self.assertFalse(type(a) is type(b))
+
+
+  def test_compile_skips_custom_storage(self):
+    class RawAttribute(Attribute):
+      def _attr_raw_get(self, instance, name, default=None):
+        return 'raw'
+
+    class GetAttribute(Attribute):
+      def __get__(self, instance, model_class):
+        return 'get'
+
+    self.assertEqual(AttributeAccessor.compile(RawAttribute(name='foo')), None)
+    self.assertEqual(AttributeAccessor.compile(GetAttribute(name='foo')), None)
+
+
+  def test_get(self):
+    Foo = self.accessor_class()
+    m = Foo()
+    self.assertEqual(m.foo, None)
+    m.data['foo'] = 'bar'
+    self.assertEqual(m.foo, 'bar')
+
+  def test_get_default(self):
+    Foo = self.accessor_class(default='biz')
+    m = Foo()
+    self.assertEqual(m.foo, 'biz')
+    m.data['foo'] = None
+    self.assertEqual(m.foo, 'biz')
+    m.data['foo'] = 'bar'
+    self.assertEqual(m.foo, 'bar')
+
+  def test_get_serializer(self):
+    Foo = self.accessor_class(serializer=json)
+    m = Foo()
+    m.data['foo'] = '"bar"'
+    self.assertEqual(m.foo, 'bar')
+
+  def test_get_from_class(self):
+    Foo = self.accessor_class(default='biz')
+    self.assertEqual(Foo.foo, 'biz')
+
+
+  def test_set(self):
+    Foo = self.accessor_class()
+    m = Foo()
+    m.foo = 'bar'
+    self.assertEqual(m.data['foo'], 'bar')
+
+  def test_set_serializer(self):
+    Foo = self.accessor_class(serializer=json)
+    m = Foo()
+    m.foo = 'bar'
+    self.assertEqual(m.data['foo'], '"bar"')
+    self.assertEqual(m.foo, 'bar')
+
+  def test_set_marks_dirty(self):
+    Foo = self.accessor_class()
+    m = Foo()
+    m.foo = 'bar'
+    self.assertFalse(hasattr(m, '_dirty'))
+
+    m._dirty = set()
+    m.foo = 'biz'
+    self.assertEqual(m._dirty, set(['foo']))
+
+  def test_set_type_coercion(self):
+    Foo = self.accessor_class()
+    m = Foo()
+    m.foo = 5
+    self.assertEqual(m.data['foo'], '5')
+
+    Foo = self.accessor_class(data_type=int)
+    m = Foo()
+    m.foo = '5'
+    self.assertEqual(m.data['foo'], 5)
+    with self.assertRaises(TypeError):
+      m.foo = 'five'
+
+  def test_set_type_not_required(self):
+    Foo = self.accessor_class(required=False)
+    m = Foo()
+    m.foo = 'bar'
+    self.assertEqual(m.data['foo'], 'bar')
+    m.foo = None
+    self.assertEqual(m.data['foo'], None)
+
+  def test_set_type_required(self):
+    Foo = self.accessor_class(required=True)
+    m = Foo()
+    m.foo = 'bar'
+    self.assertEqual(m.data['foo'], 'bar')
+    with self.assertRaises(ValueError):
+      m.foo = None
+
+
+  def test_custom_value_methods(self):
+    class EmptyStringAttribute(Attribute):
+      def is_empty_value(self, value):
+        return not value
+
+      def validated_value(self, value):
+        value = super(EmptyStringAttribute, self).validated_value(value)
+        return value.upper() if value else value
+
+    Foo = self.accessor_class(
+        attribute=EmptyStringAttribute(name='foo', default='biz'))
+    m = Foo()
+    m.foo = 'bar'
+    self.assertEqual(m.data['foo'], 'BAR')
+    m.foo = ''
+    self.assertEqual(m.data['foo'], '')
+    self.assertEqual(m.foo, 'biz')
+
+
+  def test_compile_index(self):
+    class Foo(object):
+      foo = AttributeAccessor.compile(Attribute(name='foo', default='biz'), 1)
+      def __init__(self):
+        self._values = [None, missing, None]
+
+    self.assertEqual(Foo.__dict__['foo'].index, 1)
+    m = Foo()
+    self.assertEqual(m.foo, 'biz')
+    m.foo = 'bar'
+    self.assertEqual(m._values, [None, 'bar', None])
+    self.assertEqual(m.foo, 'bar')
+    m.foo = None
+    self.assertEqual(m.foo, 'biz')
+
+
+  def test_get_serializer_cached(self):
+    serializer = CountingSerializer()
+    Foo = self.accessor_class(serializer=serializer, data_type=list,
+        cache=True)
+    m = Foo()
+    m.data['foo'] = '["bar"]'
+    self.assertTrue(m.foo is m.foo)
+    self.assertEqual(serializer.loaded, 1)
+
+    m.data['foo'] = '["biz"]'
+    self.assertEqual(m.foo, ['biz'])
+    self.assertEqual(serializer.loaded, 2)
+
+    m.foo = ['baz']
+    self.assertFalse('foo' in m._decoded)
+    self.assertEqual(m.foo, ['baz'])
+    self.assertEqual(serializer.loaded, 3)
+
+  def test_get_serializer_not_cached(self):
+    serializer = CountingSerializer()
+    Foo = self.accessor_class(serializer=serializer)
+    m = Foo()
+    m.data['foo'] = '["bar"]'
+    self.assertFalse(m.foo is m.foo)
+    self.assertEqual(serializer.loaded, 2)
+
+
+
 if __name__ == '__main__':
   unittest.main()
@@ -6,6 +6,7 @@ from .. import attribute_metaclass
 from ..attribute_metaclass import AttributeMetaclass
 from ..attribute_metaclass import DuplicateAttributeError
 from ..attribute import Attribute
+from ..attribute import AttributeAccessor
 
 
 
@@ -119,6 +120,56 @@ class TestAttributeMetaclass(unittest.TestCase):
 
 
 
+  def test_does_not_compile_attributes_by_default(self):
+    class Model(object):
+      __metaclass__ = AttributeMetaclass
+      foo = Attribute()
+
+    self.assertTrue(isinstance(Model.__dict__['foo'], Attribute))
+
+
+  def test_compiles_attributes(self):
+    class Model(object):
+      __metaclass__ = AttributeMetaclass
+      __compile_attributes__ = True
+      foo = Attribute()
+
+      def __init__(self):
+        self.data = {}
+
+    accessor = Model.__dict__['foo']
+    self.assertTrue(isinstance(accessor, AttributeAccessor))
+    self.assertTrue(accessor.attribute is Model._attributes['foo'])
+
+    m = Model()
+    m.foo = 'bar'
+    self.assertEqual(m.data, {'foo': 'bar'})
+    self.assertEqual(m.foo, 'bar')
+
+
+  def test_compiles_only_own_attributes(self):
+    class Model(object):
+      __metaclass__ = AttributeMetaclass
+      __compile_attributes__ = True
+      foo = Attribute()
+
+    class SubModel(Model):
+      bar = Attribute()
+
+    self.assertFalse('foo' in SubModel.__dict__)
+    self.assertTrue(isinstance(SubModel.__dict__['bar'], AttributeAccessor))
+    self.assertEqual(set(SubModel._attributes), set(['foo', 'bar']))
+
+
+  def test_does_not_compile_renamed_attributes(self):
+    class Model(object):
+      __metaclass__ = AttributeMetaclass
+      __compile_attributes__ = True
+      foo = Attribute(name='bar')
+
+    self.assertTrue(isinstance(Model.__dict__['foo'], Attribute))
+
+
 
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,223 @@
+import json
+import unittest
+import datastore
+
+from StringIO import StringIO
+
+from .. import bulk_loader
+from ..attribute import Attribute
+from ..bulk_loader import BulkLoader
+from ..collection_manager import CollectionManager
+from ..identity_map import IdentityMap
+from ..instrumentation import Instrumentation
+from ..manager import Manager
+from ..model import Key
+from ..model import Model
+from .test_objects_object_datastore import BatchDictDatastore
+
+
+class Person(Model):
+  name = Attribute(required=True)
+  age = Attribute(data_type=int, indexed=True)
+  city = Attribute(default='Paris')
+  tags = Attribute(data_type=list, serializer=json)
+
+
+def records(count):
+  return [{'key': 'p%d' % i, 'name': 'P%d' % i, 'age': i % 3, 'tags': [i]}
+      for i in range(count)]
+
+
+class TestBulkLoader(unittest.TestCase):
+
+  def test_exists(self):
+    self.assertTrue(hasattr(bulk_loader, 'BulkLoader'))
+
+
+  def test_config(self):
+    mgr = Manager(datastore.DictDatastore(), model=Person)
+    loader = BulkLoader(mgr)
+    self.assertEqual(loader.batch_size, BulkLoader.batch_size)
+    self.assertEqual(loader.workers, BulkLoader.workers)
+    self.assertFalse(loader.skip_invalid)
+
+    loader = BulkLoader(mgr, batch_size=10, workers=3, skip_invalid=True)
+    self.assertEqual(loader.batch_size, 10)
+    self.assertEqual(loader.workers, 3)
+    self.assertTrue(loader.skip_invalid)
+
+
+  def test_load(self):
+    mgr = Manager(datastore.DictDatastore(), model=Person)
+    stats = BulkLoader(mgr, batch_size=4).load(records(10))
+
+    self.assertEqual(stats['parsed'], 10)
+    self.assertEqual(stats['validated'], 10)
+    self.assertEqual(stats['written'], 10)
+    self.assertEqual(stats['invalid'], 0)
+    self.assertEqual(stats['batches'], 3)
+
+    person = mgr.get('p7')
+    self.assertEqual(person.key, Key('/person:p7'))
+    self.assertEqual(person.name, 'P7')
+    self.assertEqual(person.age, 1)
+    self.assertEqual(person.city, 'Paris')
+    self.assertEqual(person.tags, [7])
+
+    # stored as instances store themselves.
+    expected = Person('p7')
+    expected.name = 'P7'
+    expected.age = 1
+    expected.tags = [7]
+    self.assertEqual(mgr.datastore.child_datastore.get(expected.key),
+        expected.data)
+
+
+  def test_load_keys(self):
+    mgr = Manager(datastore.DictDatastore(), model=Person)
+    BulkLoader(mgr).load([
+      {'key': '/person:a', 'name': 'A'},
+      {'key': Key('/person:b'), 'name': 'B'},
+    ])
+    self.assertEqual(mgr.get('a').name, 'A')
+    self.assertEqual(mgr.get('b').name, 'B')
+
+    loader = BulkLoader(mgr)
+    self.assertRaises(TypeError, loader.load, [{'key': '/other:c'}])
+
+
+  def test_batches(self):
+    ds = BatchDictDatastore()
+    mgr = Manager(ds, model=Person)
+    BulkLoader(mgr, batch_size=4).load(records(10))
+    self.assertEqual(ds.batches, [('put', 4), ('put', 4), ('put', 2)])
+
+
+  def test_workers(self):
+    mgr = Manager(datastore.DictDatastore(), model=Person)
+    mgr.build_indexes()
+    stats = BulkLoader(mgr, batch_size=7, workers=4).load(records(100))
+    self.assertEqual(stats['written'], 100)
+    self.assertEqual(stats['batches'], 15)
+    for i in range(100):
+      self.assertEqual(mgr.get('p%d' % i).name, 'P%d' % i)
+
+    # index entries from concurrent batches are all kept.
+    self.assertEqual(len(mgr.find_by('age', 0)), 34)
+    self.assertEqual(len(mgr.datastore.child_datastore.get(
+        mgr.index_key('age', 0))), 34)
+
+
+  def test_collection_manager(self):
+    mgr = CollectionManager(datastore.DictDatastore(), model=Person)
+    stats = BulkLoader(mgr, batch_size=4, workers=2).load(records(10))
+    self.assertEqual(stats['written'], 10)
+
+    # loaded instances are added to the collection.
+    self.assertEqual(mgr.count(), 10)
+    self.assertEqual(sorted(p.name for p in mgr.instances),
+        sorted('P%d' % i for i in range(10)))
+    self.assertTrue(mgr.collection.contains(Key('/person:p3')))
+
+
+  def test_invalid(self):
+    mgr = Manager(datastore.DictDatastore(), model=Person)
+    data = records(5)
+    del data[1]['name']
+    data[3]['age'] = 'old'
+
+    loader = BulkLoader(mgr)
+    self.assertRaises(ValueError, loader.load, data)
+
+    loader = BulkLoader(mgr, skip_invalid=True)
+    stats = loader.load(data)
+    self.assertEqual(stats['parsed'], 5)
+    self.assertEqual(stats['validated'], 3)
+    self.assertEqual(stats['invalid'], 2)
+    self.assertEqual(len(loader.errors), 2)
+    self.assertEqual(mgr.get('p1'), None)
+    self.assertEqual(mgr.get('p3'), None)
+    self.assertEqual(mgr.get('p4').name, 'P4')
+
+    loader = BulkLoader(mgr, skip_invalid=True)
+    loader.max_errors = 1
+    loader.load(data)
+    self.assertEqual(len(loader.errors), 1)
+
+
+  def test_unknown_fields(self):
+    mgr = Manager(datastore.DictDatastore(), model=Person)
+    BulkLoader(mgr).load([{'key': 'a', 'name': 'A', 'height': 2}])
+    self.assertFalse('height' in mgr.datastore.child_datastore.get(
+        Key('/person:a')))
+
+
+  def test_index(self):
+    mgr = Manager(datastore.DictDatastore(), model=Person)
+    mgr.build_indexes()
+    BulkLoader(mgr).load(records(6))
+    self.assertEqual(sorted(p.name for p in mgr.find_by('age', 2)),
+        ['P2', 'P5'])
+
+    # reloading moves instances between index entries.
+    BulkLoader(mgr).load([{'key': 'p2', 'name': 'P2', 'age': 0}])
+    self.assertEqual([p.name for p in mgr.find_by('age', 2)], ['P5'])
+    self.assertEqual(sorted(p.name for p in mgr.find_by('age', 0)),
+        ['P0', 'P2', 'P3'])
+
+
+  def test_instrumentation(self):
+    inst = Instrumentation()
+    mgr = Manager(datastore.DictDatastore(), model=Person,
+        instrumentation=inst)
+    BulkLoader(mgr, batch_size=4).load(records(10))
+    operations = inst.stats()['operations']
+    self.assertEqual(operations['object_datastore.put_records']['count'], 3)
+
+
+  def test_identity_map(self):
+    mgr = Manager(datastore.DictDatastore(), model=Person,
+        identity_map=IdentityMap())
+    BulkLoader(mgr).load([{'key': 'a', 'name': 'A'}])
+    self.assertEqual(mgr.get('a').name, 'A')
+
+    BulkLoader(mgr).load([{'key': 'a', 'name': 'B'}])
+    self.assertEqual(mgr.get('a').name, 'B')
+
+
+  def test_load_ndjson(self):
+    mgr = Manager(datastore.DictDatastore(), model=Person)
+    lines = StringIO('\n'.join(map(json.dumps, records(3))) + '\n\n')
+    stats = BulkLoader(mgr).load_ndjson(lines)
+    self.assertEqual(stats['written'], 3)
+    self.assertEqual(mgr.get('p2').tags, [2])
+
+
+  def test_load_csv(self):
+    mgr = Manager(datastore.DictDatastore(), model=Person)
+    lines = StringIO('key,name,age,city\na,A,3,\nb,B,,Rome\n')
+    stats = BulkLoader(mgr).load_csv(lines)
+    self.assertEqual(stats['written'], 2)
+
+    a = mgr.get('a')
+    self.assertEqual(a.age, 3)
+    self.assertEqual(a.city, 'Paris')
+    b = mgr.get('b')
+    self.assertEqual(b.age, None)
+    self.assertEqual(b.city, 'Rome')
+
+
+  def test_rates(self):
+    mgr = Manager(datastore.DictDatastore(), model=Person)
+    loader = BulkLoader(mgr)
+    self.assertEqual(loader.rates(),
+        {'parse': None, 'validate': None, 'write': None})
+
+    loader.load(records(50))
+    for stage in loader.stages:
+      self.assertTrue(loader.stats['%s_seconds' % stage] >= 0)
+    self.assertEqual(sorted(loader.rates()), ['parse', 'validate', 'write'])
+
+
+if __name__ == '__main__':
+  unittest.main()
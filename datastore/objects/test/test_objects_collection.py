@@ -1,3 +1,5 @@
+import time
+import threading
 import unittest
 import logging
 import datastore
@@ -143,6 +145,293 @@ class TestCollection(unittest.TestCase):
     self.assertEqual(list(coll.keys), [])
 
 
+  def test_add_many_remove_many(self):
+    ds = DictDatastore()
+    coll = Collection(Key('Foo'), ds)
+    ods = ObjectDatastore(coll.directory_datastore)
+    models = [Model('bar%d' % i) for i in range(10)]
+    for model in models:
+      ods.put(model.key, model)
+
+    puts = []
+    put = ds.put
+    def recording_put(key, value):
+      puts.append(key)
+      put(key, value)
+    ds.put = recording_put
+
+    coll.add(models[0])
+    del puts[:]
+    coll.add_many(models + [models[3]])
+    self.assertEqual(puts.count(Key('/Foo')), 1)
+    self.assertEqual(list(coll.keys), [Key('/Foo:bar%d' % i) for i in range(10)])
+    self.assertEqual(coll.count(), 10)
+    self.assertEqual(ods.get(Key('/Foo:bar4')).data, models[4].data)
+
+    del puts[:]
+    coll.remove_many([models[2].key, models[5], models[2]])
+    self.assertEqual(puts.count(Key('/Foo')), 1)
+    self.assertEqual(len(list(coll.keys)), 8)
+    self.assertEqual(coll.count(), 8)
+    self.assertFalse(coll.contains(models[5]))
+    self.assertIsNone(ods.get(Key('/Foo:bar5')))
+
+    # no changes, no rewrites.
+    del puts[:]
+    coll.add_many(models[:2])
+    coll.remove_many([models[2]])
+    self.assertEqual(puts.count(Key('/Foo')), 0)
+
+
+  def test_clear(self):
+    coll = Collection(Key('Foo'), DictDatastore())
+    coll.clear()
+    coll.add_many([Model('bar%d' % i) for i in range(5)])
+    coll.clear()
+    self.assertEqual(list(coll.keys), [])
+    self.assertEqual(coll.count(), 0)
+    self.assertFalse(coll.contains(Model('bar1')))
+
+
+  def test_contains_count(self):
+    coll = Collection(Key('Foo'), DictDatastore())
+    bar = Model('bar')
+    baz = Model('baz')
+    self.assertEqual(coll.count(), 0)
+    self.assertFalse(coll.contains(bar))
+
+    coll.add(bar)
+    coll.add(baz)
+    coll.add(bar)
+    self.assertEqual(coll.count(), 2)
+    self.assertTrue(coll.contains(bar))
+    self.assertTrue(coll.contains(baz.key))
+    self.assertTrue(coll.contains(Key('/Foo:baz')))
+    self.assertFalse(coll.contains(Model('qux')))
+
+    coll.remove(bar)
+    coll.remove(bar)
+    self.assertEqual(coll.count(), 1)
+    self.assertFalse(coll.contains(bar))
+    self.assertTrue(coll.contains(baz))
+
+
+  def test_contains_count_without_directory(self):
+    coll = Collection(Key('Foo'), DictDatastore())
+    coll.add(Model('bar'))
+    coll.directory_datastore.get = None
+    self.assertTrue(coll.contains(Model('bar')))
+    self.assertEqual(coll.count(), 1)
+
+
+  def test_recount(self):
+    ds = DictDatastore()
+    coll = Collection(Key('Foo'), ds)
+    for name in ['bar', 'baz', 'qux']:
+      coll.add(Model(name))
+
+    # as kept before markers and counts.
+    for name in ['bar', 'baz', 'qux']:
+      ds.delete(Key('/Foo/_members:%s' % name))
+    ds.delete(Key('/Foo/_meta:count'))
+    self.assertEqual(coll.count(), 0)
+    self.assertFalse(coll.contains(Model('bar')))
+
+    coll.recount()
+    self.assertEqual(coll.count(), 3)
+    self.assertTrue(coll.contains(Model('bar')))
+    self.assertEqual(ds.get(Key('/Foo/_members:bar')), '/Foo/_members:bar')
+    self.assertEqual(coll.page()[0],
+        map(Key, ['/Foo:bar', '/Foo:baz', '/Foo:qux']))
+
+
+  def test_count_not_queried(self):
+    ds = DictDatastore()
+    coll = Collection(Key('Foo'), ds)
+    coll.add(Model('bar'))
+    self.assertEqual(coll.count(), 1)
+    # the count is not among the records of /Foo instances.
+    self.assertFalse(1 in list(ds.query(datastore.Query(Key('/Foo')))))
+
+
+  def test_count_concurrent(self):
+    coll = Collection(Key('Foo'), DictDatastore())
+    models = [Model('bar%d' % i) for i in range(40)]
+    threads = [threading.Thread(target=coll.add, args=(m,)) for m in models]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(coll.count(), 40)
+    self.assertEqual(len(list(coll.keys)), 40)
+
+
+  def test_page(self):
+    coll, models = self._collection_with_models(7)
+    keys = list(coll.keys)
+
+    page, cursor = coll.page(limit=3)
+    self.assertEqual(page, keys[:3])
+    page, cursor = coll.page(cursor, limit=3)
+    self.assertEqual(page, keys[3:6])
+    page, cursor = coll.page(cursor, limit=3)
+    self.assertEqual(page, keys[6:])
+    self.assertEqual(cursor, None)
+
+    page, cursor = coll.page(limit=6)
+    self.assertEqual(page, keys[:6])
+    self.assertEqual(coll.page(cursor, limit=1), ([keys[6]], None))
+    self.assertEqual(coll.page(limit=7), (keys, None))
+
+    coll.page_size = 5
+    self.assertEqual(coll.page()[0], keys[:5])
+    self.assertEqual(Collection(Key('Foo'), DictDatastore()).page(),
+        ([], None))
+    self.assertRaises(ValueError, coll.page, 'bad')
+    self.assertRaises(ValueError, coll.page, 'a:b:c:d')
+
+
+  def test_page_after_removals(self):
+    coll, models = self._collection_with_models(8)
+    keys = list(coll.keys)
+    page, cursor = coll.page(limit=4)
+
+    # removing listed members does not skip or repeat others.
+    coll.remove(models[1])
+    coll.remove(models[2])
+    page, next_cursor = coll.page(cursor, limit=2)
+    self.assertEqual(page, keys[4:6])
+
+    # nor does removing the last member listed.
+    coll.remove(models[5])
+    self.assertEqual(coll.page(next_cursor)[0], keys[6:])
+
+    # nor does removing members before and after the cursor.
+    coll, models = self._collection_with_models(8)
+    keys = list(coll.keys)
+    page, cursor = coll.page(limit=4)
+    coll.remove(models[0])
+    coll.remove(models[4])
+    self.assertEqual(coll.page(cursor)[0], keys[5:])
+
+
+  def test_page_reads_only_page(self):
+    coll, models = self._collection_with_models(10)
+    page, cursor = coll.page(limit=4)
+
+    fetched = []
+    get = coll.directory_datastore.get
+    def recording_get(key):
+      fetched.append(key)
+      return get(key)
+    coll.directory_datastore.get = recording_get
+
+    instances, cursor = coll.page_instances(cursor, limit=4)
+    self.assertEqual([i.data for i in instances], [m.data for m in models[4:8]])
+    # the instances only: the directory is not read.
+    self.assertEqual(fetched, [Key('/Foo:bar%d' % i) for i in range(4, 8)])
+
+
+  def test_page_queries_markers(self):
+    class QueryDictDatastore(DictDatastore):
+      def query(self, query):
+        queries.append(query)
+        return super(QueryDictDatastore, self).query(query)
+
+    queries = []
+    coll = Collection(Key('Foo'), QueryDictDatastore())
+    for name in ['c', 'a', 'd', 'b']:
+      coll.add(Model(name))
+
+    # members are listed in key order, from a key-range query.
+    page, cursor = coll.page(limit=2)
+    self.assertEqual(page, [Key('/Foo:a'), Key('/Foo:b')])
+    self.assertEqual(coll.page(cursor), ([Key('/Foo:c'), Key('/Foo:d')], None))
+    self.assertEqual([(str(q.key), q.limit) for q in queries],
+        [('/Foo/_members', 3), ('/Foo/_members', 101)])
+    self.assertEqual([map(str, q.filters) for q in queries],
+        [[], ['key > /Foo/_members:b']])
+    self.assertEqual(map(str, queries[0].orders), ['+key'])
+
+
+  def test_page_object_datastore(self):
+    class Foo(Model): pass
+
+    coll = Collection(Key('/foo'), ObjectDatastore(DictDatastore(), model=Foo),
+        Model=Foo)
+    for name in ['b', 'a']:
+      coll.add(Foo(name))
+    self.assertEqual(coll.page(), ([Key('/foo:a'), Key('/foo:b')], None))
+
+
+  def test_page_instances_with_workers(self):
+    coll, models = self._collection_with_models(10, workers=3)
+    instances, cursor = coll.page_instances(limit=6)
+    self.assertEqual([i.data for i in instances], [m.data for m in models[:6]])
+    instances, cursor = coll.page_instances(cursor)
+    self.assertEqual([i.data for i in instances], [m.data for m in models[6:]])
+    self.assertEqual(cursor, None)
+
+
+  # concurrent access tests
+
+  def test_construct_with_options(self):
+    class Foo(Model): pass
+
+    coll = Collection(Key('Foo'), DictDatastore())
+    self.assertTrue(coll.Model is Model)
+    self.assertEqual(coll.workers, 1)
+    self.assertEqual(coll.read_ahead, None)
+    self.assertEqual(coll.ordered, True)
+
+    coll = Collection(Key('Foo'), DictDatastore(), Model=Foo, workers=4,
+        read_ahead=16, ordered=False)
+    self.assertTrue(coll.Model is Foo)
+    self.assertEqual(coll.workers, 4)
+    self.assertEqual(coll.read_ahead, 16)
+    self.assertEqual(coll.ordered, False)
+
+
+  def _collection_with_models(self, count, **kwargs):
+    coll = Collection(Key('Foo'), DictDatastore(), **kwargs)
+    ds = ObjectDatastore(coll.directory_datastore)
+    models = [Model('bar%d' % i) for i in range(count)]
+    for model in models:
+      ds.put(model.key, model)
+      coll.add(model)
+    return coll, models
+
+
+  def test_instance_data_generator_with_workers(self):
+    coll, models = self._collection_with_models(20, workers=4)
+    data = list(coll.instance_data_generator())
+    self.assertEqual(data, [m.data for m in models])
+
+    data = list(coll.instance_data_generator(ordered=False))
+    self.assertEqual(sorted(data), sorted(m.data for m in models))
+
+
+  def test_instance_data_generator_overlaps_fetches(self):
+    coll, models = self._collection_with_models(8)
+
+    get = coll.directory_datastore.get
+    def slow_get(key):
+      time.sleep(0.02)
+      return get(key)
+    coll.directory_datastore.get = slow_get
+
+    start = time.time()
+    data = list(coll.instance_data_generator(workers=8))
+    self.assertTrue(time.time() - start < 0.16)
+    self.assertEqual(data, [m.data for m in models])
+
+
+  def test_instances_with_workers(self):
+    coll, models = self._collection_with_models(10, workers=3, read_ahead=2)
+    instances = list(coll.instances)
+    self.assertEqual([i.data for i in instances], [m.data for m in models])
+
+
 
 if __name__ == '__main__':
   unittest.main()
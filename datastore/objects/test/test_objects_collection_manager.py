@@ -2,6 +2,7 @@ import unittest
 import datastore
 
 from .. import collection_manager
+from ..key_cache import KeyCache
 from ..model import Key
 from ..model import Model
 from ..manager import Manager
@@ -40,6 +41,15 @@ class TestCollectionManager(unittest.TestCase):
     mgr = CollectionManager(ds)
     mgr.model = Foo
     self.assertEqual(mgr.key('bar'), Key('/foo:bar'))
+    self.assertEqual(mgr.key(Key('/bar:baz')), Key('/bar:baz'))
+
+    # names are checked as by Model.instanceKey.
+    self.assertRaises(ValueError, mgr.key, 'bar/baz')
+    self.assertRaises(ValueError, mgr.get, 'bar/baz')
+    self.assertRaises(ValueError, mgr.delete, 'bar/baz')
+
+    Foo.__key_cache__ = KeyCache(10)
+    self.assertTrue(mgr.key('bar') is Foo.instanceKey('bar'))
 
 
   def test_collection(self):
@@ -72,6 +82,127 @@ class TestCollectionManager(unittest.TestCase):
     mgr.delete(instance.key)
     self.assertEqual(list(mgr.collection.keys), [])
 
+  def test_instances(self):
+    class Foo(Model): pass
+
+    ds = datastore.DictDatastore()
+    mgr = CollectionManager(ds, model=Foo)
+    instances = [Foo.withData({'key': '/foo:bar%d' % i}) for i in range(3)]
+    for instance in instances:
+      mgr.put(instance)
+
+    results = list(mgr.instances)
+    self.assertEqual(len(results), 3)
+    self.assertTrue(all(isinstance(r, Foo) for r in results))
+    self.assertEqual([r.data for r in results], [i.data for i in instances])
+
+
+  def test_instances_with_concurrent_collection(self):
+    class Foo(Model): pass
+
+    class ConcurrentCollection(Collection):
+      workers = 4
+
+    class FooManager(CollectionManager):
+      Collection = ConcurrentCollection
+
+    mgr = FooManager(datastore.DictDatastore(), model=Foo)
+    instances = [Foo.withData({'key': '/foo:bar%d' % i}) for i in range(10)]
+    for instance in instances:
+      mgr.put(instance)
+
+    results = list(mgr.instances)
+    self.assertEqual([r.data for r in results], [i.data for i in instances])
+
+
+  def test_count(self):
+    class Foo(Model): pass
+
+    mgr = CollectionManager(datastore.DictDatastore(), model=Foo)
+    self.assertEqual(mgr.count(), 0)
+    for name in ['a', 'b', 'c']:
+      mgr.put(Foo(name))
+    mgr.put(Foo('a'))
+    self.assertEqual(mgr.count(), 3)
+
+    mgr.delete(mgr.key('b'))
+    self.assertEqual(mgr.count(), 2)
+    self.assertTrue(mgr.collection.contains(mgr.key('a')))
+    self.assertFalse(mgr.collection.contains(mgr.key('b')))
+
+
+  def test_collection_reused(self):
+    class Foo(Model): pass
+    class Bar(Model): pass
+
+    mgr = CollectionManager(datastore.DictDatastore(), model=Foo)
+    self.assertTrue(mgr.collection is mgr.collection)
+
+    mgr.model = Bar
+    self.assertEqual(mgr.collection.key, Key('/bar'))
+    self.assertTrue(mgr.collection.Model is Bar)
+
+
+  def test_put_many_delete_many(self):
+    class Foo(Model): pass
+
+    ds = datastore.DictDatastore()
+    mgr = CollectionManager(ds, model=Foo)
+
+    puts = []
+    put = ds.put
+    def recording_put(key, value):
+      puts.append(key)
+      put(key, value)
+    ds.put = recording_put
+
+    mgr.put_many(Foo('foo%d' % i) for i in range(20))
+    self.assertEqual(puts.count(Key('/foo')), 1)
+    self.assertEqual(mgr.count(), 20)
+    self.assertEqual([i.key.name for i in mgr.instances],
+        ['foo%d' % i for i in range(20)])
+
+    del puts[:]
+    mgr.delete_many(['foo3', Key('/foo:foo7')])
+    self.assertEqual(puts.count(Key('/foo')), 1)
+    self.assertEqual(mgr.count(), 18)
+    self.assertEqual(mgr.get('foo3'), None)
+    self.assertFalse(mgr.collection.contains(mgr.key('foo7')))
+    self.assertEqual(len(list(mgr.instances)), 18)
+
+
+  def test_delete_discards_index_entries(self):
+    from ..attribute import Attribute
+
+    class Foo(Model):
+      color = Attribute(indexed=True)
+
+    mgr = CollectionManager(datastore.DictDatastore(), model=Foo)
+    for name in ['a', 'b']:
+      foo = Foo(name)
+      foo.color = 'red'
+      mgr.put(foo)
+
+    mgr.delete('a')
+    mgr.delete_many(['b'])
+    child = mgr.datastore.child_datastore
+    self.assertEqual(child.get(mgr.index_key('color', 'red')), None)
+
+
+  def test_truncate(self):
+    class Foo(Model): pass
+
+    mgr = CollectionManager(datastore.DictDatastore(), model=Foo)
+    mgr.put_many(Foo('foo%d' % i) for i in range(12))
+    self.assertEqual(mgr.truncate(batch_size=5), 12)
+    self.assertEqual(mgr.count(), 0)
+    self.assertEqual(list(mgr.instances), [])
+    self.assertEqual(mgr.get('foo1'), None)
+
+    mgr.remove_all_items()
+    self.assertEqual(mgr.count(), 0)
+
+
 
 if __name__ == '__main__':
   unittest.main()
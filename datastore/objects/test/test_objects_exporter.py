@@ -0,0 +1,191 @@
+import json
+import unittest
+import datastore
+
+from StringIO import StringIO
+
+from .. import exporter
+from ..attribute import Attribute
+from ..collection import Collection
+from ..collection_manager import CollectionManager
+from ..exporter import Exporter
+from ..manager import Manager
+from ..model import Key
+from ..model import Model
+from ..object_datastore import ObjectDatastore
+
+
+class Person(Model):
+  name = Attribute()
+  age = Attribute(data_type=int)
+
+
+def manager(count, ds=None):
+  mgr = Manager(ds or datastore.DictDatastore(), model=Person)
+  for i in range(count):
+    person = Person('p%d' % i)
+    person.name = 'P%d' % i
+    person.age = i
+    mgr.put(person)
+  return mgr
+
+
+class TestExporter(unittest.TestCase):
+
+  def stored(self, mgr):
+    return sorted(mgr.datastore.child_datastore.query(mgr.init_query()))
+
+
+  def test_exists(self):
+    self.assertTrue(hasattr(exporter, 'Exporter'))
+
+
+  def test_config(self):
+    mgr = manager(0)
+    exp = Exporter(mgr)
+    self.assertEqual(exp.format, 'ndjson')
+    self.assertEqual(exp.chunk_size, Exporter.chunk_size)
+
+    exp = Exporter(mgr, format='binary', chunk_size=10)
+    self.assertEqual(exp.format, 'binary')
+    self.assertEqual(exp.chunk_size, 10)
+
+    self.assertRaises(ValueError, Exporter, mgr, format='xml')
+    coll = Collection(Key('/people'), datastore.DictDatastore())
+    self.assertRaises(ValueError, Exporter, coll, query=mgr.init_query())
+
+
+  def test_records(self):
+    mgr = manager(5)
+    records = list(Exporter(mgr).records())
+    self.assertEqual(sorted(records), self.stored(mgr))
+    self.assertTrue(all(isinstance(record, dict) for record in records))
+
+
+  def test_query(self):
+    mgr = manager(10)
+    query = mgr.init_query().filter('age', '>=', 7)
+    records = list(Exporter(mgr, query=query).records())
+    self.assertEqual(sorted(r['name'] for r in records), ['P7', 'P8', 'P9'])
+
+
+  def test_chunks(self):
+    mgr = manager(5)
+    exp = Exporter(mgr, chunk_size=2)
+    chunks = list(exp.chunks())
+    self.assertEqual([cursor for cursor, _ in chunks], [2, 4, 5])
+    lines = ''.join(data for _, data in chunks).splitlines()
+    self.assertEqual(sorted(map(json.loads, lines)), self.stored(mgr))
+
+
+  def test_export_ndjson(self):
+    mgr = manager(5)
+    exp = Exporter(mgr)
+    out = StringIO()
+    self.assertEqual(exp.export(out), 5)
+    self.assertEqual(len(out.getvalue().splitlines()), 5)
+
+    out.seek(0)
+    self.assertEqual(sorted(exp.read(out)), self.stored(mgr))
+
+
+  def test_export_binary(self):
+    mgr = manager(5)
+    exp = Exporter(mgr, format='binary')
+    out = StringIO()
+    self.assertEqual(exp.export(out), 5)
+
+    out.seek(0)
+    self.assertEqual(sorted(exp.read(out)), self.stored(mgr))
+
+    # truncated exports are detected.
+    self.assertRaises(ValueError, list,
+        exp.read(StringIO(out.getvalue()[:-1])))
+    self.assertRaises(ValueError, list,
+        exp.read(StringIO(out.getvalue()[:2])))
+
+
+  def test_resume(self):
+    mgr = manager(10)
+    exp = Exporter(mgr, chunk_size=3)
+    checkpoints = []
+
+    class Interrupted(Exception):
+      pass
+
+    def checkpoint(cursor, size):
+      checkpoints.append((cursor, size))
+      if len(checkpoints) == 2:
+        out.write('{"key": "/person:partial')
+        raise Interrupted()
+
+    out = StringIO()
+    self.assertRaises(Interrupted, exp.export, out, checkpoint=checkpoint)
+    self.assertEqual(checkpoints[-1][0], 6)
+
+    cursor, size = checkpoints[-1]
+    out.truncate(size)
+    out.seek(size)
+    self.assertEqual(exp.export(out, cursor=cursor), 10)
+
+    out.seek(0)
+    self.assertEqual(sorted(exp.read(out)), self.stored(mgr))
+
+
+  def test_resume_limit(self):
+    mgr = manager(10)
+    query = mgr.init_query()
+    query.limit = 5
+    exp = Exporter(mgr, query=query)
+    self.assertEqual(len(list(exp.records(3))), 2)
+    self.assertEqual(list(exp.records(5)), [])
+
+
+  def test_no_instances(self):
+    mgr = manager(5)
+    def fail(data):
+      raise AssertionError('instance created')
+    mgr.datastore.model_instance_gen = fail
+    mgr.datastore._instance = fail
+    Person.withData = classmethod(fail)
+    try:
+      self.assertEqual(Exporter(mgr).export(StringIO()), 5)
+    finally:
+      del Person.withData
+
+
+  def test_collection(self):
+    ds = datastore.DictDatastore()
+    mgr = CollectionManager(ds, model=Person)
+    for i in range(5):
+      person = Person('p%d' % i)
+      person.name = 'P%d' % i
+      mgr.put(person)
+
+    exp = Exporter(mgr.collection, chunk_size=2)
+    records = list(exp.records())
+    self.assertEqual([r['name'] for r in records],
+        ['P0', 'P1', 'P2', 'P3', 'P4'])
+    self.assertEqual([c for c, _ in exp.chunks()], [2, 4, 5])
+    self.assertEqual([r['name'] for r in exp.records(3)], ['P3', 'P4'])
+
+
+  def test_collection_links(self):
+    ds = datastore.DictDatastore()
+    ods = ObjectDatastore(ds, model=Person)
+    coll = Collection(Key('/people'), ods)
+
+    a = Person('a')
+    a.name = 'A'
+    ods.put(a.key, a)
+    coll.add(Person('b'))
+    coll.add(a)
+
+    # missing instances are skipped, but still count towards cursors.
+    exp = Exporter(coll)
+    self.assertEqual(list(exp.records()), [ds.get(a.key)])
+    self.assertEqual([c for c, _ in exp.chunks()], [2])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,113 @@
+import unittest
+
+from .. import identity_map
+from ..identity_map import IdentityMap
+from ..model import Key
+from ..model import Model
+
+
+class Clock(object):
+  '''Manually advanced clock.'''
+
+  def __init__(self):
+    self.now = 0
+
+  def __call__(self):
+    return self.now
+
+
+
+class TestIdentityMap(unittest.TestCase):
+
+  def test_exists(self):
+    self.assertTrue(hasattr(identity_map, 'IdentityMap'))
+
+
+  def test_is_class(self):
+    self.assertTrue(isinstance(IdentityMap, type))
+
+
+  def test_construct(self):
+    im = IdentityMap(10, ttl=5)
+    self.assertEqual(im.size, 10)
+    self.assertEqual(im.ttl, 5)
+    self.assertEqual(len(im), 0)
+    self.assertRaises(ValueError, IdentityMap, 0)
+
+
+  def test_get_put(self):
+    im = IdentityMap()
+    key = Key('/model:foo')
+    instance = Model(key)
+
+    self.assertEqual(im.get(key), None)
+    im.put(key, instance)
+    self.assertTrue(im.get(key) is instance)
+    self.assertTrue(im.get(Key('/model:foo')) is instance)
+    self.assertTrue(key in im)
+    self.assertEqual(len(im), 1)
+
+
+  def test_discard_and_clear(self):
+    im = IdentityMap()
+    key1 = Key('/model:foo')
+    key2 = Key('/model:bar')
+    im.put(key1, Model(key1))
+    im.put(key2, Model(key2))
+
+    im.discard(key1)
+    im.discard(key1)
+    self.assertEqual(im.get(key1), None)
+    self.assertFalse(im.get(key2) is None)
+
+    im.clear()
+    self.assertEqual(len(im), 0)
+    self.assertEqual(im.get(key2), None)
+
+
+  def test_evicts_least_recently_used(self):
+    im = IdentityMap(2)
+    keys = [Key('/model:%d' % i) for i in range(3)]
+    im.put(keys[0], Model(keys[0]))
+    im.put(keys[1], Model(keys[1]))
+
+    im.get(keys[0])
+    im.put(keys[2], Model(keys[2]))
+    self.assertTrue(keys[0] in im)
+    self.assertFalse(keys[1] in im)
+    self.assertTrue(keys[2] in im)
+    self.assertEqual(im.evictions, 1)
+
+
+  def test_evicts_expired(self):
+    clock = Clock()
+    im = IdentityMap(ttl=10, clock=clock)
+    key = Key('/model:foo')
+    instance = Model(key)
+    im.put(key, instance)
+
+    clock.now = 9
+    self.assertTrue(im.get(key) is instance)
+
+    clock.now = 10
+    self.assertEqual(im.get(key), None)
+    self.assertFalse(key in im)
+    self.assertEqual(im.evictions, 1)
+
+
+  def test_stats(self):
+    im = IdentityMap(1)
+    key1 = Key('/model:foo')
+    key2 = Key('/model:bar')
+    im.get(key1)
+    im.put(key1, Model(key1))
+    im.get(key1)
+    im.put(key2, Model(key2))
+
+    self.assertEqual(im.stats,
+        {'hits': 1, 'misses': 1, 'evictions': 1, 'size': 1})
+
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,234 @@
+import unittest
+import datastore
+
+from .. import instrumentation
+from ..attribute import Attribute
+from ..identity_map import IdentityMap
+from ..instrumentation import Histogram
+from ..instrumentation import Instrumentation
+from ..manager import Manager
+from ..model import Model
+from ..object_datastore import ObjectDatastore
+
+
+class Clock(object):
+  '''Clock advancing by `step` each time it is read.'''
+
+  def __init__(self, step=1.0):
+    self.now = 0.0
+    self.step = step
+
+  def __call__(self):
+    self.now += self.step
+    return self.now
+
+
+class Person(Model):
+  name = Attribute()
+  age = Attribute(data_type=int, indexed=True)
+
+
+
+class TestHistogram(unittest.TestCase):
+
+  def test_empty(self):
+    h = Histogram()
+    self.assertEqual(h.count, 0)
+    self.assertEqual(h.percentile(50), None)
+    self.assertEqual(h.stats()['mean'], None)
+
+
+  def test_add(self):
+    h = Histogram(bounds=[1, 2, 5])
+    for seconds in [0.5, 1, 1.5, 3, 10]:
+      h.add(seconds)
+
+    self.assertEqual(h.counts, [2, 1, 1, 1])
+    self.assertEqual(h.count, 5)
+    self.assertEqual(h.total, 16.0)
+    self.assertEqual(h.max, 10)
+
+
+  def test_percentile(self):
+    h = Histogram(bounds=[1, 2, 5])
+    for i in range(90):
+      h.add(0.5)
+    for i in range(9):
+      h.add(3)
+    h.add(4)
+
+    self.assertEqual(h.percentile(50), 1)
+    self.assertEqual(h.percentile(90), 1)
+    self.assertEqual(h.percentile(99), 4)
+    self.assertEqual(h.percentile(100), 4)
+
+    h.add(8)
+    self.assertEqual(h.percentile(100), 8)
+
+
+  def test_stats(self):
+    h = Histogram(bounds=[1, 2])
+    h.add(0.5)
+    h.add(1.5)
+    stats = h.stats()
+    self.assertEqual(stats['count'], 2)
+    self.assertEqual(stats['mean'], 1.0)
+    self.assertEqual(stats['p50'], 1)
+    self.assertEqual(stats['buckets'], [(1, 1), (2, 1), (None, 0)])
+
+
+
+class TestInstrumentation(unittest.TestCase):
+
+  def test_exists(self):
+    self.assertTrue(hasattr(instrumentation, 'Instrumentation'))
+
+
+  def test_timer(self):
+    inst = Instrumentation(clock=Clock())
+    timer = inst.timer('op')    # 1
+    timer.phase('io')           # 2
+    timer.skip()                # 3
+    timer.phase('copy')         # 4
+    timer.phase('io')           # 5
+    timer.done()                # 6
+
+    operation = inst.stats()['operations']['op']
+    self.assertEqual(operation['count'], 1)
+    self.assertEqual(operation['total'], 5.0)
+    self.assertEqual(operation['phases']['io']['total'], 2.0)
+    self.assertEqual(operation['phases']['copy']['total'], 1.0)
+
+
+  def test_timer_total(self):
+    inst = Instrumentation(clock=Clock())
+    timer = inst.timer('op')
+    timer.phase('io')
+    timer.done(0.5)
+    self.assertEqual(inst.stats()['operations']['op']['total'], 0.5)
+
+
+  def test_count(self):
+    inst = Instrumentation()
+    inst.count('hit')
+    inst.count('hit', 2)
+    inst.count('miss')
+    self.assertEqual(inst.stats()['counters'], {'hit': 3, 'miss': 1})
+
+
+  def test_hooks(self):
+    calls = []
+    inst = Instrumentation(hooks=[lambda *args: calls.append(args)],
+        clock=Clock())
+    timer = inst.timer('op')
+    timer.phase('io')
+    timer.done()
+    inst.count('hit')
+    self.assertEqual(calls, [('op', 'io', 1.0), ('op', 'total', 2.0),
+        ('hit', None, 1)])
+
+    more = []
+    inst.add_hook(lambda *args: more.append(args))
+    inst.count('miss')
+    self.assertEqual(more, [('miss', None, 1)])
+
+
+  def test_reset(self):
+    inst = Instrumentation()
+    inst.count('hit')
+    inst.timer('op').done()
+    inst.reset()
+    self.assertEqual(inst.stats(), {'counters': {}, 'operations': {}})
+
+
+
+class TestInstrumented(unittest.TestCase):
+
+  def person(self, name, age=1):
+    person = Person(name)
+    person.name = name.upper()
+    person.age = age
+    return person
+
+
+  def test_disabled(self):
+    ods = ObjectDatastore(datastore.DictDatastore(), model=Person)
+    self.assertEqual(ods.instrumentation, None)
+    mgr = Manager(datastore.DictDatastore(), model=Person)
+    self.assertEqual(mgr.instrumentation, None)
+    mgr.put(self.person('a'))
+    self.assertEqual(mgr.get(mgr.key('a')).name, 'A')
+
+
+  def test_object_datastore(self):
+    inst = Instrumentation()
+    ods = ObjectDatastore(datastore.DictDatastore(), model=Person,
+        instrumentation=inst)
+    person = self.person('a')
+    ods.put(person.key, person)
+    self.assertEqual(ods.get(person.key).data, person.data)
+    ods.put_many([(person.key, person)])
+    ods.get_many([person.key, Person.key.instance('missing')])
+    self.assertEqual(len(list(ods.query(datastore.Query(Person.key)))), 1)
+
+    operations = inst.stats()['operations']
+    self.assertEqual(sorted(operations), ['object_datastore.get',
+        'object_datastore.get_many', 'object_datastore.put',
+        'object_datastore.put_many', 'object_datastore.query'])
+    self.assertEqual(sorted(operations['object_datastore.get']['phases']),
+        ['copy', 'deserialize', 'io'])
+    self.assertEqual(sorted(operations['object_datastore.put']['phases']),
+        ['copy', 'io'])
+    self.assertEqual(sorted(operations['object_datastore.query']['phases']),
+        ['copy', 'deserialize', 'io'])
+
+
+  def test_query_excludes_consumer(self):
+    clock = Clock(0)
+    inst = Instrumentation(clock=clock)
+    ods = ObjectDatastore(datastore.DictDatastore(), model=Person,
+        instrumentation=inst)
+    for name in ['a', 'b']:
+      person = self.person(name)
+      ods.put(person.key, person)
+    inst.reset()
+
+    for person in ods.query(datastore.Query(Person.key)):
+      clock.now += 100
+    query = inst.stats()['operations']['object_datastore.query']
+    self.assertEqual(query['count'], 1)
+    self.assertEqual(query['total'], 0.0)
+
+
+  def test_manager(self):
+    calls = []
+    inst = Instrumentation(hooks=[lambda *args: calls.append(args)])
+    mgr = Manager(datastore.DictDatastore(), model=Person,
+        identity_map=IdentityMap(), instrumentation=inst,
+        write_changes_only=True)
+    self.assertTrue(mgr.datastore.instrumentation is inst)
+
+    person = self.person('a')
+    mgr.put(person)
+    mgr.put(person)
+    mgr.get(person.key)
+    mgr.get(person.key)
+    mgr.get_many([person.key, mgr.key('b')])
+    mgr.delete(person.key)
+
+    stats = inst.stats()
+    self.assertEqual(stats['counters'], {'manager.put.skipped': 1,
+        'manager.identity_map.hit': 2, 'manager.identity_map.miss': 2})
+    operations = stats['operations']
+    self.assertEqual(operations['manager.put']['count'], 1)
+    self.assertEqual(sorted(operations['manager.put']['phases']),
+        ['index', 'io', 'validate'])
+    self.assertEqual(operations['manager.get']['count'], 2)
+    self.assertEqual(operations['object_datastore.get']['count'], 1)
+    self.assertEqual(sorted(operations['manager.delete']['phases']),
+        ['index', 'io'])
+    self.assertTrue(('manager.put', 'index') in [c[:2] for c in calls])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+
+from .. import key_cache
+from ..key_cache import KeyCache
+from ..model import Key
+
+
+class TestKeyCache(unittest.TestCase):
+
+  def test_exists(self):
+    self.assertTrue(hasattr(key_cache, 'KeyCache'))
+
+
+  def test_construct(self):
+    cache = KeyCache(10)
+    self.assertEqual(cache.size, 10)
+    self.assertEqual(len(cache), 0)
+    self.assertRaises(ValueError, KeyCache, 0)
+
+
+  def test_get(self):
+    cache = KeyCache()
+    key = cache.get('/model:foo')
+    self.assertEqual(key, Key('/model:foo'))
+    self.assertTrue(cache.get('/model:foo') is key)
+    self.assertTrue('/model:foo' in cache)
+    self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+
+  def test_evicts_oldest(self):
+    cache = KeyCache(2)
+    a = cache.get('/a')
+    cache.get('/b')
+    cache.get('/a')
+    cache.get('/c')
+    self.assertEqual(len(cache), 2)
+    self.assertFalse('/a' in cache)
+    self.assertTrue('/b' in cache)
+    self.assertTrue(cache.get('/a') is not a)
+
+
+  def test_clear(self):
+    cache = KeyCache()
+    cache.get('/a')
+    cache.clear()
+    self.assertEqual(len(cache), 0)
+    self.assertEqual(cache.get('/a'), Key('/a'))
+
+
+if __name__ == '__main__':
+  unittest.main()
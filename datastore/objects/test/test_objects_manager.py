@@ -1,11 +1,23 @@
+import sys
+import json
 import unittest
 import datastore
 
 from .. import manager
+from ..attribute import Attribute
 from ..manager import Manager
+from ..identity_map import IdentityMap
 from ..model import Key
 from ..model import Model
 from ..object_datastore import ObjectDatastore
+from ..record_codec import RecordCodec
+from .test_objects_object_datastore import BatchDictDatastore
+from .test_objects_object_datastore import PatchDictDatastore
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
 
 
 class TestManager(unittest.TestCase):
@@ -28,6 +40,12 @@ class TestManager(unittest.TestCase):
     mgr = Manager(ds, model=Foo)
     self.assertTrue(mgr.model is Foo)
 
+  def test_construct_passes_options_to_datastore(self):
+    ds = datastore.DictDatastore()
+    mgr = Manager(ds, isolation='copy', batch_size=10)
+    self.assertEqual(mgr.datastore.isolation, 'copy')
+    self.assertEqual(mgr.datastore.batch_size, 10)
+
 
   def test_get_constructs_model(self):
     ds = datastore.DictDatastore()
@@ -170,6 +188,613 @@ class TestManager(unittest.TestCase):
     self.assertFalse(mgr.contains(key2))
     self.assertFalse(ds.contains(key2))
 
+  def _truncate_manager(self, count, ds=None, **kwargs):
+    class Foo(Model):
+      color = Attribute(indexed=True)
+
+    if ds is None:
+      ds = datastore.DictDatastore()
+
+    mgr = Manager(ds, model=Foo, **kwargs)
+    for i in range(count):
+      foo = Foo('foo%d' % i)
+      foo.color = ['red', 'blue'][i % 2]
+      mgr.put(foo)
+    return mgr
+
+  def test_truncate(self):
+    mgr = self._truncate_manager(25)
+    other = Manager(mgr.datastore.child_datastore, model=Model)
+    other.put(Model('keep'))
+
+    progress = []
+    self.assertEqual(mgr.truncate(batch_size=10, progress=progress.append),
+        25)
+    self.assertEqual(progress, [10, 20, 25])
+    self.assertEqual(list(mgr.query(mgr.init_query())), [])
+    self.assertEqual(mgr.find_by('color', 'red'), [])
+
+    # index entries are gone too.
+    child = mgr.datastore.child_datastore
+    self.assertEqual(child.get(mgr.index_key('color', 'red')), None)
+    self.assertEqual(child.get(mgr.index_key('color', 'blue')), None)
+    self.assertTrue(other.contains('keep'))
+
+    self.assertEqual(mgr.truncate(), 0)
+
+  def test_truncate_no_instances(self):
+    mgr = self._truncate_manager(5)
+    def fail(*args):
+      raise AssertionError('instance created')
+    mgr.datastore.model_instance_gen = fail
+    mgr.datastore._instance = fail
+    self.assertEqual(mgr.truncate(), 5)
+
+  def test_truncate_workers(self):
+    mgr = self._truncate_manager(100, ds=BatchDictDatastore())
+    self.assertEqual(mgr.truncate(batch_size=7, workers=4), 100)
+    self.assertEqual(list(mgr.query(mgr.init_query())), [])
+    batches = mgr.datastore.child_datastore.batches
+    self.assertEqual(sum(n for op, n in batches if op == 'delete'), 100)
+
+  def test_truncate_resume(self):
+    mgr = self._truncate_manager(30)
+
+    class Interrupted(Exception):
+      pass
+
+    def progress(deleted):
+      raise Interrupted()
+
+    self.assertRaises(Interrupted, mgr.truncate, batch_size=10,
+        progress=progress)
+    self.assertEqual(len(list(mgr.query(mgr.init_query()))), 20)
+    self.assertEqual(mgr.truncate(batch_size=10), 20)
+    self.assertEqual(list(mgr.query(mgr.init_query())), [])
+
+  def test_truncate_skips_other_records(self):
+    mgr = self._truncate_manager(25)
+    mgr.truncate_rounds = 1
+    child = mgr.datastore.child_datastore
+    # rounds may read only these, which are left in place.
+    for i in range(40):
+      child.put(Key('/foo:other%d' % i), 'other')
+
+    self.assertEqual(mgr.truncate(batch_size=5), 25)
+    self.assertEqual(len(list(child.query(mgr.init_query()))), 40)
+    self.assertEqual(mgr.find_by('color', 'red'), [])
+
+  def test_truncate_mismatched_keys(self):
+    mgr = self._truncate_manager(5)
+    child = mgr.datastore.child_datastore
+    child.put(Key('/foo:stored'), {'key': '/foo:named'})
+    self.assertEqual(mgr.truncate(batch_size=2), 5)
+    self.assertTrue(child.contains(Key('/foo:stored')))
+
+  def test_truncate_max_rounds(self):
+    mgr = self._truncate_manager(30)
+    mgr.truncate_rounds = 1
+    mgr.truncate_max_rounds = 2
+    self.assertRaises(RuntimeError, mgr.truncate, batch_size=10)
+    self.assertFalse(mgr.index_built('color'))
+    self.assertEqual(len(list(mgr.query(mgr.init_query()))), 10)
+
+    mgr.truncate_max_rounds = 3
+    self.assertEqual(mgr.truncate(batch_size=10), 10)
+
+  def test_truncate_identity_map(self):
+    mgr = self._truncate_manager(3, identity_map=IdentityMap())
+    self.assertTrue(mgr.get('foo1') is not None)
+    mgr.truncate()
+    self.assertEqual(mgr.get('foo1'), None)
+
+  def test_truncate_delete_prefix(self):
+    class PrefixDictDatastore(datastore.DictDatastore):
+      def delete_prefix(self, key):
+        self.prefixes.append(key)
+
+    ds = PrefixDictDatastore()
+    ds.prefixes = []
+    mgr = self._truncate_manager(3, ds=ds)
+    progress = []
+    self.assertEqual(mgr.truncate(progress=progress.append), 3)
+    self.assertEqual(ds.prefixes, [Key('/foo')])
+    self.assertEqual(progress, [3])
+    self.assertTrue(mgr.index_built('color'))
+
+    # counting reads records without decoding them.
+    mgr = self._truncate_manager(0, ds=ds)
+    mgr.datastore.codec = RecordCodec(mgr.model)
+    for i in range(3):
+      mgr.put(mgr.model('foo%d' % i))
+    self.assertTrue(mgr.datastore.codec.is_encoded(ds.get(Key('/foo:foo0'))))
+    mgr.datastore.decode = None
+    self.assertEqual(mgr.truncate(), 3)
+
+    # or not at all.
+    ds.query = None
+    self.assertEqual(mgr.truncate(count=False, progress=progress.append),
+        None)
+    self.assertEqual(progress, [3])
+    self.assertEqual(ds.prefixes, [Key('/foo')] * 3)
+
+  def test_get_many(self):
+    class Foo(Model): pass
+
+    ds = datastore.DictDatastore()
+    mgr = Manager(ds, model=Foo)
+    key1 = Key('/foo:bar1')
+    key2 = Key('/foo:bar2')
+    ds.put(key1, {'key': str(key1), 'foo': 'bar1'})
+    ds.put(key2, {'key': str(key2), 'foo': 'bar2'})
+
+    results = mgr.get_many(['bar2', key1, 'bar3'])
+    self.assertEqual(len(results), 3)
+    self.assertTrue(isinstance(results[0], Foo))
+    self.assertEqual(results[0].key, key2)
+    self.assertEqual(results[1].key, key1)
+    self.assertEqual(results[2], None)
+
+    self.assertRaises(TypeError, mgr.get_many, [Key('/bar:bar1')])
+
+
+  def test_put_many_and_delete_many(self):
+    class Foo(Model): pass
+
+    ds = datastore.DictDatastore()
+    mgr = Manager(ds, model=Foo)
+    instances = [Foo('bar%d' % i) for i in range(3)]
+
+    mgr.put_many(iter(instances))
+    for instance in instances:
+      self.assertEqual(ds.get(instance.key), instance.data)
+      self.assertFalse(ds.get(instance.key) is instance.data)
+
+    mgr.delete_many(['bar0', instances[1].key])
+    self.assertFalse(mgr.contains('bar0'))
+    self.assertFalse(mgr.contains('bar1'))
+    self.assertTrue(mgr.contains('bar2'))
+
+
+  def test_put_many_checks_type(self):
+    class Foo(Model): pass
+
+    mgr = Manager(datastore.DictDatastore(), model=Foo)
+    self.assertRaises(TypeError, mgr.put_many, [Foo('bar'), 'baz'])
+
+
+  # identity map tests
+
+  def test_identity_map_defaults_to_none(self):
+    mgr = Manager(datastore.DictDatastore())
+    self.assertEqual(mgr.identity_map, None)
+
+
+  def test_get_uses_identity_map(self):
+    ds = datastore.DictDatastore()
+    im = IdentityMap()
+    mgr = Manager(ds, identity_map=im)
+    self.assertTrue(mgr.identity_map is im)
+    key = Key('/model:bar')
+    ds.put(key, {'key': str(key), 'foo': 'bar'})
+
+    instance = mgr.get('bar')
+    self.assertTrue(mgr.get('bar') is instance)
+    self.assertTrue(mgr.get(key) is instance)
+    self.assertEqual(im.hits, 2)
+    self.assertEqual(im.misses, 1)
+
+    # served from the map, without datastore access
+    ds.delete(key)
+    self.assertTrue(mgr.get('bar') is instance)
+
+
+  def test_identity_map_skips_missing(self):
+    im = IdentityMap()
+    mgr = Manager(datastore.DictDatastore(), identity_map=im)
+    self.assertEqual(mgr.get('bar'), None)
+    self.assertEqual(len(im), 0)
+
+
+  def test_put_and_delete_invalidate_identity_map(self):
+    ds = datastore.DictDatastore()
+    im = IdentityMap()
+    mgr = Manager(ds, identity_map=im)
+    key = Key('/model:bar')
+    mgr.put(Model.withData({'key': str(key), 'foo': 'bar'}))
+
+    instance = mgr.get(key)
+    other = Model.withData({'key': str(key), 'foo': 'biz'})
+    mgr.put(other)
+    self.assertFalse(key in im)
+    self.assertEqual(mgr.get(key).data['foo'], 'biz')
+
+    mgr.delete(key)
+    self.assertFalse(key in im)
+    self.assertEqual(mgr.get(key), None)
+
+
+  def test_get_many_uses_identity_map(self):
+    ds = datastore.DictDatastore()
+    im = IdentityMap()
+    mgr = Manager(ds, identity_map=im)
+    keys = [Key('/model:%d' % i) for i in range(3)]
+    for key in keys:
+      ds.put(key, {'key': str(key)})
+
+    first = mgr.get('0')
+    results = mgr.get_many(keys + ['3'])
+    self.assertTrue(results[0] is first)
+    self.assertEqual([r.key for r in results[:3]], keys)
+    self.assertEqual(results[3], None)
+    self.assertTrue(mgr.get('2') is results[2])
+
+
+  def test_batch_writes_invalidate_identity_map(self):
+    ds = datastore.DictDatastore()
+    im = IdentityMap()
+    mgr = Manager(ds, identity_map=im)
+    instances = [Model('%d' % i) for i in range(3)]
+    mgr.put_many(instances)
+    mgr.get_many(['0', '1', '2'])
+    self.assertEqual(len(im), 3)
+
+    mgr.put_many(instances[:1])
+    self.assertEqual(len(im), 2)
+
+    mgr.delete_many(['1', '2'])
+    self.assertEqual(len(im), 0)
+
+
+
+  # dirty tracking tests
+
+  def test_put_writes_unmodified_instances(self):
+    pds = PatchDictDatastore()
+    mgr = Manager(pds)
+    self.assertFalse(mgr.write_changes_only)
+    instance = Model('foo')
+    mgr.put(instance)
+
+    # changes not tracked are written too.
+    instance = mgr.get('foo')
+    instance.data['foo'] = 'bar'
+    self.assertFalse(instance.isDirty())
+    mgr.put(instance)
+    mgr.put_many([instance])
+    self.assertEqual(pds.writes, [('put', instance.key)] * 3)
+    self.assertEqual(pds.get(instance.key)['foo'], 'bar')
+
+    instance.updateData({'foo': 'biz'})
+    mgr.put(instance)
+    self.assertEqual(pds.writes[-1], ('put', instance.key))
+
+
+  def test_put_skips_unmodified_instances(self):
+    pds = PatchDictDatastore()
+    mgr = Manager(pds, write_changes_only=True)
+    self.assertTrue(mgr.write_changes_only)
+    instance = Model('foo')
+    mgr.put(instance)
+    self.assertFalse(instance.isDirty())
+    self.assertEqual(pds.writes, [('put', instance.key)])
+
+    mgr.put(instance)
+    mgr.put(mgr.get('foo'))
+    mgr.put_many([instance, mgr.get('foo')])
+    self.assertEqual(len(pds.writes), 1)
+
+
+  def test_put_validates(self):
+    class Foo(Model):
+      __deferred_validation__ = True
+      age = Attribute(data_type=int)
+
+    ds = datastore.DictDatastore()
+    mgr = Manager(ds, model=Foo)
+    foo = Foo('a')
+    foo.age = '3'
+    mgr.put(foo)
+    self.assertTrue(foo.isValidated())
+    self.assertEqual(ds.get(foo.key)['age'], 3)
+
+    bar = Foo('b')
+    bar.age = 'three'
+    self.assertRaises(TypeError, mgr.put, bar)
+    self.assertRaises(TypeError, mgr.put_many, [bar])
+    self.assertFalse(mgr.contains(bar.key))
+
+    bar.age = '4'
+    mgr.put_many([bar])
+    self.assertEqual(mgr.get('b').age, 4)
+
+
+  def test_put_writes_modified_fields(self):
+    pds = PatchDictDatastore()
+    mgr = Manager(pds, write_changes_only=True)
+    pds.put(Key('/model:foo'), {'key': '/model:foo', 'foo': 'bar'})
+
+    instance = mgr.get('foo')
+    instance.updateData({'foo': 'biz'})
+    mgr.put(instance)
+    self.assertEqual(pds.writes[-1], ('patch', instance.key, ['foo']))
+    self.assertEqual(pds.get(instance.key)['foo'], 'biz')
+    self.assertFalse(instance.isDirty())
+
+    instance.updateData({'bar': 'baz'})
+    mgr.put_many([instance])
+    self.assertEqual(pds.writes[-1], ('patch', instance.key, ['bar']))
+    self.assertEqual(pds.get(instance.key)['bar'], 'baz')
+
+    instance.markDirty()
+    mgr.put_many([instance])
+    self.assertEqual(pds.writes[-1], ('put', instance.key))
+
+
+  # index tests
+
+  def indexed_model(self):
+    class Person(Model):
+      name = Attribute(indexed=True)
+      age = Attribute(data_type=int, indexed=True)
+      bio = Attribute()
+    return Person
+
+
+  def test_find_by_requires_indexed_attribute(self):
+    Person = self.indexed_model()
+    mgr = Manager(datastore.DictDatastore(), model=Person)
+    self.assertRaises(ValueError, mgr.find_by, 'bio', 'foo')
+    self.assertRaises(ValueError, mgr.find_by, 'height', 'foo')
+
+
+  def test_find_by(self):
+    Person = self.indexed_model()
+    ds = datastore.DictDatastore()
+    mgr = Manager(ds, model=Person)
+    for name, age in [('a', 30), ('b', 30), ('c', 40)]:
+      person = Person(name)
+      person.name = name.upper()
+      person.age = age
+      mgr.put(person)
+
+    self.assertEqual([p.key.name for p in mgr.find_by('name', 'A')], ['a'])
+    self.assertEqual(sorted(p.key.name for p in mgr.find_by('age', 30)),
+        ['a', 'b'])
+    self.assertEqual(sorted(p.key.name for p in mgr.find_by('age', '30')),
+        ['a', 'b'])
+    self.assertEqual(mgr.find_by('age', 50), [])
+    self.assertEqual(mgr.find_by('age', None), [])
+    self.assertEqual(mgr.find_by('age', 'abc'), [])
+
+    # index entries are kept apart from instances.
+    self.assertEqual(len(list(mgr.query(mgr.init_query()))), 3)
+    self.assertEqual(ds.get(mgr.index_key('age', 30)),
+        ['/person:a', '/person:b'])
+
+
+  def test_index_follows_updates(self):
+    Person = self.indexed_model()
+    ds = PatchDictDatastore()
+    mgr = Manager(ds, model=Person, write_changes_only=True)
+    person = Person('a')
+    person.age = 30
+    mgr.put(person)
+
+    person = mgr.get('a')
+    person.age = 31
+    mgr.put(person)
+    self.assertEqual(ds.writes[-2:], [('put', mgr.index_key('age', 31)),
+        ('patch', person.key, ['age'])])
+    self.assertEqual(mgr.find_by('age', 30), [])
+    self.assertEqual(ds.get(mgr.index_key('age', 30)), None)
+    self.assertEqual([p.key for p in mgr.find_by('age', 31)], [person.key])
+
+    # unindexed changes do not touch the index
+    writes = len(ds.writes)
+    person.bio = 'foo'
+    mgr.put(person)
+    self.assertEqual(len(ds.writes), writes + 1)
+
+    mgr.delete('a')
+    self.assertEqual(mgr.find_by('age', 31), [])
+    self.assertEqual(ds.get(mgr.index_key('age', 31)), None)
+
+
+  def test_index_batch_writes(self):
+    Person = self.indexed_model()
+    ds = datastore.DictDatastore()
+    mgr = Manager(ds, model=Person)
+    people = [Person('%d' % i) for i in range(4)]
+    for person in people:
+      person.age = 30
+    mgr.put_many(people)
+    self.assertEqual(len(mgr.find_by('age', 30)), 4)
+
+    people[0].age = 31
+    mgr.put_many(people)
+    self.assertEqual(len(mgr.find_by('age', 30)), 3)
+    self.assertEqual(len(mgr.find_by('age', 31)), 1)
+
+    mgr.delete_many(['0', '1'])
+    self.assertEqual(len(mgr.find_by('age', 30)), 2)
+    self.assertEqual(ds.get(mgr.index_key('age', 31)), None)
+
+
+  def test_index_batch_deletes_read_records_in_batches(self):
+    Person = self.indexed_model()
+    ds = BatchDictDatastore()
+    mgr = Manager(ds, model=Person, batch_size=2)
+    people = [Person('%d' % i) for i in range(5)]
+    for person in people:
+      person.age = 30
+    mgr.put_many(people)
+
+    del ds.batches[:]
+    mgr.delete_many(['%d' % i for i in range(5)])
+    self.assertEqual(ds.batches, [('get', 2), ('delete', 2), ('get', 2),
+        ('delete', 2), ('get', 1), ('delete', 1)])
+    self.assertEqual(mgr.find_by('age', 30), [])
+    self.assertEqual(ds.get(mgr.index_key('age', 30)), None)
+
+
+  def test_index_locks_are_shared(self):
+    Person = self.indexed_model()
+    ds = datastore.DictDatastore()
+    mgr = Manager(ds, model=Person)
+    other = Manager(ds, model=Person)
+    self.assertTrue(mgr.index_locks is other.index_locks)
+
+    index_key = mgr.index_key('age', 30)
+    with other.index_locks.lock(index_key):
+      self.assertFalse(mgr.index_locks.lock(index_key).acquire(False))
+
+
+  def test_find_by_skips_stale_entries(self):
+    Person = self.indexed_model()
+    ds = datastore.DictDatastore()
+    mgr = Manager(ds, model=Person)
+    person = Person('a')
+    person.name = 'A'
+    mgr.put(person)
+    ds.put(mgr.index_key('name', 'A'), ['/person:a', '/person:b'])
+    ds.put(mgr.index_key('name', 'B'), ['/person:a'])
+
+    self.assertEqual([p.key.name for p in mgr.find_by('name', 'A')], ['a'])
+    self.assertEqual(mgr.find_by('name', 'B'), [])
+
+
+  def test_find_by_scans_until_built(self):
+    Person = self.indexed_model()
+    ds = BatchDictDatastore()
+    mgr = Manager(ds, model=Person)
+    self.assertFalse(mgr.index_built('age'))
+    person = Person('a')
+    person.age = 30
+    mgr.put(person)
+    ds.put(Key('/person:b'), {'key': '/person:b', 'age': 30})
+
+    self.assertEqual(sorted(p.key.name for p in mgr.find_by('age', 30)),
+        ['a', 'b'])
+    self.assertEqual(ds.get(mgr.index_key('age', 30)), ['/person:a'])
+
+    self.assertEqual(mgr.build_indexes(batch_size=1), 2)
+    self.assertTrue(mgr.index_built('age'))
+    self.assertTrue(mgr.index_built('name'))
+    self.assertEqual(ds.get(mgr.index_key('age', 30)),
+        ['/person:a', '/person:b'])
+
+    del ds.batches[:]
+    self.assertEqual(sorted(p.key.name for p in mgr.find_by('age', 30)),
+        ['a', 'b'])
+    self.assertEqual(ds.batches, [('get', 2)])
+    self.assertEqual(mgr.find_by('age', 'abc'), [])
+
+    # building again adds nothing.
+    self.assertEqual(mgr.build_indexes(), 2)
+    self.assertEqual(ds.get(mgr.index_key('age', 30)),
+        ['/person:a', '/person:b'])
+
+
+  def test_index_key_quotes_values(self):
+    Person = self.indexed_model()
+    mgr = Manager(datastore.DictDatastore(), model=Person)
+    self.assertEqual(mgr.index_key('name', 'a/b:c'),
+        Key('/person/_index/name:a%2Fb%3Ac'))
+    self.assertEqual(mgr.index_key('name', u'\xe9'),
+        Key('/person/_index/name:%C3%A9'))
+
+
+  # columns tests
+
+  def columns_manager(self):
+    class Sample(Model):
+      count = Attribute(data_type=int, default=0)
+      ratio = Attribute(data_type=float)
+      valid = Attribute(data_type=bool)
+      label = Attribute()
+      tags = Attribute(data_type=list, serializer=json)
+
+    mgr = Manager(datastore.DictDatastore(), model=Sample)
+    for i in range(5):
+      sample = Sample('%d' % i)
+      sample.count = i if i else None
+      sample.ratio = i / 2.0 if i != 2 else None
+      sample.valid = i % 2 == 0
+      sample.label = 'l%d' % i
+      sample.tags = ['t%d' % i, 'x']
+      mgr.put(sample)
+    return mgr
+
+
+  @unittest.skipIf(numpy is None, 'requires numpy')
+  def test_query_columns(self):
+    mgr = self.columns_manager()
+    query = mgr.init_query().order('+label')
+    columns = mgr.query_columns(query, ['count', 'ratio', 'valid', 'label',
+        'tags', 'key'], chunk_size=2)
+
+    self.assertEqual(columns['count'].dtype, numpy.int64)
+    self.assertEqual(columns['count'].tolist(), [0, 1, 2, 3, 4])
+    self.assertEqual(columns['count'].sum(), 10)
+
+    self.assertEqual(columns['ratio'].dtype, numpy.float64)
+    self.assertEqual(columns['ratio'][[0, 1, 3, 4]].tolist(),
+        [0.0, 0.5, 1.5, 2.0])
+    self.assertTrue(numpy.isnan(columns['ratio'][2]))
+
+    self.assertEqual(columns['valid'].dtype, numpy.bool_)
+    self.assertEqual(columns['valid'].sum(), 3)
+
+    self.assertEqual(columns['label'].dtype, object)
+    self.assertEqual(columns['label'].tolist(), ['l0', 'l1', 'l2', 'l3', 'l4'])
+    self.assertEqual(columns['tags'].shape, (5,))
+    self.assertEqual(columns['tags'][1], ['t1', 'x'])
+    self.assertEqual(columns['key'][0], '/sample:0')
+
+
+  @unittest.skipIf(numpy is None, 'requires numpy')
+  def test_query_columns_does_not_create_instances(self):
+    mgr = self.columns_manager()
+    mgr.model.withData = None
+    query = mgr.init_query().filter('label', '>', 'l2')
+    columns = mgr.query_columns(query, ['count'])
+    self.assertEqual(sorted(columns['count'].tolist()), [3, 4])
+
+
+  @unittest.skipIf(numpy is None, 'requires numpy')
+  def test_query_columns_empty(self):
+    mgr = self.columns_manager()
+    query = mgr.init_query().filter('label', '>', 'l9')
+    columns = mgr.query_columns(query, ['count', 'label'])
+    self.assertEqual(columns['count'].dtype, numpy.int64)
+    self.assertEqual(len(columns['count']), 0)
+    self.assertEqual(len(columns['label']), 0)
+
+
+  @unittest.skipIf(numpy is None, 'requires numpy')
+  def test_query_columns_errors(self):
+    mgr = self.columns_manager()
+    query = mgr.init_query()
+    self.assertRaises(ValueError, mgr.query_columns, query, ['height'])
+
+    mgr.datastore.child_datastore.put(Key('/sample:5'), {'key': '/sample:5'})
+    self.assertRaises(ValueError, mgr.query_columns, query, ['valid'])
+
+
+  def test_query_columns_without_numpy(self):
+    self.assertFalse(hasattr(manager, 'numpy'))
+    mgr = self.columns_manager()
+    saved = sys.modules.get('numpy')
+    sys.modules['numpy'] = None  # makes `import numpy` fail.
+    try:
+      self.assertRaises(ImportError, mgr.query_columns, mgr.init_query(),
+          ['count'])
+    finally:
+      if saved is None:
+        del sys.modules['numpy']
+      else:
+        sys.modules['numpy'] = saved
 
 
 
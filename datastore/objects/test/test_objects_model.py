@@ -1,3 +1,4 @@
+import json
 import unittest
 import datastore
 
@@ -5,7 +6,12 @@ from .. import model
 from ..model import Key
 from ..model import Model
 from ..attribute import Attribute
+from ..attribute import AttributeAccessor
+from ..attribute import RawValueAccessor
 from ..attribute_metaclass import AttributeMetaclass
+from ..key_cache import KeyCache
+from ..util import CompactData
+from ..util import missing
 
 class TestKey(unittest.TestCase):
 
@@ -42,7 +48,7 @@ class TestModel(unittest.TestCase):
       Model(Key('/model:foo/bar:biz'))
 
     # keys MUST be of type Key (not str)
-    with self.assertRaises(AssertionError):
+    with self.assertRaises(ValueError):
       Model('/foo:bar')
 
 
@@ -102,6 +108,85 @@ class TestModel(unittest.TestCase):
     self.assertEqual(f.foo, 'bar')
 
 
+  def test_attributes_are_compiled(self):
+    class Foo(Model):
+      foo = Attribute()
+
+    self.assertTrue(isinstance(Foo.__dict__['foo'], AttributeAccessor))
+    self.assertTrue(Foo.__dict__['foo'].attribute is Foo._attributes['foo'])
+
+
+  def test_attributes_raw_access_uses_data(self):
+    class Foo(Model):
+      foo = Attribute()
+
+    f = Foo('foo')
+    attr = Foo._attributes['foo']
+    attr._attr_raw_set(f, 'foo', 'bar')
+    self.assertEqual(f.data['foo'], 'bar')
+    self.assertEqual(attr._attr_raw_get(f, 'foo'), 'bar')
+    self.assertEqual(attr.__get__(f, Foo), 'bar')
+
+
+  def test_compiled_models_need_no_setattr(self):
+    class Foo(Model):
+      foo = Attribute()
+
+    self.assertTrue(Foo.__setattr__ is object.__setattr__)
+    self.assertTrue(isinstance(Foo.__dict__['_foo'], RawValueAccessor))
+    f = Foo('foo')
+    f.foo = 'bar'
+    self.assertEqual(f.data['foo'], 'bar')
+    f._foo = 'baz'
+    self.assertEqual(f.data['foo'], 'baz')
+    del f.data['foo']
+    self.assertRaises(AttributeError, getattr, f, '_foo')
+    f.other = 'biz'
+    self.assertEqual(f.__dict__['other'], 'biz')
+
+    # subclasses with attributes not compiled redirect raw values again.
+    class Bar(Foo):
+      __compile_attributes__ = False
+      bar = Attribute()
+
+    self.assertEqual(Bar.__setattr__.im_func, Model.__raw_setattr__.im_func)
+    b = Bar('bar')
+    b.bar = 'biz'
+    self.assertEqual(b.data['bar'], 'biz')
+
+    class Baz(Bar):
+      baz = Attribute()
+
+    self.assertEqual(Baz.__setattr__.im_func, Model.__raw_setattr__.im_func)
+
+    # as do models with attributes storing values differently.
+    class RawAttribute(Attribute):
+      def _attr_raw_set(self, instance, name, value):
+        super(RawAttribute, self)._attr_raw_set(instance, name, value)
+
+    class Biz(Model):
+      foo = Attribute()
+      raw = RawAttribute()
+
+    self.assertEqual(Biz.__setattr__.im_func, Model.__raw_setattr__.im_func)
+    b = Biz('biz')
+    b.raw = 'biz'
+    self.assertEqual(b.data['raw'], 'biz')
+
+    # and models defining their own keep it.
+    class Custom(Model):
+      foo = Attribute()
+
+      def __setattr__(self, name, value):
+        super(Custom, self).__setattr__(name, value)
+
+    class SubCustom(Custom):
+      bar = Attribute()
+
+    self.assertEqual(SubCustom.__setattr__.im_func,
+        Custom.__dict__['__setattr__'])
+
+
   def test_attributes_set_to_data(self):
     class Foo(Model):
       foo = Attribute()
@@ -212,6 +297,49 @@ class TestModel(unittest.TestCase):
     self.assertEqual(D('d1').key, Key('/d:d1'))
 
 
+  def test_key_is_memoized(self):
+    class Foo(Model): pass
+    self.assertTrue(Foo.key is Foo.key)
+    self.assertEqual(Foo.key_type, 'foo')
+
+    Foo.__key_type__ = 'bar'
+    self.assertEqual(Foo.key_type, 'bar')
+    self.assertEqual(Foo.key, Key('/bar'))
+    self.assertEqual(Foo('a').key, Key('/bar:a'))
+
+    del Foo.__key_type__
+    self.assertEqual(Foo.key, Key('/foo'))
+
+
+  def test_key_memo_per_class(self):
+    class Foo(Model): pass
+    self.assertEqual(Foo.key, Key('/foo'))
+    class Bar(Foo): pass
+    self.assertEqual(Bar.key, Key('/bar'))
+    self.assertEqual(Foo.key, Key('/foo'))
+
+
+  def test_instance_key(self):
+    self.assertEqual(Model.instanceKey('foo'), Key('/model:foo'))
+    self.assertEqual(Model.instanceKey(1), Key('/model:1'))
+    self.assertTrue(Model.instanceKey('foo') is not Model.instanceKey('foo'))
+    self.assertRaises(ValueError, Model.instanceKey, 'a/b')
+
+
+  def test_key_cache(self):
+    class Foo(Model):
+      __key_cache__ = KeyCache(10)
+
+    key = Foo.instanceKey('a')
+    self.assertEqual(key, Key('/foo:a'))
+    self.assertTrue(Foo.instanceKey('a') is key)
+    self.assertTrue(Foo('a').key is key)
+    self.assertTrue(Foo.withData({'key': '/foo:a'}).key is key)
+    self.assertTrue(Foo.withStoredData({'key': '/foo:a'}).key is key)
+    self.assertEqual(Foo('a').data['key'], '/foo:a')
+    self.assertRaises(ValueError, Foo.instanceKey, 'a/b')
+
+
   # updateData tests
 
   def test_update_data_is_method(self):
@@ -229,6 +357,18 @@ class TestModel(unittest.TestCase):
     data.update(data2)
     self.assertEqual(instance.data, data)
 
+  def test_update_data_drops_decoded_values(self):
+    class A(Model):
+      foo = Attribute(serializer=json, data_type=list, cache=True)
+
+    instance = A.withData({'key': '/a:foo', 'foo': '["bar"]'})
+    self.assertEqual(instance.foo, ['bar'])
+    self.assertTrue('foo' in instance._decoded)
+
+    instance.updateData({'foo': '["biz"]'})
+    self.assertFalse(hasattr(instance, '_decoded'))
+    self.assertEqual(instance.foo, ['biz'])
+
 
   # updateAttributes tests
 
@@ -255,6 +395,67 @@ class TestModel(unittest.TestCase):
     instance.updateAttributes(data3)
     self.assertEqual(instance.data, {'key': key, 'foo': 'biz', 'bar':'baz'})
 
+  def test_update_attributes_drops_decoded_values(self):
+    class A(Model):
+      foo = Attribute(serializer=json, data_type=list, cache=True)
+
+    instance = A.withData({'key': '/a:foo', 'foo': '["bar"]'})
+    self.assertEqual(instance.foo, ['bar'])
+
+    instance.updateAttributes({'foo': ['biz']})
+    self.assertFalse('foo' in instance._decoded)
+    self.assertEqual(instance.foo, ['biz'])
+
+
+  # dirty tracking tests
+
+  def test_new_instances_are_dirty(self):
+    instance = Model('foo')
+    self.assertTrue(instance.isDirty())
+    self.assertEqual(instance.dirtyFields(), None)
+
+  def test_mark_clean(self):
+    class A(Model):
+      foo = Attribute()
+
+    instance = A('foo')
+    instance.markClean()
+    self.assertFalse(instance.isDirty())
+    self.assertEqual(instance.dirtyFields(), set())
+
+    instance.foo = 'bar'
+    self.assertTrue(instance.isDirty())
+    self.assertEqual(instance.dirtyFields(), set(['foo']))
+
+    instance.updateData({'bar': 'biz'})
+    instance.updateAttributes({'foo': 'baz'})
+    self.assertEqual(instance.dirtyFields(), set(['foo', 'bar']))
+
+  def test_mark_dirty(self):
+    instance = Model('foo')
+    instance.markDirty('foo')
+    self.assertEqual(instance.dirtyFields(), None)
+
+    instance.markClean()
+    instance.markDirty('foo', 'bar')
+    self.assertEqual(instance.dirtyFields(), set(['foo', 'bar']))
+    instance.markDirty()
+    self.assertEqual(instance.dirtyFields(), None)
+
+  def test_key_change_marks_dirty(self):
+    instance = Model('foo')
+    instance.markClean()
+    instance.updateAttributes({'key': 'foo'})
+    self.assertFalse(instance.isDirty())
+    instance.updateAttributes({'key': 'bar'})
+    self.assertEqual(instance.dirtyFields(), None)
+
+  def test_data_changes_not_tracked(self):
+    instance = Model('foo')
+    instance.markClean()
+    instance.data['foo'] = 'bar'
+    self.assertFalse(instance.isDirty())
+
 
   # withData tests
 
@@ -303,6 +504,107 @@ class TestModel(unittest.TestCase):
     self.assertEqual(instance.data, data)
 
 
+  # withStoredData tests
+
+  def test_with_stored_data(self):
+    class Foo(Model):
+      foo = Attribute(default='biz')
+      bar = Attribute(data_type=int)
+
+    data = {'key': '/foo:foo', 'bar': 5}
+    instance = Foo.withStoredData(data)
+    self.assertTrue(isinstance(instance, Foo))
+    self.assertTrue(instance.data is data)
+    self.assertEqual(instance.key, Key('/foo:foo'))
+    self.assertEqual(instance.bar, 5)
+    self.assertEqual(instance.foo, 'biz')
+    self.assertEqual(data, {'key': '/foo:foo', 'foo': 'biz', 'bar': 5})
+    self.assertFalse(instance.isDirty())
+
+    instance.foo = 'baz'
+    self.assertEqual(instance.dirtyFields(), set(['foo']))
+    self.assertEqual(data['foo'], 'baz')
+
+
+  def test_with_stored_data_not_constructed(self):
+    class ListAttribute(Attribute):
+      def default_value(self):
+        return []
+
+    class Foo(Model):
+      foo = Attribute(default='biz')
+      bar = ListAttribute(data_type=list)
+
+    self.assertEqual(sorted(Foo._defaults),
+        [('bar', None, Foo._attributes['bar'].default_value),
+         ('foo', 'biz', None)])
+    self.assertTrue(Foo._plain_construction())
+
+    a = Foo.withStoredData({'key': '/foo:a'})
+    b = Foo.withStoredData({'key': '/foo:b', 'foo': 'baz'})
+
+    self.assertEqual(a.data, {'key': '/foo:a', 'foo': 'biz', 'bar': []})
+    self.assertEqual(b.data, {'key': '/foo:b', 'foo': 'baz', 'bar': []})
+    self.assertFalse(a.bar is b.bar)
+    self.assertEqual(a.key, Key('/foo:a'))
+    self.assertFalse(a.isDirty())
+    self.assertEqual(a.data, Foo.withData({'key': '/foo:a'}).data)
+
+
+  def test_with_stored_data_init(self):
+    class Foo(Model):
+      foo = Attribute(default='biz')
+
+      def __init__(self, keyOrName):
+        super(Foo, self).__init__(keyOrName)
+        self.loaded = True
+
+    self.assertFalse(Foo._plain_construction())
+    instance = Foo.withStoredData({'key': '/foo:foo'})
+    self.assertTrue(instance.loaded)
+    self.assertEqual(instance.data, Foo.withData({'key': '/foo:foo'}).data)
+    self.assertRaises(TypeError, Foo.withStoredData, {'key': '/bar:foo'})
+
+
+  def test_with_stored_data_trusted(self):
+    class Foo(Model):
+      __trusted_hydration__ = True
+      foo = Attribute(default='biz')
+
+      def __init__(self, keyOrName):
+        raise AssertionError('not constructed')
+
+    data = {'key': '/foo:foo'}
+    instance = Foo.withStoredData(data)
+    self.assertTrue(instance.data is data)
+    self.assertEqual(instance.key, Key('/foo:foo'))
+    self.assertEqual(instance.foo, 'biz')
+    self.assertEqual(data, {'key': '/foo:foo'})
+    self.assertFalse(instance.isDirty())
+
+
+  def test_with_stored_data_key_attr(self):
+    class Foo(Model):
+      key_attr = 'biz'
+
+    instance = Foo.withStoredData({'biz': '/foo:bar'})
+    self.assertEqual(instance.key, Key('/foo:bar'))
+    self.assertRaises(KeyError, Foo.withStoredData, {'key': '/foo:bar'})
+
+
+  def test_with_stored_data_matches_with_data(self):
+    class Foo(Model):
+      foo = Attribute(default='biz')
+      bar = Attribute(data_type=list, serializer=json)
+
+    data = {'key': '/foo:foo', 'foo': 'baz', 'bar': '[1, 2]'}
+    stored = Foo.withStoredData(dict(data))
+    loaded = Foo.withData(data)
+    self.assertEqual(stored.data, loaded.data)
+    self.assertEqual(stored.bar, loaded.bar)
+    self.assertEqual(str(stored), str(loaded))
+
+
   # change key_attr
 
   def test_with_different_key_attr(self):
@@ -330,6 +632,263 @@ class TestModel(unittest.TestCase):
     self.assertEqual(repr(instance), 'Foo.withData(%s)' % data)
 
 
+  # validation tests
+
+  def deferred_class(self):
+    class Foo(Model):
+      __deferred_validation__ = True
+      name = Attribute(required=True, default='foo')
+      age = Attribute(data_type=int)
+      tags = Attribute(data_type=list, serializer=json)
+    return Foo
+
+
+  def test_validate(self):
+    Foo = self.deferred_class()
+    foo = Foo('a')
+    self.assertTrue(foo.isValidated())
+
+    foo.age = '3'
+    self.assertFalse(foo.isValidated())
+    self.assertEqual(foo.age, '3')
+    foo.validate()
+    self.assertTrue(foo.isValidated())
+    self.assertEqual(foo.age, 3)
+    self.assertEqual(foo.data['age'], 3)
+
+
+  def test_validate_errors(self):
+    Foo = self.deferred_class()
+    foo = Foo('a')
+    foo.age = 'three'
+    foo.name = None
+    self.assertRaises((TypeError, ValueError), foo.validate)
+    self.assertFalse(foo.isValidated())
+    self.assertRaises((TypeError, ValueError), foo.validate)
+
+    foo.age = 3
+    self.assertRaises(ValueError, foo.validate)
+    foo.name = 'A'
+    foo.validate()
+    self.assertTrue(foo.isValidated())
+
+
+  def test_validate_serialized_when_set(self):
+    Foo = self.deferred_class()
+    foo = Foo('a')
+    foo.tags = ['a']
+    self.assertEqual(foo.data['tags'], '["a"]')
+    self.assertTrue(foo.isValidated())
+    with self.assertRaises(TypeError):
+      foo.tags = 5
+
+
+  def test_validate_marks_dirty(self):
+    Foo = self.deferred_class()
+    foo = Foo.withStoredData({'key': '/foo:a'})
+    foo.age = '3'
+    self.assertEqual(foo.dirtyFields(), set(['age']))
+
+
+  def test_validate_inherited(self):
+    class Foo(Model):
+      age = Attribute(data_type=int)
+    class Bar(Foo):
+      __deferred_validation__ = True
+    class Baz(Bar):
+      __deferred_validation__ = False
+
+    bar = Bar('a')
+    bar.age = '3'
+    self.assertEqual(bar.age, '3')
+    for cls in [Foo, Baz]:
+      instance = cls('a')
+      instance.age = '3'
+      self.assertEqual(instance.age, 3)
+
+
+  def test_validate_not_compiled(self):
+    class Foo(Model):
+      __compile_attributes__ = False
+      __deferred_validation__ = True
+      age = Attribute(data_type=int)
+
+    foo = Foo('a')
+    foo.age = '3'
+    self.assertEqual(foo.data['age'], '3')
+    foo.validate()
+    self.assertEqual(foo.age, 3)
+
+
+  def test_validate_many(self):
+    Foo = self.deferred_class()
+    records = [
+      {'key': 'a', 'age': 3},
+      {'key': 'b', 'age': 'three', 'name': None},
+      {'key': 'c', 'age': '4', 'tags': 5},
+    ]
+    errors = Foo.validate_many(iter(records))
+    self.assertEqual([(index, attr) for index, attr, error in errors],
+        [(1, 'age'), (1, 'name'), (2, 'tags')])
+    self.assertTrue(isinstance(errors[0][2], TypeError))
+    self.assertTrue(isinstance(errors[1][2], ValueError))
+    self.assertEqual(Foo.validate_many(records[:1]), [])
+
+    class Bar(Model):
+      name = Attribute(required=True)
+    errors = Bar.validate_many([{'key': 'a'}, {'name': 'A'}])
+    self.assertEqual([(index, attr) for index, attr, error in errors],
+        [(0, 'name')])
+    self.assertTrue(isinstance(errors[0][2], ValueError))
+
+
+  def test_validate_many_matches_eager_validation(self):
+    class Eager(Model):
+      name = Attribute(required=True, default='foo')
+      age = Attribute(data_type=int, required=True)
+      city = Attribute(default='Paris')
+
+    class Deferred(Eager):
+      __deferred_validation__ = True
+
+    records = [
+      {'key': 'a', 'name': 'A', 'age': 3},
+      {'key': 'b', 'name': None, 'age': 3},
+      {'key': 'c', 'age': None},
+      {'key': 'd', 'age': 3, 'city': None},
+      {'key': 'e', 'age': 'three'},
+    ]
+
+    def eager_errors(record):
+      errors = []
+      for attr_name in sorted(Eager._attributes):
+        if attr_name in record:
+          try:
+            setattr(Eager('x'), attr_name, record[attr_name])
+          except (TypeError, ValueError), error:
+            errors.append(attr_name)
+      return errors
+
+    self.assertEqual([eager_errors(record) for record in records],
+        [[], ['name'], ['age'], [], ['age']])
+    for Foo in [Eager, Deferred]:
+      errors = Foo.validate_many(records)
+      self.assertEqual([(index, attr) for index, attr, error in errors],
+          [(1, 'name'), (2, 'age'), (4, 'age')])
+
+    # deferred instances are rejected when validated, as eager ones when set.
+    foo = Deferred('b')
+    foo.updateAttributes(records[1])
+    self.assertRaises(ValueError, foo.validate)
+    self.assertRaises(ValueError, Eager('b').updateAttributes, records[1])
+
+
+
+
+class TestCompactModel(unittest.TestCase):
+
+  def compact_class(self):
+    class Foo(Model):
+      __compact__ = True
+      foo = Attribute(default='biz')
+      bar = Attribute(data_type=int)
+    return Foo
+
+
+  def test_layout(self):
+    Foo = self.compact_class()
+    self.assertEqual(Foo._layout, ('key', 'bar', 'foo'))
+    self.assertEqual(Foo._layout_index, {'key': 0, 'bar': 1, 'foo': 2})
+    self.assertEqual(Foo.__dict__['foo'].index, 2)
+
+
+  def test_values(self):
+    Foo = self.compact_class()
+    f = Foo('foo')
+    self.assertEqual(f._values, ['/foo:foo', None, 'biz', None])
+    self.assertFalse('data' in f.__dict__)
+
+    f.bar = '5'
+    self.assertEqual(f.bar, 5)
+    self.assertEqual(f._values, ['/foo:foo', 5, 'biz', None])
+
+
+  def test_data(self):
+    Foo = self.compact_class()
+    f = Foo('foo')
+    self.assertTrue(isinstance(f.data, CompactData))
+    self.assertEqual(f.data, {'key': '/foo:foo', 'foo': 'biz', 'bar': None})
+
+    f.data['foo'] = 'bar'
+    self.assertEqual(f.foo, 'bar')
+    f.data['baz'] = 'biz'
+    self.assertEqual(f.data['baz'], 'biz')
+    self.assertEqual(f._values[-1], {'baz': 'biz'})
+
+
+  def test_with_data(self):
+    Foo = self.compact_class()
+    data = {'key': '/foo:foo', 'foo': 'bar', 'bar': 5, 'baz': 'biz'}
+    f = Foo.withData(data)
+    self.assertEqual(f.key, Key('/foo:foo'))
+    self.assertEqual(f.foo, 'bar')
+    self.assertEqual(f.bar, 5)
+    self.assertEqual(f.data, data)
+    self.assertEqual(repr(f), 'Foo.withData(%s)' % data)
+
+
+  def test_with_stored_data(self):
+    Foo = self.compact_class()
+    data = {'key': '/foo:foo', 'bar': 5, 'baz': 'biz'}
+    f = Foo.withStoredData(data)
+    self.assertEqual(f._values, ['/foo:foo', 5, 'biz', {'baz': 'biz'}])
+    self.assertEqual(f.foo, 'biz')
+    self.assertEqual(f.bar, 5)
+    self.assertEqual(f.data, dict(data, foo='biz'))
+    self.assertFalse(f.isDirty())
+
+    Foo.__trusted_hydration__ = True
+    f = Foo.withStoredData(data)
+    self.assertEqual(f._values, ['/foo:foo', 5, missing, {'baz': 'biz'}])
+    self.assertEqual(f.foo, 'biz')
+    self.assertEqual(f.data, data)
+
+
+  def test_inheritance_keeps_positions(self):
+    Foo = self.compact_class()
+    class Bar(Foo):
+      baz = Attribute()
+
+    self.assertEqual(Bar._layout, ('key', 'bar', 'foo', 'baz'))
+    self.assertFalse('foo' in Bar.__dict__)
+
+    b = Bar('bar')
+    b.baz = 'biz'
+    self.assertEqual(b.foo, 'biz')
+    self.assertEqual(b._values, ['/bar:bar', None, 'biz', 'biz', None])
+
+
+  def test_dirty_tracking(self):
+    Foo = self.compact_class()
+    f = Foo('foo')
+    f.markClean()
+    f.foo = 'bar'
+    self.assertEqual(f.dirtyFields(), set(['foo']))
+
+
+  def test_compact_subclass(self):
+    class Foo(Model):
+      foo = Attribute()
+
+    class Bar(Foo):
+      __compact__ = True
+
+    self.assertEqual(Bar.__dict__['foo'].index, 1)
+    b = Bar('bar')
+    b.foo = 'biz'
+    self.assertEqual(b._values, ['/bar:bar', 'biz', None])
+    self.assertEqual(Foo('foo').data, {'key': '/foo:foo', 'foo': None})
+
 
 
 
@@ -2,9 +2,54 @@ import unittest
 import datastore
 
 from .. import object_datastore
+from ..attribute import Attribute
 from ..model import Key
 from ..model import Model
 from ..object_datastore import ObjectDatastore
+from ..util import CopyOnReadDict
+from ..util import CopyOnWriteDict
+
+
+class BatchDictDatastore(datastore.DictDatastore):
+  '''DictDatastore with native batch operations, recording their calls.'''
+
+  def __init__(self):
+    super(BatchDictDatastore, self).__init__()
+    self.batches = []
+
+  def get_many(self, keys):
+    self.batches.append(('get', len(keys)))
+    return [self.get(key) for key in keys]
+
+  def put_many(self, items):
+    self.batches.append(('put', len(items)))
+    for key, value in items:
+      self.put(key, value)
+
+  def delete_many(self, keys):
+    self.batches.append(('delete', len(keys)))
+    for key in keys:
+      self.delete(key)
+
+
+
+class PatchDictDatastore(datastore.DictDatastore):
+  '''DictDatastore with partial updates, recording its writes.'''
+
+  def __init__(self):
+    super(PatchDictDatastore, self).__init__()
+    self.writes = []
+
+  def put(self, key, value):
+    self.writes.append(('put', key))
+    super(PatchDictDatastore, self).put(key, value)
+
+  def patch(self, key, fields):
+    data = self.get(key)
+    if data is None:
+      raise KeyError(key)
+    self.writes.append(('patch', key, sorted(fields)))
+    data.update(fields)
 
 
 class TestObjectDatastore(unittest.TestCase):
@@ -172,6 +217,323 @@ class TestObjectDatastore(unittest.TestCase):
     self.assertEqual(results[1].key, Key('/model:bar'))
 
 
+  # batch tests
+
+  def test_construct_with_batch_size_option(self):
+    ods = ObjectDatastore(datastore.DictDatastore(), batch_size=7)
+    self.assertEqual(ods.batch_size, 7)
+    self.assertEqual(ObjectDatastore.batch_size, 100)
+
+
+  def test_get_many_returns_instances_in_order(self):
+    dds = datastore.DictDatastore()
+    ods = ObjectDatastore(dds)
+    keys = [Key('/model:%d' % i) for i in range(5)]
+    for key in keys[::2]:
+      dds.put(key, {'key': str(key), 'foo': 'bar'})
+
+    results = ods.get_many(keys)
+    self.assertEqual(len(results), 5)
+    self.assertEqual(results[0].key, keys[0])
+    self.assertEqual(results[1], None)
+    self.assertEqual(results[2].key, keys[2])
+    self.assertEqual(results[3], None)
+    self.assertEqual(results[4].key, keys[4])
+    self.assertFalse(results[0].data is dds.get(keys[0]))
+
+
+  def test_get_many_accepts_generators(self):
+    dds = datastore.DictDatastore()
+    ods = ObjectDatastore(dds, batch_size=2)
+    keys = [Key('/model:%d' % i) for i in range(5)]
+    for key in keys:
+      dds.put(key, {'key': str(key)})
+
+    results = ods.get_many(key for key in keys)
+    self.assertEqual([r.key for r in results], keys)
+
+
+  def test_get_many_uses_native_batches(self):
+    bds = BatchDictDatastore()
+    ods = ObjectDatastore(bds, batch_size=2)
+    keys = [Key('/model:%d' % i) for i in range(5)]
+    for key in keys:
+      bds.put(key, {'key': str(key)})
+
+    results = ods.get_many(keys)
+    self.assertEqual([r.key for r in results], keys)
+    self.assertEqual(bds.batches, [('get', 2), ('get', 2), ('get', 1)])
+
+
+  def test_put_many_stores_model_data_copies(self):
+    dds = datastore.DictDatastore()
+    ods = ObjectDatastore(dds, batch_size=2)
+    instances = [Model('%d' % i) for i in range(3)]
+    ods.put_many((i.key, i) for i in instances)
+
+    for instance in instances:
+      data = dds.get(instance.key)
+      self.assertEqual(data, instance.data)
+      self.assertFalse(data is instance.data)
+
+
+  def test_put_many_uses_native_batches(self):
+    bds = BatchDictDatastore()
+    ods = ObjectDatastore(bds, batch_size=2)
+    instances = [Model('%d' % i) for i in range(3)]
+    ods.put_many((i.key, i) for i in instances)
+
+    self.assertEqual(bds.batches, [('put', 2), ('put', 1)])
+    for instance in instances:
+      self.assertEqual(bds.get(instance.key), instance.data)
+
+
+  def test_put_records(self):
+    bds = BatchDictDatastore()
+    ods = ObjectDatastore(bds, batch_size=2)
+    records = [{'key': '/model:%d' % i} for i in range(3)]
+    ods.put_records((Key(r['key']), r) for r in records)
+
+    self.assertEqual(bds.batches, [('put', 2), ('put', 1)])
+    for record in records:
+      self.assertTrue(bds.get(Key(record['key'])) is record)
+
+
+  def test_delete_many(self):
+    dds = datastore.DictDatastore()
+    ods = ObjectDatastore(dds, batch_size=2)
+    instances = [Model('%d' % i) for i in range(3)]
+    ods.put_many((i.key, i) for i in instances)
+
+    ods.delete_many([instances[0].key, instances[2].key])
+    self.assertFalse(dds.contains(instances[0].key))
+    self.assertTrue(dds.contains(instances[1].key))
+    self.assertFalse(dds.contains(instances[2].key))
+
+
+  def test_delete_many_uses_native_batches(self):
+    bds = BatchDictDatastore()
+    ods = ObjectDatastore(bds, batch_size=2)
+    keys = [Key('/model:%d' % i) for i in range(3)]
+    ods.delete_many(keys)
+    self.assertEqual(bds.batches, [('delete', 2), ('delete', 1)])
+
+
+  # isolation tests
+
+  def test_isolation_defaults_to_deepcopy(self):
+    ods = ObjectDatastore(datastore.DictDatastore())
+    self.assertEqual(ods.isolation, 'deepcopy')
+
+
+  def test_construct_with_invalid_isolation_fails(self):
+    dds = datastore.DictDatastore()
+    self.assertRaises(ValueError, ObjectDatastore, dds, isolation='foo')
+
+
+  def test_isolation_deepcopy(self):
+    dds = datastore.DictDatastore()
+    ods = ObjectDatastore(dds, isolation='deepcopy')
+    key = Key('/model:foo')
+    dds.put(key, {'key': str(key), 'foo': {'bar': 'biz'}})
+
+    instance = ods.get(key)
+    self.assertFalse(instance.data['foo'] is dds.get(key)['foo'])
+
+    ods.put(key, instance)
+    self.assertFalse(instance.data['foo'] is dds.get(key)['foo'])
+
+
+  def test_isolation_copy(self):
+    dds = datastore.DictDatastore()
+    ods = ObjectDatastore(dds, isolation='copy')
+    key = Key('/model:foo')
+    dds.put(key, {'key': str(key), 'foo': {'bar': 'biz'}})
+
+    instance = ods.get(key)
+    self.assertTrue(isinstance(instance.data, CopyOnReadDict))
+    self.assertEqual(instance.data, dds.get(key))
+
+    # nested values are copied when read, so can be changed in place.
+    self.assertFalse(instance.data['foo'] is dds.get(key)['foo'])
+    instance.data['foo']['bar'] = 'baz'
+    self.assertEqual(dds.get(key)['foo'], {'bar': 'biz'})
+
+    ods.put(key, instance)
+    self.assertEqual(dds.get(key)['foo'], {'bar': 'baz'})
+    instance.data.get('foo')['bar'] = 'qux'
+    self.assertEqual(dds.get(key)['foo'], {'bar': 'baz'})
+
+    # so are those of new instances, once stored.
+    instance = Model.withData({'key': str(key), 'foo': {'bar': 'biz'}})
+    ods.put(key, instance)
+    instance.data['foo']['bar'] = 'baz'
+    self.assertEqual(dds.get(key)['foo'], {'bar': 'biz'})
+    self.assertEqual(list(ods.query(datastore.Query(Key('/model'))))[0].data,
+        dds.get(key))
+
+
+  def test_isolation_copy_patch(self):
+    pds = PatchDictDatastore()
+    ods = ObjectDatastore(pds, isolation='copy')
+    key = Key('/model:foo')
+    pds.put(key, {'key': str(key), 'foo': ['a']})
+
+    instance = ods.get(key)
+    instance.data['foo'].append('b')
+    ods.patch(key, instance, ['foo'])
+    instance.data['foo'].append('c')
+    self.assertEqual(pds.get(key)['foo'], ['a', 'b'])
+
+
+  def test_isolation_trusted_get(self):
+    dds = datastore.DictDatastore()
+    ods = ObjectDatastore(dds, isolation='trusted')
+    key = Key('/model:foo')
+    data = {'key': str(key), 'foo': 'bar'}
+    dds.put(key, data)
+
+    instance = ods.get(key)
+    self.assertTrue(isinstance(instance.data, CopyOnWriteDict))
+    self.assertEqual(instance.key, key)
+    self.assertEqual(instance.data, data)
+    self.assertFalse(instance.data.copied)
+
+    instance.data['foo'] = 'biz'
+    self.assertEqual(instance.data['foo'], 'biz')
+    self.assertEqual(dds.get(key)['foo'], 'bar')
+
+
+  def test_isolation_trusted_defaults(self):
+    class Foo(Model):
+      foo = Attribute(default='biz')
+
+    dds = datastore.DictDatastore()
+    ods = ObjectDatastore(dds, model=Foo, isolation='trusted')
+    key = Key('/foo:a')
+    dds.put(key, {'key': str(key)})
+
+    instance = ods.get(key)
+    self.assertEqual(instance.data, {'key': str(key), 'foo': 'biz'})
+    self.assertEqual(dds.get(key), {'key': str(key)})
+    self.assertFalse(instance.isDirty())
+
+
+  def test_isolation_trusted_put(self):
+    dds = datastore.DictDatastore()
+    ods = ObjectDatastore(dds, isolation='trusted')
+    key = Key('/model:foo')
+    instance = Model.withData({'key': str(key), 'foo': 'bar'})
+    data = instance.data
+
+    ods.put(key, instance)
+    self.assertTrue(dds.get(key) is data)
+    self.assertTrue(isinstance(instance.data, CopyOnWriteDict))
+
+    instance.data['foo'] = 'biz'
+    self.assertEqual(dds.get(key)['foo'], 'bar')
+
+    ods.put(key, instance)
+    self.assertEqual(dds.get(key)['foo'], 'biz')
+    self.assertFalse(dds.get(key) is data)
+
+
+  def test_isolation_trusted_query(self):
+    dds = datastore.DictDatastore()
+    ods = ObjectDatastore(dds, isolation='trusted')
+    key = Key('/model:foo')
+    dds.put(key, {'key': str(key), 'foo': 'bar'})
+
+    results = list(ods.query(datastore.Query(Key('/model'))))
+    self.assertEqual(len(results), 1)
+    self.assertEqual(results[0].key, key)
+    self.assertTrue(isinstance(results[0].data, CopyOnWriteDict))
+
+
+  def test_compact_model(self):
+    class Compact(Model):
+      __compact__ = True
+
+    key = Key('/compact:foo')
+    data = {'key': str(key), 'foo': {'bar': 'biz'}}
+    for isolation in ObjectDatastore.isolation_modes:
+      dds = datastore.DictDatastore()
+      ods = ObjectDatastore(dds, model=Compact, isolation=isolation)
+      dds.put(key, data)
+
+      instance = ods.get(key)
+      self.assertTrue(isinstance(instance, Compact))
+      self.assertEqual(instance.data, data)
+
+      instance.data['foo'] = 'bar'
+      ods.put(key, instance)
+      self.assertTrue(type(dds.get(key)) is dict)
+      self.assertEqual(dds.get(key), {'key': str(key), 'foo': 'bar'})
+
+
+  # dirty tracking tests
+
+  def test_get_and_query_mark_instances_clean(self):
+    for isolation in ObjectDatastore.isolation_modes:
+      dds = datastore.DictDatastore()
+      ods = ObjectDatastore(dds, isolation=isolation)
+      key = Key('/model:foo')
+      dds.put(key, {'key': str(key), 'foo': 'bar'})
+
+      self.assertFalse(ods.get(key).isDirty())
+      self.assertFalse(ods.get_many([key])[0].isDirty())
+      results = list(ods.query(datastore.Query(Key('/model'))))
+      self.assertFalse(results[0].isDirty())
+
+
+  def test_contains_does_not_get(self):
+    class NoGetDatastore(datastore.DictDatastore):
+      def get(self, key):
+        raise AssertionError('contains should not get %s' % key)
+
+    ods = ObjectDatastore(NoGetDatastore())
+    key = Key('/model:foo')
+    ods.put(key, Model('foo'))
+    self.assertTrue(ods.contains(key))
+    self.assertFalse(ods.contains(Key('/model:bar')))
+
+
+  def test_patch(self):
+    pds = PatchDictDatastore()
+    ods = ObjectDatastore(pds)
+    key = Key('/model:foo')
+    pds.put(key, {'key': str(key), 'foo': 'bar', 'bar': {'biz': 'baz'}})
+
+    instance = ods.get(key)
+    instance.updateData({'foo': 'biz'})
+    ods.patch(key, instance, instance.dirtyFields())
+    self.assertEqual(pds.writes[-1], ('patch', key, ['foo']))
+    self.assertEqual(pds.get(key)['foo'], 'biz')
+    self.assertEqual(pds.get(key)['bar'], {'biz': 'baz'})
+
+
+  def test_patch_falls_back_to_put(self):
+    key = Key('/model:foo')
+    instance = Model.withData({'key': str(key), 'foo': 'bar'})
+
+    # child cannot patch
+    dds = datastore.DictDatastore()
+    ObjectDatastore(dds).patch(key, instance, set(['foo']))
+    self.assertEqual(dds.get(key), instance.data)
+
+    # nothing stored yet
+    pds = PatchDictDatastore()
+    ObjectDatastore(pds).patch(key, instance, set(['foo']))
+    self.assertEqual(pds.writes, [('put', key)])
+    self.assertEqual(pds.get(key), instance.data)
+
+    # field removed
+    del instance.data['foo']
+    ObjectDatastore(pds).patch(key, instance, set(['foo']))
+    self.assertEqual(pds.writes[-1], ('put', key))
+    self.assertEqual(pds.get(key), instance.data)
+
+
 
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,192 @@
+import json
+import unittest
+import datastore
+
+from .. import query_plan
+from ..attribute import Attribute
+from ..manager import Manager
+from ..model import Key
+from ..model import Model
+from ..query_plan import QueryPlan
+from .test_objects_object_datastore import BatchDictDatastore
+
+
+class Person(Model):
+  name = Attribute(indexed=True)
+  age = Attribute(data_type=int, indexed=True)
+  city = Attribute()
+  tags = Attribute(data_type=list, serializer=json, indexed=True)
+
+
+people = [
+  ('a', 30, 'Paris'),
+  ('b', 30, 'Rome'),
+  ('c', 30, 'Paris'),
+  ('d', 40, 'Paris'),
+  ('e', 50, 'Rome'),
+]
+
+
+class TestQueryPlan(unittest.TestCase):
+
+  def manager(self, ds=None, build=True):
+    if ds is None:
+      ds = datastore.DictDatastore()
+
+    mgr = Manager(ds, model=Person)
+    if build:
+      mgr.build_indexes()
+    for name, age, city in people:
+      person = Person(name)
+      person.name = name
+      person.age = age
+      person.city = city
+      person.tags = [city]
+      mgr.put(person)
+    return mgr
+
+
+  def query(self):
+    return datastore.Query(Key('/person'))
+
+
+  def scan(self, mgr, query):
+    '''Returns the names of the instances a scan finds for `query`.'''
+    return [p.name for p in mgr.datastore.query(query)]
+
+
+  def test_exists(self):
+    self.assertTrue(hasattr(query_plan, 'QueryPlan'))
+
+
+  def test_scan(self):
+    mgr = self.manager()
+    query = self.query().filter('city', '=', 'Paris').filter('age', '>', 30)
+    plan = QueryPlan(mgr, query)
+    self.assertEqual(plan.strategy, 'scan')
+    self.assertEqual(plan.explain(), {
+      'strategy': 'scan',
+      'field': None,
+      'estimated_records': None,
+      'filters': ['city = Paris', 'age > 30'],
+      'orders': [],
+    })
+    self.assertEqual([p.name for p in plan.execute()], ['d'])
+
+
+  def test_key(self):
+    mgr = self.manager()
+    query = self.query().filter('key', '=', '/person:d').filter('age', '=', 30)
+    plan = QueryPlan(mgr, query)
+    self.assertEqual(plan.strategy, 'key')
+    self.assertEqual(plan.estimated_records, 1)
+    self.assertEqual(list(plan.execute()), [])
+
+    query = self.query().filter('key', '=', '/person:d')
+    self.assertEqual([p.name for p in QueryPlan(mgr, query).execute()], ['d'])
+
+    # keys outside the query's key are not read.
+    query = self.query().filter('key', '=', '/other:d')
+    self.assertEqual(QueryPlan(mgr, query).estimated_records, 0)
+
+
+  def test_index(self):
+    mgr = self.manager()
+    query = self.query().filter('city', '=', 'Paris').filter('age', '=', 30)
+    query.order('-name').limit = 1
+    plan = QueryPlan(mgr, query)
+    self.assertEqual(plan.strategy, 'index')
+    self.assertEqual(plan.field, 'age')
+    self.assertEqual(plan.estimated_records, 3)
+    self.assertEqual([p.name for p in plan.execute()], ['c'])
+    self.assertEqual([p.name for p in plan.execute()], self.scan(mgr, query))
+
+
+  def test_index_chooses_fewest_candidates(self):
+    mgr = self.manager()
+    query = self.query().filter('age', '=', 30).filter('name', '=', 'b')
+    plan = QueryPlan(mgr, query)
+    self.assertEqual(plan.field, 'name')
+    self.assertEqual(plan.estimated_records, 1)
+    self.assertEqual([p.name for p in plan.execute()], ['b'])
+
+
+  def test_index_no_entry(self):
+    mgr = self.manager()
+    plan = QueryPlan(mgr, self.query().filter('age', '=', 60))
+    self.assertEqual(plan.strategy, 'index')
+    self.assertEqual(plan.estimated_records, 0)
+    self.assertEqual(list(plan.execute()), [])
+
+
+  def test_index_uncoercible_value(self):
+    mgr = self.manager()
+    query = self.query().filter('age', '=', 'abc')
+    plan = QueryPlan(mgr, query)
+    self.assertEqual(plan.strategy, 'scan')
+    self.assertEqual(list(plan.execute()), [])
+    self.assertEqual(self.scan(mgr, query), [])
+
+    # other filters may still use an index.
+    query = self.query().filter('age', '=', 'abc').filter('name', '=', 'b')
+    plan = QueryPlan(mgr, query)
+    self.assertEqual(plan.field, 'name')
+    self.assertEqual(list(plan.execute()), [])
+    self.assertEqual(self.scan(mgr, query), [])
+
+
+  def test_index_must_be_built(self):
+    mgr = self.manager(build=False)
+    # stored bypassing the manager, so not indexed.
+    mgr.datastore.child_datastore.put(Key('/person:f'),
+        {'key': '/person:f', 'name': 'f', 'age': 30})
+
+    query = self.query().filter('age', '=', 30)
+    self.assertEqual(QueryPlan(mgr, query).strategy, 'scan')
+    self.assertEqual(sorted(p.name for p in mgr.query(query)),
+        ['a', 'b', 'c', 'f'])
+
+    self.assertEqual(mgr.build_indexes(), 6)
+    plan = QueryPlan(mgr, query)
+    self.assertEqual(plan.strategy, 'index')
+    self.assertEqual(plan.estimated_records, 4)
+    self.assertEqual(sorted(p.name for p in plan.execute()),
+        ['a', 'b', 'c', 'f'])
+
+    # other managers see the index is built.
+    other = Manager(mgr.datastore.child_datastore, model=Person)
+    self.assertEqual(QueryPlan(other, query).strategy, 'index')
+
+
+  def test_index_skips_unsuitable_filters(self):
+    mgr = self.manager()
+    query = self.query().filter('age', '!=', 30)
+    self.assertEqual(QueryPlan(mgr, query).strategy, 'scan')
+
+    # serialized attributes are filtered by raw value.
+    query = self.query().filter('tags', '=', '["Rome"]')
+    plan = QueryPlan(mgr, query)
+    self.assertEqual(plan.strategy, 'scan')
+    self.assertEqual(sorted(p.name for p in plan.execute()), ['b', 'e'])
+
+
+  def test_index_reads_in_batches(self):
+    bds = BatchDictDatastore()
+    mgr = self.manager(bds)
+    mgr.datastore.batch_size = 2
+    plan = QueryPlan(mgr, self.query().filter('age', '=', 30))
+    self.assertEqual(len(list(plan.execute())), 3)
+    self.assertEqual(bds.batches, [('get', 2), ('get', 1)])
+
+
+  def test_manager_query_uses_plan(self):
+    mgr = self.manager()
+    query = self.query().filter('age', '=', 30).order('+name')
+    self.assertEqual(mgr.explain(query)['strategy'], 'index')
+    self.assertEqual([p.name for p in mgr.query(query)], ['a', 'b', 'c'])
+    self.assertTrue(isinstance(mgr.plan(query), QueryPlan))
+
+
+
+if __name__ == '__main__':
+  unittest.main()
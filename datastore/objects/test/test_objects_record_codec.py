@@ -0,0 +1,290 @@
+import json
+import datetime
+import unittest
+import datastore
+
+from StringIO import StringIO
+
+from .. import record_codec
+from ..attribute import Attribute
+from ..bulk_loader import BulkLoader
+from ..exporter import Exporter
+from ..manager import Manager
+from ..model import Model
+from ..object_datastore import ObjectDatastore
+from ..record_codec import RecordCodec
+
+
+class Person(Model):
+  name = Attribute()
+  age = Attribute(data_type=int, indexed=True)
+
+
+def person(name, age=1):
+  instance = Person(name)
+  instance.name = name.upper()
+  instance.age = age
+  return instance
+
+
+
+class TestRecordCodec(unittest.TestCase):
+
+  def test_exists(self):
+    self.assertTrue(hasattr(record_codec, 'RecordCodec'))
+
+
+  def test_schema(self):
+    codec = RecordCodec(Person)
+    self.assertEqual(codec.schema, [['key', 'str'], ['age', 'int'],
+        ['name', 'str']])
+    self.assertEqual(codec.fields, ('key', 'age', 'name'))
+    self.assertEqual(codec.version, RecordCodec(Person).version)
+
+    class Other(Model):
+      name = Attribute()
+    self.assertNotEqual(RecordCodec(Other).version, codec.version)
+
+
+  def test_round_trip(self):
+    codec = RecordCodec(Person)
+    data = {'key': '/person:a', 'name': u'A\xe9', 'age': 3}
+    value = codec.encode(data)
+    self.assertTrue(codec.is_encoded(value))
+    self.assertFalse(codec.is_encoded(data))
+    self.assertEqual(codec.header.unpack_from(value),
+        (codec.magic, codec.format, codec.exact, codec.version))
+    self.assertEqual(codec.record_version(value), codec.version)
+    self.assertEqual(codec.decode(value), data)
+    self.assertTrue(len(value) < len(json.dumps(data)))
+
+
+  def test_types(self):
+    codec = RecordCodec(Person)
+    values = [None, True, False, 0, -1, 2 ** 40, -2 ** 70, 1.5, '', 'a\xff',
+        u'\xe9', [], [1, [2]], (1, 'a'), {}, {'a': {1: (None,)}}]
+    for value in values:
+      data = {'key': '/person:a', 'name': value, 'age': 1}
+      decoded = codec.decode(codec.encode(data))
+      self.assertEqual(decoded, data)
+      self.assertEqual(type(decoded['name']), type(value))
+    self.assertEqual(type(codec.decode(codec.encode(
+        {'key': 'a', 'name': {'a': ['b']}}))['name']['a'][0]), str)
+
+
+  def test_absent_and_extras(self):
+    codec = RecordCodec(Person)
+    data = {'key': '/person:a', 'name': None, 'other': {'nested': [1, 2]}}
+    value = codec.encode(data)
+    self.assertEqual(codec.header.unpack_from(value)[2], codec.extended)
+    self.assertEqual(codec.decode(value), data)
+
+    data = {'key': '/person:a', 'name': None, 'age': 1, 'other': 2}
+    self.assertEqual(codec.decode(codec.encode(data)), data)
+
+
+  def test_unencodable(self):
+    codec = RecordCodec(Person)
+    self.assertRaises(ValueError, codec.encode,
+        {'key': '/person:a', 'name': object()})
+    self.assertRaises(ValueError, codec.encode,
+        {'key': '/person:a', 'name': set([1])})
+
+
+  def test_is_encoded(self):
+    codec = RecordCodec(Person)
+    self.assertTrue(codec.is_encoded(codec.encode({'key': '/person:a'})))
+    self.assertFalse(codec.is_encoded('\xdb not a record'))
+    self.assertFalse(codec.is_encoded(codec.magic))
+    self.assertFalse(codec.is_encoded(u'\xdbREC' + u' ' * 10))
+    self.assertFalse(codec.is_encoded(None))
+
+
+  def test_decode_malformed(self):
+    codec = RecordCodec(Person)
+    value = codec.encode({'key': '/person:a', 'name': 'A', 'age': 1})
+    extended = codec.encode({'key': '/person:a', 'other': [1, 2]})
+    header = codec.header.size
+
+    malformed = [
+      value[:-1],
+      value + 'N',
+      value[:header] + 'x' + value[header + 1:],
+      codec.header.pack(codec.magic, 2, codec.exact, codec.version) +
+          value[header:],
+      codec.header.pack(codec.magic, codec.format, 7, codec.version) +
+          value[header:],
+      value[:header] + 's\xff\xff\xff\xff',
+      value[:header] + '[\x7f\xff\xff\xff',
+      value[:header] + 'L\x00\x00\x00\x01x' + 'NN',
+      value[:header] + 'u\x00\x00\x00\x01\xff' + 'NN',
+      extended[:-1],
+      extended[:-1] + '[\x00\x00\x00\x01i\x00\x00\x00\x09',
+      extended[:-1] + 's\x00\x00\x00\x01a',
+      value[:header] + '[\x00\x00\x00\x01' * 100 + 'N' + 'NN',
+    ]
+    for record in malformed + [None, {}, u'\xdbREC']:
+      self.assertRaises(ValueError, codec.decode, record)
+
+
+  def test_decode_errors(self):
+    codec = RecordCodec(Person)
+    self.assertRaises(ValueError, codec.decode, 'not a record')
+
+    class Old(Model):
+      __key_type__ = 'person'
+      name = Attribute()
+      height = Attribute(data_type=float)
+
+    old = RecordCodec(Old)
+    value = old.encode({'key': '/person:a', 'name': 'A', 'height': 1.5})
+    self.assertRaises(KeyError, codec.decode, value)
+
+    codec.add_schema(old.schema)
+    self.assertEqual(codec.decode(value),
+        {'key': '/person:a', 'name': 'A', 'height': 1.5})
+
+
+
+class TestCodecDatastore(unittest.TestCase):
+
+  def datastore(self, ds=None, **kwargs):
+    ds = datastore.DictDatastore() if ds is None else ds
+    return ObjectDatastore(ds, model=Person, codec=RecordCodec(Person),
+        **kwargs)
+
+
+  def test_get_put(self):
+    for isolation in ObjectDatastore.isolation_modes:
+      ods = self.datastore(isolation=isolation)
+      a = person('a')
+      ods.put(a.key, a)
+
+      stored = ods.child_datastore.get(a.key)
+      self.assertTrue(isinstance(stored, str))
+      self.assertEqual(ods.codec.decode(stored), a.data)
+
+      got = ods.get(a.key)
+      self.assertEqual(got.data, a.data)
+      self.assertFalse(got.isDirty())
+      got.name = 'B'
+      self.assertEqual(ods.get(a.key).name, 'A')
+
+
+  def test_many(self):
+    ods = self.datastore()
+    people = [person('p%d' % i, i) for i in range(5)]
+    ods.put_many([(p.key, p) for p in people])
+    got = ods.get_many([p.key for p in people] + [Person.key.instance('x')])
+    self.assertEqual([p.data for p in got[:-1]], [p.data for p in people])
+    self.assertEqual(got[-1], None)
+
+
+  def test_query(self):
+    ods = self.datastore()
+    for i in range(5):
+      p = person('p%d' % i, i)
+      ods.put(p.key, p)
+
+    query = datastore.Query(Person.key).filter('age', '>=', 2).order('-age')
+    self.assertEqual([p.age for p in ods.query(query)], [4, 3, 2])
+    records = list(ods.query_records(query))
+    self.assertEqual([r['age'] for r in records], [4, 3, 2])
+
+
+  def test_reads_dicts(self):
+    ods = self.datastore()
+    a = person('a')
+    ods.child_datastore.put(a.key, dict(a.data))
+    self.assertEqual(ods.get(a.key).data, a.data)
+
+    # other strings are not taken for records.
+    ods.child_datastore.put(a.key, '\xdb not a record')
+    self.assertEqual(ods.get(a.key), '\xdb not a record')
+
+
+  def test_unencodable_stored_as_dict(self):
+    ods = self.datastore()
+    a = person('a')
+    a.data['other'] = datetime.date(2020, 1, 1)
+    ods.put(a.key, a)
+    self.assertEqual(ods.child_datastore.get(a.key), a.data)
+    self.assertEqual(ods.get(a.key).data, a.data)
+
+
+  def test_schema_change(self):
+    ds = datastore.DictDatastore()
+
+    class Old(Model):
+      __key_type__ = 'person'
+      name = Attribute()
+      height = Attribute(data_type=float)
+
+    old = ObjectDatastore(ds, model=Old, codec=RecordCodec(Old))
+    for name in ['a', 'b']:
+      instance = Old(name)
+      instance.name = name.upper()
+      instance.height = 1.5
+      old.put(instance.key, instance)
+    a = Old('a')
+
+    # the new model reads the old record, and keeps the removed field.
+    ods = self.datastore(ds)
+    got = ods.get(a.key)
+    self.assertEqual(got.name, 'A')
+    self.assertEqual(got.data['height'], 1.5)
+
+    got.age = 3
+    ods.put(got.key, got)
+    self.assertEqual(ods.codec.record_version(ds.get(a.key)),
+        ods.codec.version)
+    self.assertEqual(old.get(a.key).height, 1.5)
+    self.assertEqual(ods.get(a.key).age, 3)
+
+    # records of unknown schemas cannot be read.
+    ds.delete(ods._schema_key(old.codec.version))
+    ods = self.datastore(ds)
+    self.assertRaises(KeyError, ods.get, Old.key.instance('b'))
+    self.assertEqual(ods.get(a.key).age, 3)
+
+
+  def test_manager(self):
+    ds = datastore.DictDatastore()
+    mgr = Manager(ds, model=Person, codec=RecordCodec(Person))
+    for i in range(5):
+      mgr.put(person('p%d' % i, i % 2))
+
+    self.assertEqual(mgr.build_indexes(), 5)
+    self.assertEqual(len(mgr.find_by('age', 1)), 2)
+    p = mgr.get('p1')
+    p.age = 0
+    mgr.put(p)
+    self.assertEqual(len(mgr.find_by('age', 1)), 1)
+    self.assertEqual(len(mgr.find_by('age', 0)), 4)
+
+    query = mgr.init_query().filter('age', '=', 0)
+    self.assertEqual(mgr.explain(query)['strategy'], 'index')
+    self.assertEqual(len(list(mgr.query(query))), 4)
+
+    self.assertEqual(mgr.truncate(), 5)
+    self.assertEqual(list(mgr.query(mgr.init_query())), [])
+    self.assertEqual(mgr.find_by('age', 0), [])
+
+
+  def test_bulk_load_and_export(self):
+    mgr = Manager(datastore.DictDatastore(), model=Person,
+        codec=RecordCodec(Person))
+    BulkLoader(mgr).load([{'key': 'p%d' % i, 'name': 'P', 'age': i}
+        for i in range(3)])
+    self.assertTrue(mgr.datastore.codec.is_encoded(
+        mgr.datastore.child_datastore.get(mgr.key('p1'))))
+    self.assertEqual(mgr.get('p2').age, 2)
+
+    out = StringIO()
+    self.assertEqual(Exporter(mgr).export(out), 3)
+    records = map(json.loads, out.getvalue().splitlines())
+    self.assertEqual(sorted(r['age'] for r in records), [0, 1, 2])
+
+
+if __name__ == '__main__':
+  unittest.main()
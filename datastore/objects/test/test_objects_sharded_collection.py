@@ -0,0 +1,161 @@
+import unittest
+
+from datastore.core import DictDatastore
+
+from .. import sharded_collection
+from ..collection import Collection
+from ..collection_manager import CollectionManager
+from ..model import Key
+from ..model import Model
+from ..object_datastore import ObjectDatastore
+from ..sharded_collection import ShardedCollection
+
+
+class TestShardedCollection(unittest.TestCase):
+
+  def collection(self, count, **kwargs):
+    ds = DictDatastore()
+    coll = ShardedCollection(Key('Foo'), ds, **kwargs)
+    ods = ObjectDatastore(coll.directory_datastore)
+    models = [Model('bar%d' % i) for i in range(count)]
+    for model in models:
+      ods.put(model.key, model)
+      coll.add(model)
+    return coll, models, ds
+
+
+  def test_exists(self):
+    self.assertTrue(hasattr(sharded_collection, 'ShardedCollection'))
+
+
+  def test_is_collection(self):
+    self.assertTrue(issubclass(ShardedCollection, Collection))
+
+
+  def test_shards(self):
+    coll = ShardedCollection(Key('Foo'), DictDatastore())
+    self.assertEqual(coll.shards, ShardedCollection.shards)
+
+    coll = ShardedCollection(Key('Foo'), DictDatastore(), shards=4, workers=2)
+    self.assertEqual(coll.shards, 4)
+    self.assertEqual(coll.workers, 2)
+    self.assertEqual(coll.shard_keys(), [Key('/Foo/_shards:0'),
+        Key('/Foo/_shards:1'), Key('/Foo/_shards:2'), Key('/Foo/_shards:3')])
+
+
+  def test_shard(self):
+    coll = ShardedCollection(Key('Foo'), DictDatastore(), shards=8)
+    shards = [coll.shard(Key('/Foo:bar%d' % i)) for i in range(100)]
+    self.assertTrue(all(0 <= shard < 8 for shard in shards))
+    self.assertEqual(len(set(shards)), 8)
+
+    # stable, and the same for unicode names.
+    self.assertEqual(coll.shard(Key('/Foo:bar')), coll.shard(Key('/Foo:bar')))
+    self.assertEqual(coll.shard(Key('/Foo:bar')), coll.shard(Key(u'/Foo:bar')))
+
+
+  def test_add_remove(self):
+    coll, models, ds = self.collection(50, shards=8)
+    keys = [coll.key.instance(m.key.name) for m in models]
+    self.assertEqual(sorted(coll.keys), sorted(keys))
+    self.assertEqual(ds.get(coll.key), None)
+
+    # members are listed in their bucket only.
+    for shard, shard_key in enumerate(coll.shard_keys()):
+      for key in ds.get(shard_key) or []:
+        self.assertEqual(coll.shard(Key(key)), shard)
+
+    coll.remove(models[3])
+    coll.remove(models[7])
+    self.assertEqual(sorted(coll.keys),
+        sorted(k for i, k in enumerate(keys) if i not in (3, 7)))
+
+
+  def test_clear(self):
+    coll, models, ds = self.collection(50, shards=8)
+    removed = []
+    remove_many = coll.remove_many
+    def recording_remove_many(keys):
+      keys = list(keys)
+      removed.append(len(keys))
+      remove_many(keys)
+    coll.remove_many = recording_remove_many
+
+    coll.clear()
+    self.assertEqual(list(coll.keys), [])
+    self.assertEqual(coll.count(), 0)
+    # a bucket at a time.
+    self.assertEqual(sum(removed), 50)
+    self.assertTrue(len(removed) > 1)
+
+
+  def test_add_rewrites_one_bucket(self):
+    coll, models, ds = self.collection(100, shards=16)
+    puts = []
+    put = ds.put
+    def recording_put(key, value):
+      puts.append((key, value))
+      put(key, value)
+    ds.put = recording_put
+
+    coll.add(Model('new'))
+    lists = [(key, value) for key, value in puts if isinstance(value, list)]
+    self.assertEqual(len(lists), 1)
+    self.assertEqual(lists[0][0],
+        coll.shard_keys()[coll.shard(Key('/Foo:new'))])
+    self.assertTrue(len(lists[0][1]) < 100)
+
+
+  def test_instances(self):
+    coll, models, ds = self.collection(20, shards=4, workers=3)
+    data = sorted(i.data for i in coll.instances)
+    self.assertEqual(data, sorted(m.data for m in models))
+
+
+  def test_page(self):
+    coll, models, ds = self.collection(50, shards=8)
+    keys = list(coll.keys)
+
+    pages = []
+    page, cursor = coll.page(limit=7)
+    pages.append(page)
+    while cursor:
+      page, cursor = coll.page(cursor, limit=7)
+      pages.append(page)
+
+    self.assertEqual(sum(pages, []), keys)
+    self.assertTrue(all(len(page) == 7 for page in pages[:-1]))
+
+
+  def test_page_reads_few_buckets(self):
+    coll, models, ds = self.collection(50, shards=8)
+    page, cursor = coll.page(limit=20)
+
+    read = []
+    get = coll.directory_datastore.get
+    def recording_get(key):
+      read.append(key)
+      return get(key)
+    coll.directory_datastore.get = recording_get
+
+    coll.page(cursor, limit=3)
+    self.assertTrue(len(read) <= 2)
+
+
+  def test_collection_manager(self):
+    class Foo(Model): pass
+
+    class Manager(CollectionManager):
+      Collection = ShardedCollection
+
+    mgr = Manager(DictDatastore(), model=Foo)
+    for i in range(10):
+      mgr.put(Foo('foo%d' % i))
+    mgr.delete(mgr.key('foo4'))
+    self.assertTrue(isinstance(mgr.collection, ShardedCollection))
+    self.assertEqual(sorted(i.key.name for i in mgr.instances),
+        sorted('foo%d' % i for i in range(10) if i != 4))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,9 +1,21 @@
+import copy
 import json
+import time
 import pickle
 import unittest
+import threading
 
 from .. import util
+from ..util import chunks
 from ..util import classproperty
+from ..util import CompactData
+from ..util import copy_values
+from ..util import CopyOnReadDict
+from ..util import CopyOnWriteDict
+from ..util import LockStripes
+from ..util import missing
+from ..util import parallel_map
+from ..util import prefetch
 
 
 class TestUtilClassproperty(unittest.TestCase):
@@ -69,5 +81,314 @@ class TestUtilClassproperty(unittest.TestCase):
     self.assertTrue(foo.bar, foo)
 
 
+
+class TestUtilChunks(unittest.TestCase):
+
+  def test_chunks(self):
+    self.assertEqual(list(chunks(range(5), 2)), [[0, 1], [2, 3], [4]])
+    self.assertEqual(list(chunks(range(4), 2)), [[0, 1], [2, 3]])
+    self.assertEqual(list(chunks([], 2)), [])
+
+  def test_chunks_consumes_lazily(self):
+    gen = chunks(iter(range(5)), 2)
+    self.assertEqual(gen.next(), [0, 1])
+
+  def test_chunks_requires_positive_size(self):
+    self.assertRaises(ValueError, list, chunks(range(5), 0))
+
+
+
+class TestUtilParallelMap(unittest.TestCase):
+
+  def test_ordered(self):
+    def slow_square(x):
+      time.sleep(0.001 * (10 - x))
+      return x * x
+
+    results = list(parallel_map(slow_square, range(10), 4))
+    self.assertEqual(results, [x * x for x in range(10)])
+
+
+  def test_unordered(self):
+    def slow_square(x):
+      time.sleep(0.001 * (10 - x))
+      return x * x
+
+    results = list(parallel_map(slow_square, range(10), 4, ordered=False))
+    self.assertEqual(sorted(results), [x * x for x in range(10)])
+
+
+  def test_uses_threads(self):
+    threads = set()
+    def record(x):
+      threads.add(threading.current_thread().name)
+      time.sleep(0.01)
+      return x
+
+    list(parallel_map(record, range(8), 4))
+    self.assertTrue(len(threads) > 1)
+    self.assertFalse(threading.current_thread().name in threads)
+
+
+  def test_window_bounds_read_ahead(self):
+    consumed = []
+    def items():
+      for x in range(100):
+        consumed.append(x)
+        yield x
+
+    for ordered in [True, False]:
+      del consumed[:]
+      gen = parallel_map(lambda x: x, items(), 2, window=3, ordered=ordered)
+      gen.next()
+      self.assertTrue(len(consumed) <= 4)
+      gen.close()
+
+
+  def test_reraises_exceptions(self):
+    def fail(x):
+      if x == 3:
+        raise KeyError(x)
+      return x
+
+    for ordered in [True, False]:
+      gen = parallel_map(fail, range(6), 2, ordered=ordered)
+      self.assertRaises(KeyError, list, gen)
+
+
+
+class TestUtilPrefetch(unittest.TestCase):
+
+  def test_yields_items(self):
+    self.assertEqual(list(prefetch(iter(range(10)), 3)), range(10))
+    self.assertEqual(list(prefetch([], 3)), [])
+
+
+  def test_iterates_in_background(self):
+    threads = set()
+    def items():
+      for x in range(5):
+        threads.add(threading.current_thread().name)
+        yield x
+
+    self.assertEqual(list(prefetch(items(), 2)), range(5))
+    self.assertFalse(threading.current_thread().name in threads)
+
+
+  def test_reads_ahead_at_most_size(self):
+    consumed = []
+    def items():
+      for x in range(100):
+        consumed.append(x)
+        yield x
+
+    gen = prefetch(items(), 3)
+    gen.next()
+    time.sleep(0.05)
+    self.assertTrue(len(consumed) <= 5)
+    gen.close()
+
+
+  def test_reraises_exceptions(self):
+    def items():
+      yield 1
+      raise KeyError('foo')
+
+    gen = prefetch(items(), 3)
+    self.assertEqual(gen.next(), 1)
+    self.assertRaises(KeyError, gen.next)
+
+
+
+class TestUtilLockStripes(unittest.TestCase):
+
+  def test_same_lock_per_key(self):
+    locks = LockStripes(8)
+    self.assertTrue(locks.lock('/a') is locks.lock('/a'))
+    self.assertTrue(locks.lock(u'/a') is locks.lock('/a'))
+    self.assertEqual(len(set(locks.lock('/%d' % i) for i in range(100))), 8)
+
+  def test_requires_positive_count(self):
+    self.assertRaises(ValueError, LockStripes, 0)
+
+
+
+class TestUtilCopyOnWriteDict(unittest.TestCase):
+
+  def test_reads_through(self):
+    source = {'foo': 'bar'}
+    view = CopyOnWriteDict(source)
+    self.assertEqual(view['foo'], 'bar')
+    self.assertEqual(view.get('foo'), 'bar')
+    self.assertEqual(view.get('biz'), None)
+    self.assertTrue('foo' in view)
+    self.assertEqual(len(view), 1)
+    self.assertEqual(list(view), ['foo'])
+    self.assertEqual(view, source)
+    self.assertEqual(repr(view), repr(source))
+    self.assertFalse(view.copied)
+
+  def test_copies_on_write(self):
+    source = {'foo': 'bar'}
+    view = CopyOnWriteDict(source)
+    view['foo'] = 'biz'
+    self.assertTrue(view.copied)
+    self.assertEqual(view['foo'], 'biz')
+    self.assertEqual(source, {'foo': 'bar'})
+
+    view['baz'] = 'biz'
+    del view['foo']
+    self.assertEqual(view, {'baz': 'biz'})
+    self.assertEqual(source, {'foo': 'bar'})
+
+  def test_copies_on_update(self):
+    source = {'foo': 'bar'}
+    view = CopyOnWriteDict(source)
+    view.update({'foo': 'biz'})
+    self.assertEqual(view, {'foo': 'biz'})
+    self.assertEqual(source, {'foo': 'bar'})
+
+  def test_copy_returns_dict(self):
+    source = {'foo': 'bar'}
+    view = CopyOnWriteDict(source)
+    copied = view.copy()
+    self.assertTrue(isinstance(copied, dict))
+    self.assertEqual(copied, source)
+    self.assertFalse(copied is source)
+
+  def test_freeze(self):
+    view = CopyOnWriteDict({'foo': 'bar'})
+    view['foo'] = 'biz'
+    frozen = view.freeze()
+    self.assertEqual(frozen, {'foo': 'biz'})
+    self.assertFalse(view.copied)
+
+    view['foo'] = 'baz'
+    self.assertEqual(frozen, {'foo': 'biz'})
+    self.assertEqual(view, {'foo': 'baz'})
+
+
+
+class TestUtilCopyOnReadDict(unittest.TestCase):
+
+  def test_reads(self):
+    source = {'foo': 'bar', 'biz': 1}
+    view = CopyOnReadDict(source)
+    self.assertEqual(view['foo'], 'bar')
+    self.assertEqual(view.get('biz'), 1)
+    self.assertEqual(view.get('baz'), None)
+    self.assertTrue('foo' in view)
+    self.assertEqual(len(view), 2)
+    self.assertEqual(sorted(view), ['biz', 'foo'])
+    self.assertEqual(view, source)
+    self.assertEqual(repr(view), repr(source))
+
+  def test_copies_top_level(self):
+    source = {'foo': 'bar'}
+    view = CopyOnReadDict(source)
+    view['foo'] = 'biz'
+    view['baz'] = 'biz'
+    del view['foo']
+    self.assertEqual(view, {'baz': 'biz'})
+    self.assertEqual(source, {'foo': 'bar'})
+
+  def test_copies_nested_on_read(self):
+    nested = {'bar': ['biz']}
+    source = {'foo': nested}
+    view = CopyOnReadDict(source)
+    self.assertTrue(view._dict['foo'] is nested)
+
+    value = view['foo']
+    self.assertEqual(value, nested)
+    self.assertFalse(value is nested)
+    self.assertTrue(view['foo'] is value)
+    self.assertTrue(view.get('foo') is value)
+
+    value['bar'].append('baz')
+    self.assertEqual(source, {'foo': {'bar': ['biz']}})
+    self.assertEqual(dict(view.items()), {'foo': {'bar': ['biz', 'baz']}})
+
+  def test_set_values_are_not_copied(self):
+    view = CopyOnReadDict({})
+    value = ['foo']
+    view['foo'] = value
+    view.update(bar=value)
+    self.assertTrue(view['foo'] is value)
+    self.assertTrue(view['bar'] is value)
+
+  def test_share(self):
+    view = CopyOnReadDict({'foo': ['bar']})
+    view['foo'].append('biz')
+    shared = view.share()
+    self.assertEqual(shared, {'foo': ['bar', 'biz']})
+    self.assertTrue(isinstance(shared, dict))
+
+    view['foo'].append('baz')
+    self.assertEqual(shared, {'foo': ['bar', 'biz']})
+    self.assertEqual(view['foo'], ['bar', 'biz', 'baz'])
+
+  def test_copy_values(self):
+    source = {'foo': ['bar'], 'biz': 'baz'}
+    copied = copy_values(source)
+    self.assertEqual(copied, source)
+    self.assertFalse(copied['foo'] is source['foo'])
+    self.assertTrue(copied['biz'] is source['biz'])
+
+
+
+class TestUtilCompactData(unittest.TestCase):
+
+  index = {'foo': 0, 'bar': 1}
+
+  def test_reads_values(self):
+    values = ['biz', missing, None]
+    view = CompactData(values, self.index)
+    self.assertEqual(view['foo'], 'biz')
+    self.assertRaises(KeyError, lambda: view['bar'])
+    self.assertRaises(KeyError, lambda: view['baz'])
+    self.assertEqual(view.get('bar'), None)
+    self.assertTrue('foo' in view)
+    self.assertFalse('bar' in view)
+    self.assertEqual(len(view), 1)
+    self.assertEqual(list(view), ['foo'])
+    self.assertEqual(view, {'foo': 'biz'})
+    self.assertEqual(repr(view), repr({'foo': 'biz'}))
+
+  def test_writes_values(self):
+    values = [missing, missing, None]
+    view = CompactData(values, self.index)
+    view['bar'] = 'biz'
+    view.update({'foo': 1})
+    self.assertEqual(values, [1, 'biz', None])
+    self.assertEqual(view, {'foo': 1, 'bar': 'biz'})
+
+    del view['foo']
+    self.assertEqual(values, [missing, 'biz', None])
+    self.assertRaises(KeyError, view.__delitem__, 'foo')
+
+  def test_other_keys(self):
+    values = [missing, missing, None]
+    view = CompactData(values, self.index)
+    view['baz'] = 'biz'
+    self.assertEqual(values, [missing, missing, {'baz': 'biz'}])
+    self.assertEqual(view, {'baz': 'biz'})
+
+    del view['baz']
+    self.assertEqual(view, {})
+    self.assertRaises(KeyError, view.__delitem__, 'baz')
+
+  def test_copy_returns_dict(self):
+    view = CompactData(['biz', None, None], self.index)
+    copied = view.copy()
+    self.assertTrue(isinstance(copied, dict))
+    self.assertEqual(copied, {'foo': 'biz', 'bar': None})
+
+  def test_missing_is_unique(self):
+    self.assertTrue(copy.copy(missing) is missing)
+    self.assertTrue(copy.deepcopy([missing])[0] is missing)
+    self.assertTrue(pickle.loads(pickle.dumps(missing)) is missing)
+
+
+
 if __name__ == '__main__':
   unittest.main()
@@ -1,3 +1,11 @@
+import sys
+import copy
+import Queue
+import threading
+import collections
+
+from multiprocessing.pool import ThreadPool
+
 
 class classproperty(object):
   '''Implements both @property and @classmethod behavior.'''
@@ -7,3 +15,391 @@ class classproperty(object):
 
   def __get__(self, instance, owner):
     return self.getter(instance) if instance else self.getter(owner)
+
+
+
+def chunks(iterable, size):
+  '''Yields lists of up to `size` consecutive items from `iterable`.'''
+  if size < 1:
+    raise ValueError('chunk size must be positive, not %s' % size)
+
+  chunk = []
+  for item in iterable:
+    chunk.append(item)
+    if len(chunk) == size:
+      yield chunk
+      chunk = []
+
+  if chunk:
+    yield chunk
+
+
+
+def parallel_map(function, iterable, workers, window=None, ordered=True):
+  '''Yields `function(item)` for each item in `iterable`, calling `function`
+  from a pool of `workers` threads.
+
+  At most `window` calls (default: twice the workers) are in flight at once,
+  so `iterable` is consumed only as fast as results are. Results are yielded
+  in input order if `ordered`, or as soon as they are ready otherwise.
+  Exceptions raised by `function` are re-raised to the consumer.
+  '''
+  window = window or 2 * workers
+  pool = ThreadPool(workers)
+  try:
+    if ordered:
+      pending = collections.deque()
+      for item in iterable:
+        pending.append(pool.apply_async(function, (item,)))
+        if len(pending) >= window:
+          yield pending.popleft().get()
+      while pending:
+        yield pending.popleft().get()
+
+    else:
+      done = Queue.Queue()
+      def call(item):
+        try:
+          done.put((function(item), None))
+        except Exception:
+          done.put((None, sys.exc_info()))
+
+      def result():
+        value, exc_info = done.get()
+        if exc_info:
+          raise exc_info[0], exc_info[1], exc_info[2]
+        return value
+
+      pending = 0
+      for item in iterable:
+        pool.apply_async(call, (item,))
+        pending += 1
+        if pending >= window:
+          pending -= 1
+          yield result()
+      while pending:
+        pending -= 1
+        yield result()
+
+  finally:
+    # no join: the threads exit on their own once in-flight calls finish.
+    pool.close()
+
+
+
+def prefetch(iterable, size, pool=None):
+  '''Yields the items of `iterable`, which is iterated in the background
+  (in a thread of `pool`, or a new thread) up to `size` items ahead.
+  Exceptions raised while iterating are re-raised to the consumer.
+  '''
+  done = object()
+  stop = threading.Event()
+  items = Queue.Queue(maxsize=size)
+
+  def offer(item):
+    while not stop.is_set():
+      try:
+        items.put(item, timeout=0.1)
+        return True
+      except Queue.Full:
+        pass
+    return False
+
+  def produce():
+    try:
+      for item in iterable:
+        if not offer((item, None)):
+          return
+      offer((done, None))
+    except Exception:
+      offer((None, sys.exc_info()))
+
+  if pool:
+    pool.apply_async(produce)
+  else:
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+
+  try:
+    while True:
+      item, exc_info = items.get()
+      if exc_info:
+        raise exc_info[0], exc_info[1], exc_info[2]
+      if item is done:
+        return
+      yield item
+  finally:
+    stop.set()
+
+
+
+class LockStripes(object):
+  '''A fixed set of locks, guarding any number of keys.
+
+  `lock(key)` returns the lock for `key`, always the same one for equal keys
+  (keys that are not strings are compared by `str`). Keys may share a lock,
+  so a thread should hold one lock at a time.
+  '''
+
+  def __init__(self, count=64):
+    if count < 1:
+      raise ValueError('lock count must be positive, not %s' % count)
+    self._locks = [threading.Lock() for i in range(count)]
+
+  def lock(self, key):
+    return self._locks[hash(str(key)) % len(self._locks)]
+
+
+
+class CopyOnWriteDict(collections.MutableMapping):
+  '''A read-only view of a dict, which copies the dict upon first mutation.
+
+  Reads go straight to the wrapped dict. The first write makes a shallow
+  copy, so the wrapped dict itself is never modified through the view.
+  '''
+
+  def __init__(self, source):
+    self._dict = source
+    self._owned = False
+
+  @property
+  def copied(self):
+    '''Whether the wrapped dict has been copied (i.e. the view was mutated).'''
+    return self._owned
+
+  def freeze(self):
+    '''Returns the current dict. Further mutation will copy it again.'''
+    self._owned = False
+    return self._dict
+
+  def _writable(self):
+    if not self._owned:
+      self._dict = dict(self._dict)
+      self._owned = True
+    return self._dict
+
+  def __getitem__(self, key):
+    return self._dict[key]
+
+  def __setitem__(self, key, value):
+    self._writable()[key] = value
+
+  def __delitem__(self, key):
+    del self._writable()[key]
+
+  def __contains__(self, key):
+    return key in self._dict
+
+  def __iter__(self):
+    return iter(self._dict)
+
+  def __len__(self):
+    return len(self._dict)
+
+  def __eq__(self, other):
+    if isinstance(other, CopyOnWriteDict):
+      other = other._dict
+    return self._dict == other
+
+  def __ne__(self, other):
+    return not self.__eq__(other)
+
+  def __repr__(self):
+    return repr(self._dict)
+
+  def get(self, key, default=None):
+    return self._dict.get(key, default)
+
+  def update(self, *args, **kwargs):
+    self._writable().update(*args, **kwargs)
+
+  def copy(self):
+    return dict(self._dict)
+
+
+
+# types of values that cannot be modified in place, so need no copying.
+_immutable_types = frozenset([type(None), bool, int, long, float, complex,
+    str, unicode])
+
+
+def copy_values(data):
+  '''Returns a copy of dict `data`, with deep copies of its mutable values.'''
+  return dict((key, value if type(value) in _immutable_types
+      else copy.deepcopy(value)) for key, value in data.iteritems())
+
+
+
+class CopyOnReadDict(collections.MutableMapping):
+  '''A copy of a dict, sharing mutable values with it until they are read.
+
+  The dict itself is copied up front, but its mutable values (like lists and
+  dicts) are deep-copied only the first time they are read. Values cannot be
+  mutated in place without being read first, so this copies nested values on
+  write: those never read are never copied, and those read can be mutated
+  without affecting the source dict.
+  '''
+
+  def __init__(self, source):
+    self._dict = dict(source)
+    self._copied = set()
+
+  def share(self):
+    '''Returns a dict of the current values. They are shared with it from then
+    on, so are copied again when next read.
+    '''
+    self._copied.clear()
+    return dict(self._dict)
+
+  def __getitem__(self, key):
+    value = self._dict[key]
+    if type(value) in _immutable_types or key in self._copied:
+      return value
+
+    value = self._dict[key] = copy.deepcopy(value)
+    self._copied.add(key)
+    return value
+
+  def __setitem__(self, key, value):
+    self._dict[key] = value
+    self._copied.add(key)
+
+  def __delitem__(self, key):
+    del self._dict[key]
+    self._copied.discard(key)
+
+  def __contains__(self, key):
+    return key in self._dict
+
+  def __iter__(self):
+    return iter(self._dict)
+
+  def __len__(self):
+    return len(self._dict)
+
+  def __eq__(self, other):
+    if isinstance(other, CopyOnReadDict):
+      other = other._dict
+    return self._dict == other
+
+  def __ne__(self, other):
+    return not self.__eq__(other)
+
+  def __repr__(self):
+    return repr(self._dict)
+
+  def get(self, key, default=None):
+    if key in self._dict:
+      return self[key]
+    return default
+
+  def update(self, *args, **kwargs):
+    items = dict(*args, **kwargs)
+    self._dict.update(items)
+    self._copied.update(items)
+
+  def copy(self):
+    return dict(self)
+
+
+
+class _Missing(object):
+  '''Type of `missing`.'''
+
+  def __repr__(self):
+    return 'missing'
+
+  # there is only one `missing`, even across copies and pickles.
+  def __copy__(self):
+    return self
+
+  def __deepcopy__(self, memo):
+    return self
+
+  def __reduce__(self):
+    return 'missing'
+
+# marks positions without a value in CompactData lists.
+missing = _Missing()
+
+
+
+class CompactData(collections.MutableMapping):
+  '''A dict-like view of values kept in a list.
+
+  `index` maps each of a fixed set of keys to its position in `values`.
+  Positions holding `missing` are not in the view. Other keys go in a dict
+  kept in the last position of `values` (None until one is set).
+  '''
+
+  def __init__(self, values, index):
+    self._values = values
+    self._index = index
+
+  def __getitem__(self, key):
+    position = self._index.get(key)
+    if position is None:
+      extra = self._values[-1]
+      if extra is None:
+        raise KeyError(key)
+      return extra[key]
+
+    value = self._values[position]
+    if value is missing:
+      raise KeyError(key)
+    return value
+
+  def __setitem__(self, key, value):
+    position = self._index.get(key)
+    if position is not None:
+      self._values[position] = value
+    elif self._values[-1] is None:
+      self._values[-1] = {key: value}
+    else:
+      self._values[-1][key] = value
+
+  def __delitem__(self, key):
+    position = self._index.get(key)
+    if position is None:
+      extra = self._values[-1]
+      if extra is None:
+        raise KeyError(key)
+      del extra[key]
+    elif self._values[position] is missing:
+      raise KeyError(key)
+    else:
+      self._values[position] = missing
+
+  def __iter__(self):
+    values = self._values
+    for key, position in self._index.iteritems():
+      if values[position] is not missing:
+        yield key
+    if values[-1]:
+      for key in values[-1]:
+        yield key
+
+  def __len__(self):
+    return sum(1 for key in self)
+
+  def __repr__(self):
+    return repr(dict(self))
+
+  def update(self, *args, **kwargs):
+    if len(args) == 1 and not kwargs and isinstance(args[0], dict):
+      items = args[0]
+    else:
+      items = dict(*args, **kwargs)
+
+    values = self._values
+    index = self._index
+    for key, value in items.iteritems():
+      position = index.get(key)
+      if position is None:
+        self[key] = value
+      else:
+        values[position] = value
+
+  def copy(self):
+    return dict(self)
@@ -39,6 +39,7 @@ setup(
   packages=packages,
   namespace_packages=['datastore'],
   install_requires=['datastore>=0.3.4'],
+  extras_require={'columns': ['numpy']},
   test_suite='datastore.objects.test',
   classifiers=[
     'Topic :: Database',